@@ -1,21 +1,84 @@
 # api/hydraulic_sim_api.py
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, g, jsonify, request, current_app, stream_with_context
 import os
 import wntr
 import traceback
+import json
 from werkzeug.utils import secure_filename
 import time
+from utils.network_store import NETWORK_STORE, load_network
+from utils.network_registry import HYDRAULIC_NETWORKS, UnknownNetwork, validate_network_id
+from utils.result_cache import run_simulation as run_cached_simulation, run_until_hour
+from utils.result_arrays import rounded_list
+from utils.epanet_stepper import iter_hydraulic_steps
+from utils.sensor_placement import get_placement
+from utils.network_graph import get_network_graph
+from utils.distance_matrix import get_distance_matrix
+from utils.landmarks import query_distances
+from utils.http_cache import cached_json_response
+from utils.skeleton import run_preview_simulation, preview_report, preview_summary
+from utils.gga_solver import solve_snapshot
+from utils.spatial_index import get_spatial_index, parse_viewport_args
+import config
+import numpy as np
+from utils.jobs import JOB_MANAGER
+from api.jobs_api import submit_job, request_flag, request_value, release_network_version
+from utils.binary_format import pack_timeseries, check_variables, DEFAULT_NODE_VARIABLES, DEFAULT_LINK_VARIABLES, MIMETYPE as TIMESERIES_MIMETYPE
 hydraulic_bp = Blueprint('hydraulic', __name__, url_prefix='/api/hydraulic')
 
-# 全局变量存储当前加载的INP文件路径
-CURRENT_INP_FILE = None
-CURRENT_INP_FILENAME = None
+# 不需要指定管网的接口（上传新管网、列出管网）
+NETWORK_INDEPENDENT_ENDPOINTS = ('upload_inp_file', 'list_networks')
+
+def get_networks_dir():
+    """获取存放INP文件的目录（与上传目录一致）"""
+    return HYDRAULIC_NETWORKS.directory
+
+def get_inp_file_path(network_id=None):
+    """获取管网的INP文件路径（network_id为None时使用默认管网，即最近上传的管网）"""
+    return HYDRAULIC_NETWORKS.path(network_id)
+
+@hydraulic_bp.before_request
+def select_network():
+    """确定请求使用的管网（查询参数、表单或JSON中的 network_id，未指定时为默认管网）"""
+    if request.endpoint in tuple(f"{hydraulic_bp.name}.{name}" for name in NETWORK_INDEPENDENT_ENDPOINTS):
+        return None
+    try:
+        g.network_id = HYDRAULIC_NETWORKS.resolve(request_value('network_id'))
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    except UnknownNetwork as e:
+        return jsonify({
+            "success": False,
+            "error": e.args[0]
+        }), 404
+    return None
+
+@hydraulic_bp.route('/networks', methods=['GET'])
+def list_networks():
+    """全部管网（管网目录中的INP文件，模型在第一次使用时加载）"""
+    try:
+        return jsonify({
+            "success": True,
+            "default_network_id": HYDRAULIC_NETWORKS.default_id,
+            "networks": HYDRAULIC_NETWORKS.describe()
+        })
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
 
 @hydraulic_bp.route('/upload-inp', methods=['POST'])
 def upload_inp_file():
-    """上传INP文件并固定命名为Net2.inp"""
-    global CURRENT_INP_FILE, CURRENT_INP_FILENAME
-    
+    """
+    上传INP文件，保存为管网目录中的 <network_id>.inp（已存在时替换），并设为默认管网
+
+    表单字段 network_id 可选，未提供时使用上传文件名（不含扩展名）
+    """
     try:
         # 检查是否有文件被上传
         if 'file' not in request.files:
@@ -40,37 +103,40 @@ def upload_inp_file():
                 "error": "只接受.inp文件"
             }), 400
             
-        # 保存文件，固定命名为Net2.inp
+        # 管网ID：指定的ID，其次为文件名（文件名全部为非ASCII字符时使用默认管网ID）
         original_filename = secure_filename(file.filename)
-        fixed_filename = "Net2.inp"
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        upload_folder = os.path.join(base_dir, 'Water-Hydraulic-Simulation', 'Networks')
-        
-        # 确保上传文件夹存在
-        if not os.path.exists(upload_folder):
-            os.makedirs(upload_folder)
-            
-        file_path = os.path.join(upload_folder, fixed_filename)
-        file.save(file_path)
+        network_id = request_value('network_id')
+        if not network_id:
+            stem = original_filename[:-4] if original_filename.lower().endswith('.inp') else ''
+            network_id = stem or config.DEFAULT_NETWORK_ID
+        try:
+            validate_network_id(network_id)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
         
-        # 尝试加载文件验证其有效性
+        # 先写到临时文件并验证，再整体替换：正在读取旧文件的请求和任务不会读到写了一半的文件，
+        # 上传无效文件时原文件保持不变（内容与已加载文件相同时不会重新解析）
         try:
-            wn = wntr.network.WaterNetworkModel(file_path)
-            # 文件有效，更新全局变量
-            CURRENT_INP_FILE = file_path
-            CURRENT_INP_FILENAME = fixed_filename
+            digest = HYDRAULIC_NETWORKS.save_file(network_id, file.read())
         except Exception as e:
-            # 文件无效，删除并返回错误
-            os.remove(file_path)
             return jsonify({
                 "success": False,
                 "error": f"无效的INP文件: {str(e)}"
             }), 400
+        # 加载时即建立空间索引，视口查询无需等待
+        get_spatial_index(digest)
+        # 之后未指定管网的请求使用刚上传的管网
+        HYDRAULIC_NETWORKS.set_default(network_id)
         
+        file_name = f"{network_id}.inp"
         return jsonify({
             "success": True,
-            "message": "文件上传成功并保存为Net2.inp",
-            "filename": fixed_filename,
+            "message": f"文件上传成功并保存为{file_name}",
+            "network_id": network_id,
+            "filename": file_name,
             "original_filename": original_filename
         })
         
@@ -84,21 +150,45 @@ def upload_inp_file():
 @hydraulic_bp.route('/network-data', methods=['GET'])
 def get_network_data():
     """获取水网络拓扑图数据"""
-    global CURRENT_INP_FILE, CURRENT_INP_FILENAME
-    
     try:
-        if not CURRENT_INP_FILE or not os.path.exists(CURRENT_INP_FILE):
-            return jsonify({
-                "success": False,
-                "error": "未加载INP文件，请先上传"
-            }), 400
-            
-        #network_data = export_network_data(CURRENT_INP_FILE)
-        network_data=export_network_data(after_simulation=False)
+        # 拓扑数据按管网版本预先序列化，前端轮询时未变化则返回304
+        network_id = g.network_id
+        inp_file_path = get_inp_file_path(network_id)
+        digest = NETWORK_STORE.load_file(inp_file_path)
+        file_name = os.path.basename(inp_file_path)
+        return cached_json_response(digest, f"hydraulic-network-data:{network_id}", lambda: {
+            "success": True,
+            "data": export_network_data(network_id, after_simulation=False, digest=digest),
+            "network_id": network_id,
+            "file_name": file_name
+        }, inp_file_path=inp_file_path)
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@hydraulic_bp.route('/network-viewport', methods=['GET'])
+def get_network_viewport():
+    """
+    视口查询：只返回视口内的节点和管段，缩放级别较小时返回网格聚合结果
+
+    查询参数: bbox=minx,miny,maxx,maxy（与 /network-data 相同的0-1归一化坐标）、zoom
+    """
+    try:
+        try:
+            bbox, zoom = parse_viewport_args(request.args)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        digest = NETWORK_STORE.load_file(get_inp_file_path(g.network_id))
         return jsonify({
             "success": True,
-            "data": network_data,
-            "file_name": CURRENT_INP_FILENAME
+            "network_id": g.network_id,
+            "bbox": list(bbox),
+            "zoom": zoom,
+            "data": get_spatial_index(digest).viewport(bbox, zoom)
         })
     except Exception as e:
         print(traceback.format_exc())
@@ -107,28 +197,99 @@ def get_network_data():
             "error": str(e)
         }), 500
 
+def simulation_job(context, file_name=None, preview=False, network_id=None, digest=None):
+    """水力模拟任务（preview为True时在骨架化的管网上快速模拟；digest为提交任务时的管网版本）"""
+    context.set_progress(0.1, "运行EPANET模拟")
+    simulated_network_data = export_network_data(network_id, after_simulation=True, preview=preview, digest=digest)
+    return {
+        "message": "模拟完成",
+        "network_data": simulated_network_data,
+        "network_id": network_id,
+        "file_name": file_name
+    }
+
+def simulation_job_params(params):
+    """水力模拟任务的参数检查：{"network_id": 管网ID, "preview": false}，任务使用检查时的管网版本（固定至任务结束）"""
+    network_id = HYDRAULIC_NETWORKS.resolve(params.get('network_id'))
+    inp_file_path = get_inp_file_path(network_id)
+    digest = NETWORK_STORE.load_file(inp_file_path)
+    # 固定至任务结束（见 release_network_version），排队期间替换INP文件或切换到其他管网时模型不会被淘汰
+    NETWORK_STORE.pin(digest)
+    return {
+        'file_name': os.path.basename(inp_file_path),
+        'preview': bool(params.get('preview')),
+        'network_id': network_id,
+        'digest': digest
+    }
+
+JOB_MANAGER.register('hydraulic_simulate', simulation_job, simulation_job_params, release_network_version)
+
 @hydraulic_bp.route('/simulate', methods=['POST'])
 def run_simulation():
-    """运行水力模拟"""
-    global CURRENT_INP_FILE, CURRENT_INP_FILENAME
-    
+    """运行水力模拟（async=1时立即返回任务ID，否则等待任务完成；preview=1时返回骨架化管网的快速近似结果）"""
     try:
-        if not CURRENT_INP_FILE or not os.path.exists(CURRENT_INP_FILE):
+        # 任务使用提交时的管网版本，排队或运行期间上传新文件不影响结果（见 simulation_job_params）
+        return submit_job('hydraulic_simulate', {'preview': request_flag('preview'), 'network_id': g.network_id})
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"发生异常: {str(e)}")
+        print(error_trace)
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": error_trace
+        }), 500
+
+@hydraulic_bp.route('/simulate/timeseries', methods=['POST'])
+def run_simulation_timeseries():
+    """运行水力模拟，以紧凑二进制格式一次返回全部时间步的结果（格式见 utils/binary_format.py）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        # 模拟前检查变量列表，错误时直接返回400
+        try:
+            node_variables = check_variables('node', data.get('node_variables', DEFAULT_NODE_VARIABLES))
+            link_variables = check_variables('link', data.get('link_variables', DEFAULT_LINK_VARIABLES))
+        except ValueError as e:
             return jsonify({
                 "success": False,
-                "error": "未加载INP文件，请先上传"
+                "error": str(e)
             }), 400
-            
-        simulated_network_data = export_network_data(after_simulation=True)
+        
+        inp_file_path = get_inp_file_path(g.network_id)
+        digest = NETWORK_STORE.load_file(inp_file_path)
+        preview = request_flag('preview')
+        if preview:
+            results = run_preview_simulation(digest, inp_file_path=inp_file_path)
+        else:
+            results = run_cached_simulation(digest, inp_file_path=inp_file_path)
+        payload = pack_timeseries(results, node_variables, link_variables)
+        
+        response = Response(payload, mimetype=TIMESERIES_MIMETYPE)
+        if preview:
+            response.headers['X-Simulation-Preview'] = '1'
+        return response
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"发生异常: {str(e)}")
+        print(error_trace)
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": error_trace
+        }), 500
+
+@hydraulic_bp.route('/simulate/preview-report', methods=['GET'])
+def get_preview_report():
+    """快速预览（骨架化模拟）相对完整模型的误差报告"""
+    try:
+        inp_file_path = get_inp_file_path(g.network_id)
+        digest = NETWORK_STORE.load_file(inp_file_path)
         return jsonify({
             "success": True,
-            "message": "模拟完成",
-            "network_data": simulated_network_data,
-            "file_name": CURRENT_INP_FILENAME
+            "report": preview_report(digest, inp_file_path=inp_file_path)
         })
     except Exception as e:
         error_trace = traceback.format_exc()
-        print(f"发生异常: {str(e)}")
         print(error_trace)
         return jsonify({
             "success": False,
@@ -136,38 +297,82 @@ def run_simulation():
             "traceback": error_trace
         }), 500
 
-def export_network_data(after_simulation=False, hour=0):
+@hydraulic_bp.route('/simulate/stream', methods=['GET', 'POST'])
+def stream_simulation():
+    """
+    流式运行水力模拟，每推进到一个报告时刻就立即返回该时刻的节点/管段结果
+    
+    默认返回NDJSON（每行一个JSON对象）；请求头 Accept 为 text/event-stream 时返回SSE。
+    第一条消息为header（节点和管段ID），之后每个时刻一条frame，最后一条为end。
+    """
+    try:
+        network_id = g.network_id
+        wn = load_network(get_inp_file_path(network_id), copy=False)
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+    
+    use_sse = request.accept_mimetypes.best_match(['application/x-ndjson', 'text/event-stream']) == 'text/event-stream'
+    
+    def encode(message):
+        text = json.dumps(message, ensure_ascii=False)
+        if use_sse:
+            return f"event: {message['type']}\ndata: {text}\n\n"
+        return text + "\n"
+    
+    def generate():
+        frame_count = 0
+        try:
+            for step in iter_hydraulic_steps(wn):
+                if step['type'] == 'frame':
+                    frame_count += 1
+                    step = {
+                        'type': 'frame',
+                        'time': step['time'],
+                        'hour': step['time'] / 3600,
+                        'pressure': rounded_list(step['pressure']),
+                        'head': rounded_list(step['head']),
+                        'demand': rounded_list(step['demand']),
+                        'flow': rounded_list(step['flow']),
+                        'status': ["Open" if value > 0 else "Closed" for value in step['status']],
+                    }
+                yield encode(step)
+            yield encode({'type': 'end', 'frames': frame_count, 'network_id': network_id,
+                          'file_name': f"{network_id}.inp"})
+        except Exception as e:
+            print(traceback.format_exc())
+            yield encode({'type': 'error', 'error': str(e)})
+    
+    mimetype = 'text/event-stream' if use_sse else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def export_network_data(network_id=None, after_simulation=False, hour=0, preview=False, digest=None):
     """
     导出管网数据，用于前端绘制管网拓扑图
     
     参数:
+        network_id (str): 管网ID，默认为默认管网
         after_simulation (bool): 是否导出模拟后的管网数据，默认为False表示导出模拟前的原始数据
         hour (int): 要获取的模拟时间（小时），默认为0表示模拟开始时刻
+        preview (bool): 是否在骨架化的管网上快速模拟（近似结果，见 utils/skeleton.py）
+        digest (str): 要导出的管网版本，默认为INP文件的当前内容
     
     返回:
         dict: 包含nodes和links的字典
             nodes: 所有节点的列表，每个节点包含id、坐标、类型、需求等信息
             links: 所有连接的列表，每个连接包含id、起点id、终点id、类型等信息
     """
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    # 构建inp文件的绝对路径
-    networks_dir = os.path.join(BASE_DIR, 'Water-Hydraulic-Simulation', 'networks')
-    inp_files = [f for f in os.listdir(networks_dir) if f.endswith('.inp')]
-
-    if not inp_files:
-        raise FileNotFoundError(f"在 {networks_dir} 目录下没有找到.inp文件")
-
-    if len(inp_files) > 1:
-        print(f"警告: 在目录下发现多个.inp文件: {inp_files}，将使用第一个文件")
-
-    # 使用找到的第一个.inp文件
-    inp_file_name = inp_files[0]
-    inp_file_path = os.path.join(networks_dir, inp_file_name)
-
+    inp_file_path = get_inp_file_path(network_id)
     print(f"使用的inp文件: {inp_file_path}")
     
-    # 加载水力网络模型
-    wn = wntr.network.WaterNetworkModel(inp_file_path)
+    # 从共享缓存加载水力网络模型（只读，导出过程不修改模型）
+    if digest is None:
+        digest = NETWORK_STORE.load_file(inp_file_path)
+    wn = NETWORK_STORE.get_by_digest(digest, copy=False)
     print(f"加载网络模型: {inp_file_path}")
     
     # 如果需要模拟后的数据，则运行模拟
@@ -177,36 +382,34 @@ def export_network_data(after_simulation=False, hour=0):
     if after_simulation:
         try:
             print("开始运行EPANET模拟...")
-            # 使用EPANET模拟器运行模拟
-            sim = wntr.sim.EpanetSimulator(wn)
-            results = sim.run_sim()
+            # 使用EPANET模拟器运行模拟（相同管网和选项的结果直接从缓存读取）
+            if preview:
+                results = run_preview_simulation(digest, inp_file_path=inp_file_path)
+            else:
+                # 单个时刻优先用进程内的稳态求解器（不支持时返回None），否则延时模拟只运行到该时刻
+                results = solve_snapshot(digest, hour)
+                if results is None:
+                    results = run_until_hour(digest, hour, inp_file_path=inp_file_path)
             print("EPANET模拟完成")
+            print(f"模拟生成了 {len(results.times)} 个时间步")
             
-            # 获取所有时间步
-            time_steps = results.node['pressure'].index
-            print(f"模拟生成了 {len(time_steps)} 个时间步")
-            
-            # 如果指定了hour=0，直接使用第一个时间步
-            if hour == 0:
-                time_step_index = 0
-                current_time = time_steps[time_step_index]
-                print(f"使用第一个时间步（模拟开始时刻）: 索引={time_step_index}, 实际时间={current_time}秒")
-            else:
-                # 查找对应于指定小时的时间步
-                target_time = hour * 3600  # 转换为秒
-                
-                # 查找最接近目标时间的时间步
-                time_differences = [abs(t - target_time) for t in time_steps]
-                time_step_index = time_differences.index(min(time_differences))
-                
-                current_time = time_steps[time_step_index]
-                print(f"找到最接近 {hour} 小时的时间步: 索引={time_step_index}, 实际时间={current_time}秒")
+            # 查找最接近指定小时的时间步（hour=0即模拟开始时刻）
+            time_step_index = results.time_index(hour)
+            current_time = results.times[time_step_index]
+            print(f"找到最接近 {hour} 小时的时间步: 索引={time_step_index}, 实际时间={current_time}秒")
             
         except Exception as e:
             print(f"运行模拟时出错: {str(e)}")
             # 如果模拟失败，返回原始数据
             after_simulation = False
     
+    # 按整行取出指定时间步的结果，下面按元素行号直接索引
+    if after_simulation and results is not None:
+        node_pressure = rounded_list(results.node_row('pressure', time_step_index))
+        node_demand = rounded_list(results.node_row('demand', time_step_index))
+        link_flow = rounded_list(results.link_row('flowrate', time_step_index))
+        link_open = (results.link_row('status', time_step_index) > 0).tolist()
+    
     nodes = []
     links = []
     
@@ -229,34 +432,21 @@ def export_network_data(after_simulation=False, hour=0):
             
             # 如果是模拟后的数据，添加压力和实际水量信息
             if after_simulation and results is not None:
-                try:
-                    # 获取指定时间步的压力数据
-                    pressure = results.node['pressure'].loc[results.node['pressure'].index[time_step_index], node_id]
-                    node_data['pressure'] = round(float(pressure), 10)  # 保留两位小数
-                    node_data['pressure_unit'] = 'm'  # 单位为米
-                    
-                    # 获取指定时间步的实际需水量数据
-                    actual_demand = results.node['demand'].loc[results.node['demand'].index[time_step_index], node_id]
-                    node_data['actual_demand'] = round(float(actual_demand), 10)  # 保留三位小数
-                except Exception as e:
-                    print(f"获取节点 {node_id} 压力/需水量数据时出错: {str(e)}")
-                    node_data['pressure'] = None
-                    node_data['actual_demand'] = None
+                i = results.node_index[node_id]
+                node_data['pressure'] = node_pressure[i]
+                node_data['pressure_unit'] = 'm'  # 单位为米
+                node_data['actual_demand'] = node_demand[i]
         
         elif node.node_type == 'Reservoir':
             node_data['head'] = node.head
             
             # 如果是模拟后的数据，可以添加其他相关信息
             if after_simulation and results is not None:
-                try:
-                    # 水库的压力头
-                    pressure = results.node['pressure'].loc[results.node['pressure'].index[time_step_index], node_id]
-                    node_data['pressure'] = round(float(pressure), 10)  # 保留两位小数
-                    # 水库的出水量
-                    demand = results.node['demand'].loc[results.node['demand'].index[time_step_index], node_id]
-                    node_data['outflow'] = round(float(demand), 10)  # 水库出水为负需水量
-                except Exception as e:
-                    print(f"获取水库 {node_id} 数据时出错: {str(e)}")
+                i = results.node_index[node_id]
+                # 水库的压力头
+                node_data['pressure'] = node_pressure[i]
+                # 水库的出水量
+                node_data['outflow'] = node_demand[i]  # 水库出水为负需水量
         
         elif node.node_type == 'Tank':
             # 模拟前的水箱初始水位
@@ -266,21 +456,12 @@ def export_network_data(after_simulation=False, hour=0):
             
             # 如果是模拟后的数据，添加当前水位信息和流量信息
             if after_simulation and results is not None:
-                try:
-                    # 获取指定时间步的水位数据
-                    pressure = results.node['pressure'].loc[results.node['pressure'].index[time_step_index], node_id]
-                    node_data['pressure'] = round(float(pressure), 10)  # 保留两位小数
-                    node_data['pressure_unit'] = 'm'  # 单位为米
-                    current_level = results.node['pressure'].loc[results.node['pressure'].index[time_step_index], node_id]
-                    node_data['current_level'] = round(float(current_level), 2)
-                    
-                    # 获取水箱的流入/流出量
-                    demand = results.node['demand'].loc[results.node['demand'].index[time_step_index], node_id]
-                    node_data['inflow'] = round(float(demand), 10)  # 水箱流入为负需水量
-                except Exception as e:
-                    print(f"获取水箱 {node_id} 水位/流量数据时出错: {str(e)}")
-                    node_data['current_level'] = None
-                    node_data['inflow'] = None
+                i = results.node_index[node_id]
+                node_data['pressure'] = node_pressure[i]
+                node_data['pressure_unit'] = 'm'  # 单位为米
+                node_data['current_level'] = round(node_pressure[i], 2)
+                # 水箱的流入/流出量
+                node_data['inflow'] = node_demand[i]  # 水箱流入为负需水量
         
         nodes.append(node_data)
     
@@ -302,13 +483,7 @@ def export_network_data(after_simulation=False, hour=0):
             
             # 如果是模拟后的数据，添加流量信息
             if after_simulation and results is not None:
-                try:
-                    # 获取指定时间步的流量数据
-                    flow = results.link['flowrate'].loc[results.link['flowrate'].index[time_step_index], link_id]
-                    link_data['flow'] = round(float(flow), 10)  # 保留三位小数
-                except Exception as e:
-                    print(f"获取管道 {link_id} 流量数据时出错: {str(e)}")
-                    link_data['flow'] = None
+                link_data['flow'] = link_flow[results.link_index[link_id]]
         
         elif link.link_type == 'Pump':
             # 对于模拟前的数据，添加初始开关状态
@@ -316,17 +491,10 @@ def export_network_data(after_simulation=False, hour=0):
             
             # 如果是模拟后的数据，添加当前开关状态和流量
             if after_simulation and results is not None:
-                try:
-                    # 获取指定时间步的状态和流量数据
-                    status = results.link['status'].loc[results.link['status'].index[time_step_index], link_id]
-                    flow = results.link['flowrate'].loc[results.link['flowrate'].index[time_step_index], link_id]
-                    link_data['current_status'] = "Open" if float(status) > 0 else "Closed"
-                    link_data['flow'] = round(float(flow), 10)  # 保留三位小数
-                    link_data['flow_unit'] = 'm^3/s'  # 单位为立方米/秒
-                except Exception as e:
-                    print(f"获取泵 {link_id} 状态/流量数据时出错: {str(e)}")
-                    link_data['current_status'] = None
-                    link_data['flow'] = None
+                i = results.link_index[link_id]
+                link_data['current_status'] = "Open" if link_open[i] else "Closed"
+                link_data['flow'] = link_flow[i]
+                link_data['flow_unit'] = 'm^3/s'  # 单位为立方米/秒
         
         elif link.link_type == 'Valve':
             link_data['diameter'] = link.diameter
@@ -335,17 +503,10 @@ def export_network_data(after_simulation=False, hour=0):
             
             # 如果是模拟后的数据，添加当前开关状态和流量
             if after_simulation and results is not None:
-                try:
-                    # 获取指定时间步的状态和流量数据
-                    status = results.link['status'].loc[results.link['status'].index[time_step_index], link_id]
-                    flow = results.link['flowrate'].loc[results.link['flowrate'].index[time_step_index], link_id]
-                    link_data['current_status'] = "Open" if float(status) > 0 else "Closed"
-                    link_data['flow'] = round(float(flow), 10)  # 保留三位小数
-                    link_data['flow_unit'] = 'm^3/s'  # 单位为立方米/秒
-                except Exception as e:
-                    print(f"获取阀门 {link_id} 状态/流量数据时出错: {str(e)}")
-                    link_data['current_status'] = None
-                    link_data['flow'] = None
+                i = results.link_index[link_id]
+                link_data['current_status'] = "Open" if link_open[i] else "Closed"
+                link_data['flow'] = link_flow[i]
+                link_data['flow_unit'] = 'm^3/s'  # 单位为立方米/秒
         
         links.append(link_data)
     
@@ -376,63 +537,18 @@ def export_network_data(after_simulation=False, hour=0):
     # 打印一些调试信息
     print(f"导出节点数量: {len(nodes)}, 连接数量: {len(links)}")
     
-    return {'nodes': nodes, 'links': links}
+    network_data = {'nodes': nodes, 'links': links}
+    if after_simulation and preview:
+        # 预览结果附带骨架规模和（已计算过的）误差报告
+        network_data['preview'] = preview_summary(digest)
+    return network_data
 @hydraulic_bp.route('/generate-coverage-map', methods=['POST'])
 def generate_coverage_map():
     """生成不同布置点数的覆盖率图"""
     try:
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        networks_dir = os.path.join(BASE_DIR, 'Water-Hydraulic-Simulation', 'networks')
-        inp_files = [f for f in os.listdir(networks_dir) if f.endswith('.inp')]
-
-        if not inp_files:
-            raise FileNotFoundError(f"在 {networks_dir} 目录下没有找到.inp文件")
-
-        if len(inp_files) > 1:
-            print(f"警告: 在目录下发现多个.inp文件: {inp_files}，将使用第一个文件")
-
-        # 使用找到的第一个.inp文件
-        inp_file_name = inp_files[0]
-        inp_file_path = os.path.join(networks_dir, inp_file_name)
-
-        # 加载水力网络模型
-        wn = wntr.network.WaterNetworkModel(inp_file_path)
-        
-        # 构建图结构
-        nodes = []
-        for node_id, node in wn.nodes():
-            print(node_id)
-            nodes.append(node_id)
-        G = {node: [] for node in nodes}
-        for link_id, link in wn.links():
-            start_node = link.start_node_name
-            end_node = link.end_node_name
-            # 使用链接长度作为权重，如果没有长度，则使用默认值1
-            weight = link.length if hasattr(link, 'length') and link.length else 1
-            
-            # 添加双向边
-            G[start_node].append((end_node, weight))
-            G[end_node].append((start_node, weight))
-        
-        # 计算不同布置点数的覆盖率
-        max_points = len(nodes)
-        coverage_data = {}
-        
-        # 初始化已选择的点
-        exist = {node: False for node in nodes}
-        selected_nodes = []
-        
-        # 选择第一个点（可以根据需要选择特定的起始点）
-        start_node = nodes[0]
-        exist[start_node] = True
-        selected_nodes.append(start_node)
-        coverage_data["1"] = calculate_coverage(nodes, G, exist)
-        
-        # 迭代选择剩余的点并计算覆盖率
-        for i in range(2, max_points + 1):
-            next_node = work(nodes, G, exist)
-            coverage_data[str(i)] = calculate_coverage(nodes, G, exist)
-        print(coverage_data)
+        # 贪心布点顺序按管网版本缓存，整条曲线只需为每个新增监测点做一次剪枝的Dijkstra
+        digest = NETWORK_STORE.load_file(get_inp_file_path(g.network_id))
+        coverage_data = get_placement(digest).coverage_curve()
         return jsonify({
             "success": True,
             "message": "覆盖率图生成成功",
@@ -444,82 +560,6 @@ def generate_coverage_map():
             "success": False,
             "error": str(e)
         }), 500
-import heapq
-def work(nodes, G, exist):
-        """
-        寻找未被选择点中到已选择点最短距离最大的点,返回该点标识符
-        """
-        dist = {node: 1e9 for node in nodes}
-        pq = []
-        visited = {node: False for node in nodes}
-        
-        # 初始化已选择的点
-        for node in nodes:
-            if exist[node]:
-                dist[node] = 0
-                heapq.heappush(pq, (dist[node], node))
-        
-        # Dijkstra算法
-        while pq:
-            _, u = heapq.heappop(pq)
-            if visited[u]:
-                continue
-            visited[u] = True
-            
-            for v, w in G[u]:
-                if dist[v] > dist[u] + w:
-                    dist[v] = dist[u] + w
-                    heapq.heappush(pq, (dist[v], v))
-        
-        # 找到未选择点中距离最大的点
-        max_dist = -1
-        max_node = None
-        for node in nodes:
-            if exist[node]:
-                continue
-            if dist[node] > max_dist:
-                max_dist = dist[node]
-                max_node = node
-        
-        exist[max_node] = True
-        return max_node
-def calculate_coverage(nodes, G, exist):
-        """
-        计算覆盖率：(有监测点或相邻有监测点的节点数) / 总节点数
-        """
-        dist = {node: 1e9 for node in nodes}
-        pq = []
-        visited = {node: False for node in nodes}
-        
-        # 初始化已选择的点
-        for node in nodes:
-            if exist[node]:
-                dist[node] = 0
-                heapq.heappush(pq, (dist[node], node))
-        
-        # Dijkstra算法
-        while pq:
-            _, u = heapq.heappop(pq)
-            if visited[u]:
-                continue
-            visited[u] = True
-            
-            for v, w in G[u]:
-                if dist[v] > dist[u] + w:
-                    dist[v] = dist[u] + w
-                    heapq.heappush(pq, (dist[v], v))
-        
-        # 找到未选择点中距离最大的点
-        max_dist = 0
-        max_node = None
-        for node in nodes:
-            if exist[node]:
-                continue
-            if dist[node] > max_dist:
-                max_dist = dist[node]
-                max_node = node
-        
-        return max_dist
 @hydraulic_bp.route('/generate-plan', methods=['POST'])
 def generate_plan():
     """根据指定的布点数生成监测方案"""
@@ -529,27 +569,11 @@ def generate_plan():
         point_count = data.get('point_count', 0)
         network_data = data.get('network_data', None)  # 获取前端传来的网络数据
         
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        networks_dir = os.path.join(BASE_DIR, 'Water-Hydraulic-Simulation', 'networks')
-        inp_files = [f for f in os.listdir(networks_dir) if f.endswith('.inp')]
-
-        if not inp_files:
-            raise FileNotFoundError(f"在 {networks_dir} 目录下没有找到.inp文件")
-
-        # 使用找到的第一个.inp文件
-        inp_file_name = inp_files[0]
-        inp_file_path = os.path.join(networks_dir, inp_file_name)
-
-        # 加载水力网络模型
-        wn = wntr.network.WaterNetworkModel(inp_file_path)
-        
-        # 获取所有节点
-        nodes = []
-        node_coords = {}  # 存储节点坐标
-        for node_id, node in wn.nodes():
-            nodes.append(node_id)
-            # 保存节点坐标
-            node_coords[node_id] = list(node.coordinates) if node.coordinates else [0, 0]
+        # 从共享缓存加载水力网络模型（只读）
+        digest = NETWORK_STORE.load_file(get_inp_file_path(g.network_id))
+        wn = NETWORK_STORE.get_by_digest(digest, copy=False)
+        placement = get_placement(digest)
+        nodes = placement.node_ids
         
         # 验证布点数是否有效
         if point_count <= 0 or point_count > len(nodes):
@@ -557,44 +581,9 @@ def generate_plan():
                 "success": False,
                 "error": f"布点数必须大于0且不超过节点总数({len(nodes)})"
             }), 400
-            
-        # 构建图结构
-        G = {node: [] for node in nodes}
-        links_data = []  # 存储连接信息
-        for link_id, link in wn.links():
-            start_node = link.start_node_name
-            end_node = link.end_node_name
-            weight = link.length if hasattr(link, 'length') and link.length else 1
-            
-            # 添加双向边
-            G[start_node].append((end_node, weight))
-            G[end_node].append((start_node, weight))
-            
-            # 保存连接信息
-            links_data.append({
-                'id': link_id,
-                'source': start_node,
-                'target': end_node
-            })
-        
-        # 初始化已选择的点
-        exist = {node: False for node in nodes}
-        selected_nodes = []
-        
-        # 选择第一个点
-        start_node = nodes[0]
-        exist[start_node] = True
-        selected_nodes.append(start_node)
-        
-        # 迭代选择剩余的点
-        for i in range(1, point_count):
-            next_node = work(nodes, G, exist)
-            if next_node:
-                exist[next_node] = True
-                selected_nodes.append(next_node)
         
-        # 计算覆盖率
-        max_distance = calculate_coverage(nodes, G, exist)
+        # k个监测点的方案是缓存的贪心顺序的前k个
+        selected_nodes, max_distance = placement.plan(point_count)
         
         # 构建方案数据
         plan_data = {
@@ -605,39 +594,66 @@ def generate_plan():
             "detailed_sensors": []
         }
         
+        # 每个传感器的覆盖半径：以该传感器为最近监测点的节点中最远者的距离
+        # （有距离矩阵时查表，否则在拓扑图上做一次多源Dijkstra）
+        graph = get_network_graph(digest)
+        matrix = get_distance_matrix(digest)
+        if matrix is not None:
+            nearest_distance, nearest_sensor = matrix.nearest(selected_nodes)
+        else:
+            sensor_indices = [graph.node_index[node_id] for node_id in selected_nodes]
+            nearest_distance, nearest_node = graph.nearest_source(sensor_indices)
+            position = {index: i for i, index in enumerate(sensor_indices)}
+            nearest_sensor = np.array([position.get(index, 0) for index in nearest_node.tolist()])
+        reachable = np.isfinite(nearest_distance)
+        coverage_radius = np.zeros(len(selected_nodes))
+        np.maximum.at(coverage_radius, nearest_sensor[reachable], nearest_distance[reachable])
+        
         # 添加传感器详细信息
-        for node_id in selected_nodes:
+        for i, node_id in enumerate(selected_nodes):
             node_type = wn.get_node(node_id).node_type
-            # 计算每个传感器覆盖的区域（这里简化为与该节点直接相连的节点）
-            coverage_area = [neighbor for neighbor, _ in G[node_id]]
+            # 计算每个传感器覆盖的区域（默认简化为与该节点直接相连的节点）
+            coverage_area = graph.neighbors(node_id)
             
             sensor_data = {
                 "node_id": node_id,
                 "node_type": node_type,
-                "coverage_area": coverage_area
+                "coverage_area": coverage_area,
+                "coverage_radius": round(float(coverage_radius[i]), 2)  # 单位：m
             }
             plan_data["detailed_sensors"].append(sensor_data)
         
+        # 前端传来的节点坐标，按节点ID建立索引（同一ID出现多次时以第一个为准）
+        frontend_coords = {}
+        if network_data and 'nodes' in network_data:
+            for node in network_data['nodes']:
+                if 'x' in node and 'y' in node:
+                    frontend_coords.setdefault(node['id'], (node['x'], node['y']))
+        
         # 添加网络拓扑数据，用于在弹窗中绘制
+        sensor_set = set(selected_nodes)
         nodes_data = []
         for node_id in nodes:
-            # 从前端传来的数据中获取坐标，如果没有则使用后端计算的坐标
-            x, y = node_coords[node_id]
-            
-            # 如果前端传来了网络数据，优先使用前端的坐标
-            if network_data and 'nodes' in network_data:
-                for node in network_data['nodes']:
-                    if node['id'] == node_id and 'x' in node and 'y' in node:
-                        x, y = node['x'], node['y']
-                        break
+            # 优先使用前端的坐标，没有则使用INP文件中的坐标
+            if node_id in frontend_coords:
+                x, y = frontend_coords[node_id]
+            else:
+                coordinates = wn.get_node(node_id).coordinates
+                x, y = list(coordinates) if coordinates else [0, 0]
             
             nodes_data.append({
                 'id': node_id,
                 'x': x,
                 'y': y,
-                'isSensor': node_id in selected_nodes
+                'isSensor': node_id in sensor_set
             })
         
+        links_data = [{
+            'id': link_id,
+            'source': link.start_node_name,
+            'target': link.end_node_name
+        } for link_id, link in wn.links()]
+        
         # 添加网络拓扑数据到返回结果
         plan_data["network_topology"] = {
             "nodes": nodes_data,
@@ -658,29 +674,89 @@ def generate_plan():
         }), 500
 
 
-def shortest_path_distance(G, start, end):
-    """使用Dijkstra算法计算两点间的最短路径距离"""
-    dist = {node: float('inf') for node in G}
-    dist[start] = 0
-    pq = [(0, start)]
-    visited = set()
-    
-    while pq:
-        d, node = heapq.heappop(pq)
+@hydraulic_bp.route('/distance', methods=['GET'])
+def get_distance():
+    """查询两节点间按管长计的最短路径距离: ?source=节点ID&target=节点ID"""
+    try:
+        source = request.args.get('source')
+        target = request.args.get('target')
+        digest = NETWORK_STORE.load_file(get_inp_file_path(g.network_id))
+        wn = NETWORK_STORE.get_by_digest(digest, copy=False)
+        for node_id in (source, target):
+            if node_id not in wn.node_name_list:
+                return jsonify({
+                    "success": False,
+                    "error": f"节点 {node_id} 不存在"
+                }), 404
+        
+        distance = shortest_path_distance(digest, source, target)
+        return jsonify({
+            "success": True,
+            "source": source,
+            "target": target,
+            "distance": round(distance, 2) if distance != float('inf') else None  # 单位：m，不连通时为null
+        })
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+
+@hydraulic_bp.route('/distances', methods=['POST'])
+def get_distances():
+    """
+    批量查询节点对间按管长计的最短路径距离
+
+    请求JSON: {"pairs": [[起点ID, 终点ID], ...], "include_paths": false}
+    返回与pairs一一对应的距离（单位：m，不连通时为null），include_paths为true时另外返回路径节点ID列表
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        pairs = data.get('pairs')
+        include_paths = bool(data.get('include_paths', False))
+        # 先检查类型：节点ID不是字符串（如列表）时后面的集合查找会出错
+        if not isinstance(pairs, list) or not all(
+                isinstance(pair, list) and len(pair) == 2 and all(isinstance(node_id, str) for node_id in pair)
+                for pair in pairs):
+            return jsonify({
+                "success": False,
+                "error": "pairs 必须是 [起点ID, 终点ID] 的列表，节点ID为字符串"
+            }), 400
+        if len(pairs) > config.DISTANCE_QUERY_MAX_PAIRS:
+            return jsonify({
+                "success": False,
+                "error": f"节点对个数不能超过 {config.DISTANCE_QUERY_MAX_PAIRS}"
+            }), 400
         
-        if node in visited:
-            continue
-            
-        visited.add(node)
+        digest = NETWORK_STORE.load_file(get_inp_file_path(g.network_id))
+        wn = NETWORK_STORE.get_by_digest(digest, copy=False)
+        node_ids = set(wn.node_name_list)
+        unknown = sorted({str(node_id) for pair in pairs for node_id in pair if node_id not in node_ids})
+        if unknown:
+            return jsonify({
+                "success": False,
+                "error": f"节点不存在: {unknown[:20]}"
+            }), 404
         
-        if node == end:
-            return d
-            
-        for neighbor, weight in G[node]:
-            if neighbor not in visited:
-                new_dist = d + weight
-                if new_dist < dist[neighbor]:
-                    dist[neighbor] = new_dist
-                    heapq.heappush(pq, (new_dist, neighbor))
-    
-    return float('inf')
+        distances, paths = query_distances(digest, [tuple(pair) for pair in pairs], include_paths)
+        result = {
+            "success": True,
+            "distances": [round(d, 2) if d != float('inf') else None for d in distances]
+        }
+        if include_paths:
+            result["paths"] = paths
+        return jsonify(result)
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+
+def shortest_path_distance(digest, start, end):
+    """两点间的最短路径距离：有距离矩阵时直接查表，否则用地标索引（地标上下界或A*搜索）"""
+    distances, _ = query_distances(digest, [(start, end)])
+    return distances[0]
@@ -0,0 +1,241 @@
+import math
+import traceback
+
+from flask import Blueprint, jsonify, request, send_file
+from io import BytesIO
+
+import config
+from utils.jobs import JOB_MANAGER, BinaryResult, SUCCEEDED, FAILED, CANCELLED, TIMEOUT
+from utils.network_registry import UnknownNetwork
+from utils.network_store import NETWORK_STORE
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+
+def request_flag(name):
+    """请求中的布尔开关（查询参数 name=1 或JSON中 "name": true）"""
+    if request.args.get(name, '').lower() in ('1', 'true', 'yes'):
+        return True
+    data = request.get_json(silent=True)
+    return isinstance(data, dict) and bool(data.get(name))
+
+
+def request_value(name):
+    """请求中的参数（查询参数、表单字段或JSON中的 "name"），都没有时为None"""
+    value = request.args.get(name) or request.form.get(name)
+    if value is None:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            value = data.get(name)
+    return value
+
+
+def request_params(**values):
+    """请求JSON对象中的参数（请求体不是JSON对象时为空），values 覆盖同名参数"""
+    data = request.get_json(silent=True)
+    return {**(data if isinstance(data, dict) else {}), **values}
+
+
+def wants_async():
+    """请求是否要求异步执行（查询参数 async=1 或JSON中 "async": true）"""
+    return request_flag('async')
+
+
+def check_time_limit(time_limit):
+    """
+    检查请求的任务运行时间上限（秒）
+
+    返回:
+        float: 不超过 config.JOB_TIME_LIMIT 的时间上限，未指定时为None（使用默认值）
+
+    不是有限正数时抛出ValueError
+    """
+    if time_limit is None:
+        return None
+    if isinstance(time_limit, bool) or not isinstance(time_limit, (int, float)) \
+            or not math.isfinite(time_limit) or time_limit <= 0:
+        raise ValueError("time_limit 必须是正数（秒）")
+    return min(float(time_limit), config.JOB_TIME_LIMIT)
+
+
+def query_time_limit():
+    """查询参数 time_limit（秒），不是数值时原样返回，由 check_time_limit 报错"""
+    value = request.args.get('time_limit')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return value
+
+
+def prepare_job(kind, request_params, time_limit=None):
+    """
+    检查任务参数（见 JobManager.prepare）和运行时间上限
+
+    返回:
+        tuple: (任务函数的参数, 时间上限, None)，参数错误时为 (None, None, 错误响应)
+    """
+    try:
+        # 先检查时间上限：prepare 可能固定管网版本，之后不能再出错
+        time_limit = check_time_limit(time_limit)
+        return JOB_MANAGER.prepare(kind, request_params), time_limit, None
+    except ValueError as e:
+        return None, None, (jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400)
+    except UnknownNetwork as e:
+        return None, None, (jsonify({
+            "success": False,
+            "error": e.args[0]
+        }), 404)
+
+
+def release_network_version(params):
+    """任务结束后解除对管网版本的固定（prepare 中调用 NETWORK_STORE.pin(digest)）"""
+    NETWORK_STORE.unpin(params['digest'])
+
+
+def submit_job(kind, request_params):
+    """
+    检查参数后提交任务：异步请求立即返回任务信息（202），否则等待任务结束并返回结果
+
+    参数:
+        kind (str): 任务类型
+        request_params (dict): 客户端参数，由任务类型注册的检查函数转换为任务函数的参数
+
+    运行时间上限可通过查询参数 time_limit（秒）指定，不超过 config.JOB_TIME_LIMIT
+    """
+    params, time_limit, error = prepare_job(kind, request_params, query_time_limit())
+    if error:
+        return error
+    job = JOB_MANAGER.submit(kind, params, time_limit=time_limit)
+    if wants_async():
+        return jsonify({
+            "success": True,
+            "job": job.to_dict()
+        }), 202
+    job.wait()
+    return job_result_response(job)
+
+
+def job_result_response(job):
+    """将已结束任务的结果转换为HTTP响应"""
+    if job.status == SUCCEEDED:
+        if isinstance(job.result, BinaryResult):
+            return send_file(
+                BytesIO(job.result.data),
+                mimetype=job.result.mimetype,
+                as_attachment=False,
+                download_name=job.result.download_name
+            )
+        return jsonify({"success": True, **job.result})
+
+    status_codes = {FAILED: 500, CANCELLED: 409, TIMEOUT: 504}
+    body = {
+        "success": False,
+        "error": job.error,
+        "job": job.to_dict()
+    }
+    if job.traceback:
+        body["traceback"] = job.traceback
+    return jsonify(body), status_codes.get(job.status, 500)
+
+
+@jobs_bp.route('', methods=['GET'])
+def list_jobs():
+    """列出最近的任务"""
+    return jsonify({
+        "success": True,
+        "kinds": JOB_MANAGER.kinds,
+        "jobs": [job.to_dict() for job in JOB_MANAGER.list()]
+    })
+
+
+@jobs_bp.route('', methods=['POST'])
+def create_job():
+    """
+    提交任务: {"kind": 任务类型, "params": {...}, "time_limit": 秒}
+
+    params 与该类型任务对应接口的请求参数相同（包括 network_id），经过同样的检查
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        kind = data.get('kind')
+        if kind not in JOB_MANAGER.kinds:
+            return jsonify({
+                "success": False,
+                "error": f"未知的任务类型: {kind}，可选: {JOB_MANAGER.kinds}"
+            }), 400
+
+        params, time_limit, error = prepare_job(kind, data.get('params') or {}, data.get('time_limit'))
+        if error:
+            return error
+
+        job = JOB_MANAGER.submit(kind, params, time_limit=time_limit)
+        return jsonify({
+            "success": True,
+            "job": job.to_dict()
+        }), 202
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"提交任务时出错: {str(e)}")
+        print(error_trace)
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": error_trace
+        }), 500
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询任务状态和进度"""
+    job = JOB_MANAGER.get(job_id)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": f"任务 {job_id} 不存在"
+        }), 404
+    return jsonify({
+        "success": True,
+        "job": job.to_dict()
+    })
+
+
+@jobs_bp.route('/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """获取任务结果，任务未结束时返回202和当前状态"""
+    job = JOB_MANAGER.get(job_id)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": f"任务 {job_id} 不存在"
+        }), 404
+    if not job.finished:
+        return jsonify({
+            "success": True,
+            "job": job.to_dict()
+        }), 202
+    return job_result_response(job)
+
+
+@jobs_bp.route('/<job_id>/cancel', methods=['POST'])
+@jobs_bp.route('/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """取消任务"""
+    job = JOB_MANAGER.get(job_id)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": f"任务 {job_id} 不存在"
+        }), 404
+    if not JOB_MANAGER.cancel(job_id):
+        return jsonify({
+            "success": False,
+            "error": f"任务已结束，状态为 {job.status}",
+            "job": job.to_dict()
+        }), 409
+    return jsonify({
+        "success": True,
+        "job": job.to_dict()
+    })
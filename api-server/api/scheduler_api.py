@@ -1,11 +1,27 @@
 # api/scheduler_api.py
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, g, jsonify, request
 import wntr
 import os
-import random
-import csv
 import matplotlib.pyplot as plt
 import tempfile
+import threading
+from utils.network_store import NETWORK_STORE
+from utils.network_registry import SCHEDULER_NETWORKS, UnknownNetwork
+from utils.result_cache import run_simulation as run_cached_simulation, run_until_hour, invalidate_results
+from utils.result_arrays import rounded_list
+from utils.http_cache import cached_json_response
+from utils.skeleton import run_preview_simulation, preview_report, preview_summary
+from utils.gga_solver import solve_snapshot
+from utils.spatial_index import get_spatial_index, parse_viewport_args
+from utils.jobs import JOB_MANAGER, BinaryResult
+from api.jobs_api import submit_job, request_flag, request_params, request_value, release_network_version
+from utils.scenarios import run_scenarios, validate_scenario
+from utils.demand_import import read_demand_csv
+from utils.monte_carlo import run_monte_carlo, sample_demands, normalize_spec, DEFAULT_DISTRIBUTION, DEFAULT_PERCENTILES
+import numpy as np
+from pandas.errors import EmptyDataError, ParserError
+import config
+from utils.binary_format import pack_timeseries, check_variables, DEFAULT_NODE_VARIABLES, DEFAULT_LINK_VARIABLES, MIMETYPE as TIMESERIES_MIMETYPE
 # 如果已经有蓝图定义，使用现有的，否则创建新的
 # 假设您现有的文件可能已经有一些代码和变量
 water_plant_ids = ['1','8']
@@ -14,15 +30,106 @@ try:
 except NameError:
     scheduler_routes = Blueprint('scheduler_routes', __name__)
 
+# 调度算法脚本（Water-Scheduling/src/cal.py）及其神经网络模型针对该管网训练，只能调度该管网
+SCHEDULING_ALGORITHM_NETWORK_ID = 'Net2'
+
+@scheduler_routes.before_request
+def select_network():
+    """确定请求使用的管网（查询参数、表单或JSON中的 network_id，未指定时为默认管网）"""
+    if request.endpoint == f"{scheduler_routes.name}.list_networks":
+        return None
+    try:
+        g.network_id = SCHEDULER_NETWORKS.resolve(request_value('network_id'))
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    except UnknownNetwork as e:
+        return jsonify({
+            "success": False,
+            "error": e.args[0]
+        }), 404
+    return None
+
+def get_inp_file_path(network_id):
+    """获取调度模块管网的INP文件路径"""
+    return SCHEDULER_NETWORKS.path(network_id)
+
+def get_network_session(network_id):
+    """调度模块管网的编辑会话（需水量、管段修改先记录在内存和修改日志中，见 utils/network_session.py）"""
+    return SCHEDULER_NETWORKS.session(network_id)
+
+def current_digest(network_id):
+    """调度模块管网当前版本（INP文件加上未保存的修改）的哈希，模型在 NETWORK_STORE 中按需构建"""
+    return get_network_session(network_id).digest()
+
+def pin_current_digest(network_id):
+    """固定管网当前版本并返回其哈希（用于任务，任务结束后由 release_network_version 解除固定）"""
+    digest = current_digest(network_id)
+    NETWORK_STORE.pin(digest)
+    return digest
+
+@scheduler_routes.route('/networks', methods=['GET'])
+def list_networks():
+    """调度模块的全部管网（管网目录中的INP文件，模型在第一次使用时加载）"""
+    try:
+        return jsonify({
+            "success": True,
+            "default_network_id": SCHEDULER_NETWORKS.default_id,
+            "networks": SCHEDULER_NETWORKS.describe()
+        })
+    except Exception as e:
+        import traceback
+        print(traceback.format_exc())
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
 # 添加网络数据路由
 @scheduler_routes.route('/network/data', methods=['GET'])
 def get_network_data():
     """获取水网络拓扑图数据"""
     try:
-        network_data = export_network_data()
+        # 拓扑数据按管网版本预先序列化，前端轮询时未变化则返回304
+        network_id = g.network_id
+        session = get_network_session(network_id)
+        digest = session.digest()
+        # 有未保存的修改时，INP文件的修改时间不代表当前版本，只按ETag校验
+        return cached_json_response(digest, f"scheduler-network-data:{network_id}", lambda: {
+            "success": True,
+            "network_id": network_id,
+            "data": export_network_data(network_id, digest=digest)
+        }, inp_file_path=None if session.has_edits() else session.inp_file_path)
+    except Exception as e:
+        import traceback
+        print(traceback.format_exc())
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@scheduler_routes.route('/network/viewport', methods=['GET'])
+def get_network_viewport():
+    """
+    视口查询：只返回视口内的节点和管段，缩放级别较小时返回网格聚合结果
+
+    查询参数: bbox=minx,miny,maxx,maxy（与 /network/data 相同的0-1归一化坐标）、zoom
+    """
+    try:
+        try:
+            bbox, zoom = parse_viewport_args(request.args)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        digest = current_digest(g.network_id)
         return jsonify({
             "success": True,
-            "data": network_data
+            "network_id": g.network_id,
+            "bbox": list(bbox),
+            "zoom": zoom,
+            "data": get_spatial_index(digest).viewport(bbox, zoom)
         })
     except Exception as e:
         import traceback
@@ -32,16 +139,56 @@ def get_network_data():
             "error": str(e)
         }), 500
 
+def get_water_scheduling_dir():
+    """获取 Water-Scheduling 目录的绝对路径（调度算法脚本的工作目录）"""
+    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(BASE_DIR, 'Water-Scheduling')
+
+def scheduler_job(context, preview=False, network_id=SCHEDULING_ALGORITHM_NETWORK_ID):
+    """调度任务：运行调度算法脚本后模拟调度后的管网（preview为True时在骨架化的管网上快速模拟）"""
+    import sys
+    
+    water_scheduling_dir = get_water_scheduling_dir()
+    # 调用 cal.py 脚本，设置工作目录为 Water-Scheduling
+    # 注意这里使用相对路径 ./src/cal.py，与您手动运行的方式一致
+    context.set_progress(0.05, "运行调度算法")
+    # 调度脚本读取INP文件，先写回未保存的修改
+    old_digest = get_network_session(network_id).save()
+    result = context.run_subprocess([sys.executable, "./src/cal.py"], cwd=water_scheduling_dir)
+    
+    print(f"脚本退出码: {result.returncode}")
+    print(f"标准输出: {result.stdout[:200]}..." if result.stdout else "无标准输出")
+    print(f"错误输出: {result.stderr}" if result.stderr else "无错误输出")
+    
+    if result.returncode != 0:
+        raise RuntimeError(f"计算脚本执行失败: {result.stderr}")
+    # 调度脚本会改写Net2.inp，删除旧版本管网的模拟结果缓存
+    invalidate_results(old_digest)
+    
+    context.set_progress(0.7, "运行EPANET模拟")
+    simulated_network_data = export_network_data(network_id, after_simulation=True, preview=preview)
+    return {
+        "message": "模拟完成",
+        "network_id": network_id,
+        "network_data": simulated_network_data  # 返回模拟后的网络数据
+    }
+
+def scheduler_job_params(params):
+    """调度任务的参数检查：{"network_id": 管网ID, "preview": false}"""
+    network_id = SCHEDULER_NETWORKS.resolve(params.get('network_id'))
+    if network_id != SCHEDULING_ALGORITHM_NETWORK_ID:
+        raise ValueError(f"调度算法只支持管网 {SCHEDULING_ALGORITHM_NETWORK_ID}")
+    return {'preview': bool(params.get('preview')), 'network_id': network_id}
+
+JOB_MANAGER.register('scheduler_simulate', scheduler_job, scheduler_job_params)
+
 # 添加模拟路由
 @scheduler_routes.route('/network/simulate', methods=['POST'])
 def run_scheduler():
-    """运行调度算法"""
+    """运行调度算法（async=1时立即返回任务ID，否则等待任务完成；preview=1时调度后的管网在骨架上快速模拟）"""
     try:
-        # 获取项目根目录路径
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        
         # 构建 Water-Scheduling 目录的绝对路径
-        water_scheduling_dir = os.path.join(BASE_DIR, 'Water-Scheduling')
+        water_scheduling_dir = get_water_scheduling_dir()
         print(f"Water-Scheduling 目录: {water_scheduling_dir}")
         
         # 确保目录存在
@@ -51,33 +198,68 @@ def run_scheduler():
                 "error": f"目录不存在: {water_scheduling_dir}"
             }), 404
         
-        # 使用 subprocess 调用 cal.py 脚本，设置工作目录为 Water-Scheduling
-        import subprocess
-        import sys
-        
-        # 注意这里使用相对路径 ./src/cal.py，与您手动运行的方式一致
-        result = subprocess.run(
-            [sys.executable, "./src/cal.py"], 
-            capture_output=True, 
-            text=True,
-            cwd=water_scheduling_dir  # 关键：设置工作目录为 Water-Scheduling
-        )
-        
-        print(f"脚本退出码: {result.returncode}")
-        print(f"标准输出: {result.stdout[:200]}..." if result.stdout else "无标准输出")
-        print(f"错误输出: {result.stderr}" if result.stderr else "无错误输出")
-        
-        if result.returncode != 0:
-            return jsonify({
-                "success": False,
-                "error": f"计算脚本执行失败: {result.stderr}"
-            }), 500
-        simulated_network_data = export_network_data(after_simulation=True)
+        # 只支持调度算法对应的管网（见 scheduler_job_params）
+        return submit_job('scheduler_simulate', {'preview': request_flag('preview'), 'network_id': g.network_id})
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"发生异常: {str(e)}")
+        print(error_trace)
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": error_trace
+        }), 500
+
+@scheduler_routes.route('/network/simulate/preview-report', methods=['GET'])
+def get_preview_report():
+    """快速预览（骨架化模拟）相对完整模型的误差报告"""
+    try:
+        inp_file_path = get_inp_file_path(g.network_id)
+        digest = current_digest(g.network_id)
         return jsonify({
             "success": True,
-            "message": "模拟完成",
-             "network_data": simulated_network_data  # 返回模拟后的网络数据
+            "network_id": g.network_id,
+            "report": preview_report(digest, inp_file_path=inp_file_path)
         })
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(error_trace)
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": error_trace
+        }), 500
+
+@scheduler_routes.route('/network/simulate/timeseries', methods=['POST'])
+def simulate_timeseries():
+    """模拟当前管网，以紧凑二进制格式一次返回全部时间步的结果（格式见 utils/binary_format.py）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        # 模拟前检查变量列表，错误时直接返回400
+        try:
+            node_variables = check_variables('node', data.get('node_variables', DEFAULT_NODE_VARIABLES))
+            link_variables = check_variables('link', data.get('link_variables', DEFAULT_LINK_VARIABLES))
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
+        
+        inp_file_path = get_inp_file_path(g.network_id)
+        digest = current_digest(g.network_id)
+        preview = request_flag('preview')
+        if preview:
+            results = run_preview_simulation(digest, inp_file_path=inp_file_path)
+        else:
+            results = run_cached_simulation(digest, inp_file_path=inp_file_path)
+        payload = pack_timeseries(results, node_variables, link_variables)
+        
+        response = Response(payload, mimetype=TIMESERIES_MIMETYPE)
+        if preview:
+            response.headers['X-Simulation-Preview'] = '1'
+        return response
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
@@ -89,25 +271,39 @@ def run_scheduler():
             "traceback": error_trace
         }), 500
 
-def export_network_data(after_simulation=False, hour=0):
+def export_network_data(network_id, after_simulation=False, hour=0, preview=False, digest=None):
     """
     导出管网数据，用于前端绘制管网拓扑图
     
     参数:
+        network_id (str): 管网ID
         after_simulation (bool): 是否导出模拟后的管网数据，默认为False表示导出模拟前的原始数据
         hour (int): 要获取的模拟时间（小时），默认为0表示模拟开始时刻
+        preview (bool): 是否在骨架化的管网上快速模拟（近似结果，见 utils/skeleton.py）
+        digest (str): 要导出的管网版本，默认为当前版本（修改后导出修改得到的版本，不受之后的修改影响）
     
     返回:
         dict: 包含nodes和links的字典
             nodes: 所有节点的列表，每个节点包含id、坐标、类型、需求等信息
             links: 所有连接的列表，每个连接包含id、起点id、终点id、类型等信息
     """
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    # 构建inp文件的绝对路径
-    inp_file_path = os.path.join(BASE_DIR,'Water-Scheduling', 'networks', 'Net2.inp')
+    inp_file_path = get_inp_file_path(network_id)
     
-    # 加载水力网络模型
-    wn = wntr.network.WaterNetworkModel(inp_file_path)
+    # 从共享缓存加载水力网络模型（只读，导出过程不修改模型）
+    session = get_network_session(network_id)
+    if digest is None:
+        digest = session.digest()
+    version = session.version(digest)
+    if version is not None and version.has_edits():
+        # 编辑会话中的版本：基础模型加上修改，不构建该版本的完整模型
+        wn = NETWORK_STORE.get_by_digest(version.base_digest, copy=False)
+        demand_overrides = version.edited_demands()
+        status_overrides = {link_id: wntr.network.LinkStatus[status.capitalize()]
+                            for link_id, status in version.edited_statuses().items()}
+        setting_overrides = version.edited_settings()
+    else:
+        wn = NETWORK_STORE.get_by_digest(digest, copy=False)
+        demand_overrides, status_overrides, setting_overrides = {}, {}, {}
     print(f"加载网络模型: {inp_file_path}")
     
     # 如果需要模拟后的数据，则运行模拟
@@ -117,23 +313,20 @@ def export_network_data(after_simulation=False, hour=0):
     if after_simulation:
         try:
             print("开始运行EPANET模拟...")
-            # 使用EPANET模拟器运行模拟
-            sim = wntr.sim.EpanetSimulator(wn)
-            results = sim.run_sim()
+            # 使用EPANET模拟器运行模拟（相同管网和选项的结果直接从缓存读取）
+            if preview:
+                results = run_preview_simulation(digest, inp_file_path=inp_file_path)
+            else:
+                # 单个时刻优先用进程内的稳态求解器（不支持时返回None），否则延时模拟只运行到该时刻
+                results = solve_snapshot(digest, hour)
+                if results is None:
+                    results = run_until_hour(digest, hour, inp_file_path=inp_file_path)
             print("EPANET模拟完成")
+            print(f"模拟生成了 {len(results.times)} 个时间步")
             
-            # 获取所有时间步
-            time_steps = results.node['pressure'].index
-            print(f"模拟生成了 {len(time_steps)} 个时间步")
-            
-            # 查找对应于指定小时的时间步
-            target_time = hour * 3600  # 转换为秒
-            
-            # 查找最接近目标时间的时间步
-            time_differences = [abs(t - target_time) for t in time_steps]
-            time_step_index = time_differences.index(min(time_differences))
-            
-            current_time = time_steps[time_step_index]
+            # 查找最接近指定小时的时间步
+            time_step_index = results.time_index(hour)
+            current_time = results.times[time_step_index]
             print(f"找到最接近 {hour} 小时的时间步: 索引={time_step_index}, 实际时间={current_time}秒")
             
         except Exception as e:
@@ -141,6 +334,14 @@ def export_network_data(after_simulation=False, hour=0):
             # 如果模拟失败，返回原始数据
             after_simulation = False
     
+    # 按整行取出指定时间步的结果，下面按元素行号直接索引
+    if after_simulation and results is not None:
+        node_pressure = rounded_list(results.node_row('pressure', time_step_index))
+        node_demand = rounded_list(results.node_row('demand', time_step_index))
+        node_head = rounded_list(results.node_row('head', time_step_index), 2)
+        link_flow = rounded_list(results.link_row('flowrate', time_step_index))
+        link_open = (results.link_row('status', time_step_index) > 0).tolist()
+    
     nodes = []
     links = []
     
@@ -158,64 +359,39 @@ def export_network_data(after_simulation=False, hour=0):
         if node.node_type == 'Junction':
             # 对于模拟前的数据，添加基本需水量
             if not after_simulation:
-                node_data['base_demand'] = round(float(node.base_demand),10)
+                node_data['base_demand'] = round(float(demand_overrides.get(node_id, node.base_demand)),10)
                 node_data['demand_unit'] = 'm^3/s'  # 单位为立方米/秒
             
             # 如果是模拟后的数据，添加压力和实际水量信息
             if after_simulation and results is not None:
-                try:
-                    # 获取指定时间步的压力数据
-                    pressure = results.node['pressure'].loc[results.node['pressure'].index[time_step_index], node_id]
-                    node_data['pressure'] = round(float(pressure), 10)  # 保留两位小数
-                    node_data['pressure_unit'] = 'm'  # 单位为米
-                    
-                    # 获取指定时间步的实际需水量数据
-                    actual_demand = results.node['demand'].loc[results.node['demand'].index[time_step_index], node_id]
-                    node_data['actual_demand'] = round(float(actual_demand), 10)  # 保留三位小数
-                except Exception as e:
-                    print(f"获取节点 {node_id} 压力/需水量数据时出错: {str(e)}")
-                    node_data['pressure'] = None
-                    node_data['actual_demand'] = None
+                i = results.node_index[node_id]
+                node_data['pressure'] = node_pressure[i]
+                node_data['pressure_unit'] = 'm'  # 单位为米
+                node_data['actual_demand'] = node_demand[i]
         
         elif node.node_type == 'Reservoir':
             node_data['head'] = node.head
             
             # 如果是模拟后的数据，可以添加其他相关信息
             if after_simulation and results is not None:
-                try:
-                    # 水库的压力头
-                    head = results.node['head'].loc[results.node['head'].index[time_step_index], node_id]
-                    node_data['current_head'] = round(float(head), 2)
-                    # 水库的出水量
-                    demand = results.node['demand'].loc[results.node['demand'].index[time_step_index], node_id]
-                    node_data['outflow'] = round(float(demand), 10)  # 水库出水为负需水量
-                except Exception as e:
-                    print(f"获取水库 {node_id} 数据时出错: {str(e)}")
+                i = results.node_index[node_id]
+                # 水库的压力头
+                node_data['current_head'] = node_head[i]
+                # 水库的出水量
+                node_data['outflow'] = node_demand[i]  # 水库出水为负需水量
         
         elif node.node_type == 'Tank':
             # 模拟前的水箱初始水位
             node_data['level'] = node.level
             node_data['max_level'] = node.max_level
             node_data['min_level'] = node.min_level
-            print("dsad",node_data['level'])
-            # 如果是模拟后的数据，添加当前水位信息和流量信息
+            # 如果是模拟后的数据，添加压力信息和流量信息
             if after_simulation and results is not None:
-                try:
-                    # 获取指定时间步的水位数据
-                    #current_level = results.node['level'].loc[results.node['level'].index[time_step_index], node_id]
-                    #node_data['current_level'] = round(float(current_level), 10)
-                    #print("dsad",node_data['current_level'])
-                    # 获取水箱的流入/流出量
-                    pressure = results.node['pressure'].loc[results.node['pressure'].index[time_step_index], node_id]
-                    node_data['pressure'] = round(float(pressure), 10)  # 保留两位小数
-                    node_data['pressure_unit'] = 'm'  # 单位为米
-                    demand = results.node['demand'].loc[results.node['demand'].index[time_step_index], node_id]
-                    node_data['inflow'] = round(float(demand), 10)  # 水箱流入为负需水量
-                    print(demand)
-                except Exception as e:
-                    print(f"获取水箱 {node_id} 水位/流量数据时出错: {str(e)}")
-                    node_data['current_level'] = None
-                    node_data['inflow'] = None
+                i = results.node_index[node_id]
+                node_data['pressure'] = node_pressure[i]
+                node_data['pressure_unit'] = 'm'  # 单位为米
+                # 水箱的流入/流出量
+                node_data['inflow'] = node_demand[i]  # 水箱流入为负需水量
         
         nodes.append(node_data)
     
@@ -233,54 +409,33 @@ def export_network_data(after_simulation=False, hour=0):
         if link.link_type == 'Pipe':
             link_data['length'] = link.length
             link_data['diameter'] = link.diameter
-            link_data['roughness'] = link.roughness
-            print(link.diameter)
+            link_data['roughness'] = setting_overrides.get(link_id, link.roughness)
             # 如果是模拟后的数据，添加流量信息
             if after_simulation and results is not None:
-                try:
-                    # 获取指定时间步的流量数据
-                    flow = results.link['flowrate'].loc[results.link['flowrate'].index[time_step_index], link_id]
-                    link_data['flow'] = round(float(flow), 10)  # 保留三位小数
-                except Exception as e:
-                    print(f"获取管道 {link_id} 流量数据时出错: {str(e)}")
-                    link_data['flow'] = None
+                link_data['flow'] = link_flow[results.link_index[link_id]]
         
         elif link.link_type == 'Pump':
             # 对于模拟前的数据，添加初始开关状态
-            link_data['initial_status'] = link.initial_status
+            link_data['initial_status'] = status_overrides.get(link_id, link.initial_status)
             
             # 如果是模拟后的数据，添加当前开关状态和流量
             if after_simulation and results is not None:
-                try:
-                    # 获取指定时间步的状态和流量数据
-                    status = results.link['status'].loc[results.link['status'].index[time_step_index], link_id]
-                    flow = results.link['flowrate'].loc[results.link['flowrate'].index[time_step_index], link_id]
-                    link_data['current_status'] = "Open" if float(status) > 0 else "Closed"
-                    link_data['flow'] = round(float(flow), 10)  # 保留三位小数
-                    link_data['flow_unit'] = 'm^3/s'  # 单位为立方米/秒
-                except Exception as e:
-                    print(f"获取泵 {link_id} 状态/流量数据时出错: {str(e)}")
-                    link_data['current_status'] = None
-                    link_data['flow'] = None
+                i = results.link_index[link_id]
+                link_data['current_status'] = "Open" if link_open[i] else "Closed"
+                link_data['flow'] = link_flow[i]
+                link_data['flow_unit'] = 'm^3/s'  # 单位为立方米/秒
         
         elif link.link_type == 'Valve':
             link_data['diameter'] = link.diameter
             # 对于模拟前的数据，添加初始开关状态
-            link_data['initial_status'] = link.initial_status
+            link_data['initial_status'] = status_overrides.get(link_id, link.initial_status)
             
             # 如果是模拟后的数据，添加当前开关状态和流量
             if after_simulation and results is not None:
-                try:
-                    # 获取指定时间步的状态和流量数据
-                    status = results.link['status'].loc[results.link['status'].index[time_step_index], link_id]
-                    flow = results.link['flowrate'].loc[results.link['flowrate'].index[time_step_index], link_id]
-                    link_data['current_status'] = "Open" if float(status) > 0 else "Closed"
-                    link_data['flow'] = round(float(flow), 10)  # 保留三位小数
-                    link_data['flow_unit'] = 'm^3/s'  # 单位为立方米/秒
-                except Exception as e:
-                    print(f"获取阀门 {link_id} 状态/流量数据时出错: {str(e)}")
-                    link_data['current_status'] = None
-                    link_data['flow'] = None
+                i = results.link_index[link_id]
+                link_data['current_status'] = "Open" if link_open[i] else "Closed"
+                link_data['flow'] = link_flow[i]
+                link_data['flow_unit'] = 'm^3/s'  # 单位为立方米/秒
         
         links.append(link_data)
     
@@ -311,30 +466,193 @@ def export_network_data(after_simulation=False, hour=0):
     # 打印一些调试信息
     print(f"导出节点数量: {len(nodes)}, 连接数量: {len(links)}")
     
-    return {'nodes': nodes, 'links': links}
-from io import StringIO
+    network_data = {'nodes': nodes, 'links': links}
+    if after_simulation and preview:
+        # 预览结果附带骨架规模和（已计算过的）误差报告
+        network_data['preview'] = preview_summary(digest)
+    return network_data
+
+def batch_simulate_job(context, scenarios, include_arrays=False, network_id=None, digest=None):
+    """批量情景任务：在模拟进程池中并行模拟各情景，结果经共享内存汇总（digest为提交任务时的管网版本）"""
+    inp_file_path = get_inp_file_path(network_id)
+    if digest is None:
+        digest = current_digest(network_id)
+
+    def report(done, total):
+        context.check()
+        context.set_progress(done / total, f"已完成 {done}/{total} 个情景")
+
+    batch = run_scenarios(digest, scenarios, include_arrays=include_arrays,
+                          inp_file_path=inp_file_path, callback=report)
+    result = {
+        "node_ids": batch['node_ids'],
+        "link_ids": batch['link_ids'],
+        "times": batch['times'].tolist(),
+        "scenarios": batch['summaries']
+    }
+    if include_arrays:
+        # 形状为 [情景][元素][时间步]
+        result["arrays"] = {name: rounded_list(values) for name, values in batch['arrays'].items()}
+    return result
+
+def batch_simulate_job_params(params):
+    """批量情景任务的参数检查（格式见 batch_simulate），任务使用检查时的管网版本（固定至任务结束）"""
+    scenarios = params.get('scenarios')
+    if not isinstance(scenarios, list) or len(scenarios) == 0:
+        raise ValueError("请提供非空的情景列表 scenarios")
+    if len(scenarios) > config.BATCH_MAX_SCENARIOS:
+        raise ValueError(f"情景个数不能超过 {config.BATCH_MAX_SCENARIOS}")
+    
+    # 只检查元素ID和水箱参数，基础模型即可
+    network_id = SCHEDULER_NETWORKS.resolve(params.get('network_id'))
+    wn = get_network_session(network_id).base_model()
+    for index, scenario in enumerate(scenarios):
+        try:
+            validate_scenario(wn, scenario)
+        except ValueError as e:
+            raise ValueError(f"第 {index} 个情景: {str(e)}")
+    return {
+        'scenarios': scenarios,
+        'include_arrays': bool(params.get('include_arrays', False)),
+        'network_id': network_id,
+        'digest': pin_current_digest(network_id)
+    }
+
+JOB_MANAGER.register('batch_simulate', batch_simulate_job, batch_simulate_job_params, release_network_version)
+
+@scheduler_routes.route('/network/batch-simulate', methods=['POST'])
+def batch_simulate():
+    """
+    批量情景模拟
+
+    请求JSON: {"scenarios": [{"name": ..., "demands": {节点ID: 需水量}, "pump_status": {水泵ID: "OPEN"/"CLOSED"},
+              "tank_levels": {水池ID: 初始水位}}, ...], "include_arrays": false}
+    返回每个情景的最小/最大压力和流量，include_arrays为true时另外返回完整时间序列
+    （async=1时立即返回任务ID）
+    """
+    try:
+        # 提交任务前检查情景，错误时直接返回400（见 batch_simulate_job_params）；
+        # 任务使用提交时的管网版本，运行期间的修改不影响结果
+        return submit_job('batch_simulate', request_params(network_id=g.network_id))
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"批量情景模拟时出错: {str(e)}")
+        print(error_trace)
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": error_trace
+        }), 500
+
+def monte_carlo_job(context, distributions, samples, seed, pressure_floor, percentiles, hour, network_id=None,
+                    digest=None):
+    """蒙特卡洛任务：按分布规格抽样需水量并并行求解，统计各节点的压力分布（digest为提交任务时的管网版本）"""
+    inp_file_path = get_inp_file_path(network_id)
+    if digest is None:
+        digest = current_digest(network_id)
+
+    def report(done, total):
+        context.check()
+        context.set_progress(done / total, f"已完成 {done}/{total} 批样本")
+
+    analysis = run_monte_carlo(digest, distributions, samples, seed=seed, pressure_floor=pressure_floor,
+                               percentiles=percentiles, hour=hour, inp_file_path=inp_file_path, callback=report)
+    return {
+        "node_ids": analysis['node_ids'],
+        "sampled_junctions": analysis['sampled_junctions'],
+        "percentiles": {p: rounded_list(values, 4) for p, values in analysis['percentiles'].items()},
+        "mean": rounded_list(analysis['mean'], 4),
+        "violation_probability": rounded_list(analysis['violation_probability'], 6),
+        "pressure_floor": pressure_floor,
+        "samples": analysis['samples'],
+        "failed_samples": analysis['failed_samples'],
+        "seed": seed,
+        "time": analysis['target_time']
+    }
+
+def monte_carlo_job_params(params):
+    """蒙特卡洛任务的参数检查（格式见 monte_carlo），任务使用检查时的管网版本（固定至任务结束）"""
+    distributions = params.get('distributions') or {'default': DEFAULT_DISTRIBUTION}
+    samples = params.get('samples', 1000)
+    seed = params.get('seed')
+    pressure_floor = params.get('pressure_floor', 20.0)
+    percentiles = params.get('percentiles', list(DEFAULT_PERCENTILES))
+    hour = params.get('hour')
+    
+    if not isinstance(samples, int) or not 1 <= samples <= config.MONTE_CARLO_MAX_SAMPLES:
+        raise ValueError(f"samples 必须是1到{config.MONTE_CARLO_MAX_SAMPLES}之间的整数")
+    if seed is not None and (not isinstance(seed, int) or seed < 0):
+        raise ValueError("seed 必须是非负整数")
+    if not isinstance(pressure_floor, (int, float)):
+        raise ValueError("pressure_floor 必须是数值")
+    if not isinstance(percentiles, list) or not all(isinstance(p, (int, float)) and 0 <= p <= 100 for p in percentiles):
+        raise ValueError("percentiles 必须是0到100之间的数值列表")
+    if hour is not None and (not isinstance(hour, (int, float)) or hour < 0):
+        raise ValueError("hour 必须是非负数值")
+    network_id = SCHEDULER_NETWORKS.resolve(params.get('network_id'))
+    normalize_spec(get_network_session(network_id).base_model(), distributions)
+    
+    return {
+        'distributions': distributions,
+        'samples': samples,
+        'seed': seed,
+        'pressure_floor': float(pressure_floor),
+        'percentiles': percentiles,
+        'hour': hour,
+        'network_id': network_id,
+        'digest': pin_current_digest(network_id)
+    }
+
+JOB_MANAGER.register('monte_carlo', monte_carlo_job, monte_carlo_job_params, release_network_version)
+
+@scheduler_routes.route('/network/monte-carlo', methods=['POST'])
+def monte_carlo():
+    """
+    需水量不确定性的蒙特卡洛分析（格式见 utils/monte_carlo.py）
+
+    请求JSON: {"distributions": {"default": 分布, "classes": {类别: 分布}, "junctions": {节点ID: 分布}},
+              "samples": 1000, "seed": 0, "pressure_floor": 20, "percentiles": [5, 50, 95], "hour": null}
+    返回各用户节点的压力分位数和低于压力下限的概率（async=1时立即返回任务ID）
+    """
+    try:
+        # 提交任务前检查参数，错误时直接返回400（见 monte_carlo_job_params）
+        return submit_job('monte_carlo', request_params(network_id=g.network_id))
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"蒙特卡洛分析时出错: {str(e)}")
+        print(error_trace)
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": error_trace
+        }), 500
+
 @scheduler_routes.route('/network/generate-random', methods=['POST'])
 def generate_random_demands():
     """为所有节点生成随机需水量"""
     try:
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        inp_file_path = os.path.join(BASE_DIR, 'Water-Scheduling', 'networks', 'Net2.inp')
-        
-        # 加载水力网络模型
-        wn = wntr.network.WaterNetworkModel(inp_file_path)
-        
-        # 为每个节点生成随机需水量
-        for node_id, node in wn.nodes():
-            if node.node_type == 'Junction':
-                # 生成0.001到0.01之间的随机需水量(单位:立方米/秒)
-                random_demand = round(random.uniform(0, 0.01), 10)
-                print(random_demand)
-                node.demand_timeseries_list[0].base_value = random_demand
-        
-        # 保存修改后的模型
-        wntr.network.io.write_inpfile(wn,inp_file_path)
+        session = get_network_session(g.network_id)
+        
+        # 可选的分布规格和随机种子，格式同蒙特卡洛分析（默认为0到0.01之间的均匀分布，单位:立方米/秒）
+        data = request.get_json(silent=True) or {}
+        spec = data.get('distributions') or {'default': DEFAULT_DISTRIBUTION}
+        
+        # 当前版本的水力网络模型（只读，修改记录在编辑会话中）
+        wn = NETWORK_STORE.get_by_digest(session.digest(), copy=False)
+        
+        # 为每个节点生成随机需水量（抽取一个样本）
+        try:
+            junction_ids, demands = sample_demands(wn, spec, 1, data.get('seed'))
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
+        digest = session.set_demands(dict(zip(junction_ids, np.round(demands[0], 10).tolist())))
         # 返回更新后的网络数据
-        network_data = export_network_data()
+        network_data = export_network_data(g.network_id, digest=digest)
         
         return jsonify({
             "success": True,
@@ -376,73 +694,42 @@ def import_demands():
                 "error": "请上传CSV文件"
             }), 400
         
-        # 读取CSV文件内容
-        file_content = file.read().decode('utf-8')
-        csv_data = list(csv.reader(StringIO(file_content)))
-        
-        # 验证CSV格式
-        if len(csv_data) == 0:
+        # 流式解析CSV，按当前管网的用户节点哈希索引向量化检查（见 utils/demand_import.py）
+        session = get_network_session(g.network_id)
+        try:
+            demand_import = read_demand_csv(file.stream, session.junction_index())
+        except EmptyDataError:
             return jsonify({
                 "success": False,
                 "error": "CSV文件为空"
             }), 400
-            
-        # 加载水力网络模型
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        inp_file_path = os.path.join(BASE_DIR, 'Water-Scheduling', 'networks', 'Net2.inp')
-        wn = wntr.network.WaterNetworkModel(inp_file_path)
-        
-        # 更新节点需水量
-        updated_nodes = []
-        errors = []
-        
-        for row_index, row in enumerate(csv_data, 1):
-            # 检查行格式
-            if len(row) < 2:
-                errors.append(f"第{row_index}行格式错误: 列数不足")
-                continue
-                
-            node_id = row[0].strip()
-            
-            # 检查需水量是否为数字
-            try:
-                demand = float(row[1].strip())
-            except ValueError:
-                errors.append(f"第{row_index}行格式错误: '{row[1]}' 不是有效数字")
-                continue
-            
-            # 检查节点是否存在且为Junction类型
-            if node_id not in wn.node_name_list:
-                errors.append(f"节点 '{node_id}' 不存在")
-                continue
-                
-            if wn.nodes[node_id].node_type != 'Junction':
-                errors.append(f"节点 '{node_id}' 不是Junction类型，无法设置需水量")
-                continue
-            
-            # 更新节点需水量
-            wn.nodes[node_id].demand_timeseries_list[0].base_value = demand
-            updated_nodes.append(node_id)
+        except (ParserError, UnicodeDecodeError, ValueError) as e:
+            return jsonify({
+                "success": False,
+                "error": f"CSV文件格式错误: {str(e)}"
+            }), 400
+        updated_nodes = demand_import.node_ids
         
         # 检查是否有任何节点被更新
         if not updated_nodes:
             return jsonify({
                 "success": False,
-                "error": "没有任何节点被更新" + (f"，错误: {'; '.join(errors)}" if errors else "")
+                "error": "没有任何节点被更新",
+                "errors": demand_import.error_table()
             }), 400
         
-        # 保存修改后的模型
-        wntr.network.io.write_inpfile(wn, inp_file_path)
+        # 一次性写入编辑会话（只追加修改日志，INP文件在后台合并写回，见 utils/network_session.py）
+        digest = session.set_demand_values(demand_import.positions, demand_import.values)
         
-        # 返回更新后的网络数据
-        network_data = export_network_data()
+        # 返回更新后的网络数据（本次修改得到的版本，不受并发修改影响）
+        network_data = export_network_data(g.network_id, digest=digest)
         
         # 如果有错误但也有成功更新的节点，返回部分成功信息
-        if errors:
+        if demand_import.error_count:
             return jsonify({
                 "success": True,
-                "message": f"已更新{len(updated_nodes)}个节点，但有{len(errors)}个错误",
-                "errors": errors,
+                "message": f"已更新{len(updated_nodes)}个节点，但有{demand_import.error_count}个错误",
+                "errors": demand_import.error_table(),
                 "updated_nodes": updated_nodes,
                 "data": network_data
             })
@@ -481,32 +768,22 @@ def update_node_demand():
         node_id = data['node_id']
         demand = float(data['demand'])
         
-        # 加载水力网络模型
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        inp_file_path = os.path.join(BASE_DIR, 'Water-Scheduling', 'networks', 'Net2.inp')
-        wn = wntr.network.WaterNetworkModel(inp_file_path)
-        
-        # 检查节点是否存在且是Junction类型
-        if node_id not in wn.node_name_list:
+        # 更新需水量（只记录在编辑会话中，不立即改写INP文件；会话检查节点是否存在且是Junction类型）
+        try:
+            digest = get_network_session(g.network_id).set_demand(node_id, demand)
+        except KeyError as e:
             return jsonify({
                 "success": False,
-                "error": f"节点 {node_id} 不存在"
+                "error": e.args[0]
             }), 404
-            
-        if wn.nodes[node_id].node_type != 'Junction':
+        except ValueError as e:
             return jsonify({
                 "success": False,
-                "error": f"节点 {node_id} 不是Junction类型，无法设置需水量"
+                "error": str(e)
             }), 400
-            
-        # 更新需水量
-        wn.nodes[node_id].demand_timeseries_list[0].base_value = demand
-        
-        # 保存修改后的模型
-        wntr.network.io.write_inpfile(wn,inp_file_path)
         
         # 返回更新后的网络数据
-        network_data = export_network_data()
+        network_data = export_network_data(g.network_id, digest=digest)
         
         return jsonify({
             "success": True,
@@ -529,44 +806,138 @@ def update_node_demand():
             "traceback": error_trace
         }), 500
     
-@scheduler_routes.route('/network/heatmap', methods=['POST'])
-def generate_heatmap():
-    """生成网络压力或流量的热力图，并显示节点ID"""
+# 4. 修改管段状态/设定值
+@scheduler_routes.route('/network/update-link', methods=['POST'])
+def update_link():
+    """
+    修改管段的初始状态和/或设定值（只记录在编辑会话中）
+
+    请求JSON: {"link_id": ..., "status": "OPEN"/"CLOSED", "setting": 数值}，status和setting至少提供一个；
+    setting对管道为粗糙系数，对水泵为转速比，对阀门为阀门设定值（国际单位）
+    """
     try:
-        # 导入必要的库并设置 matplotlib 为非交互模式
-        import matplotlib
-        matplotlib.use('Agg')  # 设置为非交互式后端
+        data = request.get_json(silent=True) or {}
+        link_id = data.get('link_id')
+        if link_id is None or (data.get('status') is None and data.get('setting') is None):
+            return jsonify({
+                "success": False,
+                "error": "请提供管段ID以及状态或设定值"
+            }), 400
         
-        # 尝试使用不同的方式设置字体
         try:
-            # 方法1：使用系统可用字体
-            import matplotlib.font_manager as fm
-            font_path = fm.findfont(fm.FontProperties(family=['sans-serif']))
-            prop = fm.FontProperties(fname=font_path)
-            matplotlib.rcParams['font.family'] = prop.get_name()
-        except:
-            # 方法2：如果上面失败，尝试使用基本设置
-            matplotlib.rcParams['font.sans-serif'] = ['Arial', 'DejaVu Sans', 'Bitstream Vera Sans']
-        
-        import matplotlib.pyplot as plt
-        plt.ioff()  # 关闭交互模式
-        from flask import send_file
-        from io import BytesIO
-        
-        # 获取请求中的网络数据
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        inp_file_path = os.path.join(BASE_DIR, 'Water-Scheduling', 'networks', 'Net2.inp')
-        
-        # 使用WNTR加载网络
-        wn = wntr.network.WaterNetworkModel(inp_file_path)
-        
-        # 运行水力模拟
-        sim = wntr.sim.EpanetSimulator(wn)
-        results = sim.run_sim()
-        
-        # 获取压力结果 - 0小时的压力（第一个时间步）
-        pressure = results.node['pressure'].iloc[0]
+            digest = get_network_session(g.network_id).set_link(link_id, status=data.get('status'), setting=data.get('setting'))
+        except KeyError as e:
+            return jsonify({
+                "success": False,
+                "error": e.args[0]
+            }), 404
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
         
+        return jsonify({
+            "success": True,
+            "message": f"已更新管段 {link_id}",
+            "data": export_network_data(g.network_id, digest=digest)
+        })
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"更新管段时出错: {str(e)}")
+        print(error_trace)
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": error_trace
+        }), 500
+
+# 5. 保存/放弃未保存的修改
+@scheduler_routes.route('/network/save', methods=['POST'])
+def save_network():
+    """把编辑会话中未保存的修改写回INP文件"""
+    try:
+        session = get_network_session(g.network_id)
+        had_edits = session.has_edits()
+        session.save()
+        return jsonify({
+            "success": True,
+            "message": "已保存管网修改" if had_edits else "没有未保存的修改"
+        })
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"保存管网时出错: {str(e)}")
+        print(error_trace)
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": error_trace
+        }), 500
+
+@scheduler_routes.route('/network/discard', methods=['POST'])
+def discard_network_edits():
+    """丢弃编辑会话中未保存的修改，恢复为INP文件中的管网"""
+    try:
+        get_network_session(g.network_id).discard()
+        return jsonify({
+            "success": True,
+            "message": "已丢弃未保存的修改",
+            "data": export_network_data(g.network_id)
+        })
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"丢弃管网修改时出错: {str(e)}")
+        print(error_trace)
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": error_trace
+        }), 500
+
+# pyplot的全局状态不是线程安全的，任务线程中绘图需要加锁
+_PLOT_LOCK = threading.Lock()
+
+def heatmap_job(context, network_id=None, digest=None):
+    """热力图任务：生成网络压力热力图PNG，并显示节点ID"""
+    # 导入必要的库并设置 matplotlib 为非交互模式
+    import matplotlib
+    matplotlib.use('Agg')  # 设置为非交互式后端
+    
+    # 尝试使用不同的方式设置字体
+    try:
+        # 方法1：使用系统可用字体
+        import matplotlib.font_manager as fm
+        font_path = fm.findfont(fm.FontProperties(family=['sans-serif']))
+        prop = fm.FontProperties(fname=font_path)
+        matplotlib.rcParams['font.family'] = prop.get_name()
+    except:
+        # 方法2：如果上面失败，尝试使用基本设置
+        matplotlib.rcParams['font.sans-serif'] = ['Arial', 'DejaVu Sans', 'Bitstream Vera Sans']
+    
+    import matplotlib.pyplot as plt
+    plt.ioff()  # 关闭交互模式
+    from io import BytesIO
+    
+    # 获取请求中的网络数据
+    inp_file_path = get_inp_file_path(network_id)
+    
+    # 使用WNTR加载提交任务时的管网版本（只读）
+    if digest is None:
+        digest = current_digest(network_id)
+    wn = NETWORK_STORE.get_by_digest(digest, copy=False)
+    
+    # 运行水力模拟（相同管网的结果直接从缓存读取）
+    context.set_progress(0.1, "运行EPANET模拟")
+    results = run_cached_simulation(digest, inp_file_path=inp_file_path)
+    
+    # 获取压力结果 - 0小时的压力（第一个时间步）
+    pressure = results.node_series('pressure', 0)
+    
+    context.set_progress(0.5, "绘制热力图")
+    with _PLOT_LOCK:
         # 创建图形
         plt.figure(figsize=(8, 7))
         
@@ -594,17 +965,22 @@ def generate_heatmap():
         # 将图像保存到内存中
         img_buffer = BytesIO()
         plt.savefig(img_buffer, format='png', dpi=200, bbox_inches='tight')
-        img_buffer.seek(0)
         plt.close('all')
-        
-        # 直接返回图像数据
-        return send_file(
-            img_buffer,
-            mimetype='image/png',
-            as_attachment=False,
-            download_name='network_heatmap.png'
-        )
     
+    return BinaryResult(img_buffer.getvalue(), 'image/png', 'network_heatmap.png')
+
+def heatmap_job_params(params):
+    """热力图任务的参数检查：{"network_id": 管网ID}，任务使用检查时的管网版本（固定至任务结束）"""
+    network_id = SCHEDULER_NETWORKS.resolve(params.get('network_id'))
+    return {'network_id': network_id, 'digest': pin_current_digest(network_id)}
+
+JOB_MANAGER.register('heatmap', heatmap_job, heatmap_job_params, release_network_version)
+
+@scheduler_routes.route('/network/heatmap', methods=['POST'])
+def generate_heatmap():
+    """生成网络压力热力图（async=1时立即返回任务ID，否则等待任务完成并直接返回图像）"""
+    try:
+        return submit_job('heatmap', {'network_id': g.network_id})
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
@@ -4,9 +4,12 @@ from flask_cors import CORS
 from api.water_forecast_api import file_upload_routes
 from api.scheduler_api import scheduler_routes
 from api.hydraulic_sim_api import hydraulic_bp  # 导入新的水力模拟API蓝图
+from api.jobs_api import jobs_bp  # 异步任务API蓝图
+from utils.response_encoding import init_app as init_response_encoding
 
 app = Flask(__name__)
 CORS(app)  # 启用CORS支持
+init_response_encoding(app)  # 共用的响应编码层（快速JSON、MessagePack、压缩）
 
 # 添加根路由
 @app.route('/')
@@ -15,11 +18,31 @@ def index():
         "message": "Welcome to Intelligent Water Utility System API",
         "available_endpoints": [
             "/api/files/upload",
+            "/api/scheduler/networks",
             "/api/scheduler/network/data",
+            "/api/scheduler/network/viewport",
             "/api/scheduler/network/simulate",
+            "/api/scheduler/network/simulate/timeseries",
+            "/api/scheduler/network/simulate/preview-report",
+            "/api/scheduler/network/batch-simulate",
+            "/api/scheduler/network/monte-carlo",
+            "/api/scheduler/network/update-link",
+            "/api/scheduler/network/save",
+            "/api/scheduler/network/discard",
+            "/api/hydraulic/networks",
             "/api/hydraulic/upload-inp",  # 添加新的端点
             "/api/hydraulic/network-data",
-            "/api/hydraulic/simulate"
+            "/api/hydraulic/network-viewport",
+            "/api/hydraulic/simulate",
+            "/api/hydraulic/simulate/timeseries",
+            "/api/hydraulic/simulate/preview-report",
+            "/api/hydraulic/simulate/stream",
+            "/api/hydraulic/distance",
+            "/api/hydraulic/distances",
+            "/api/jobs",
+            "/api/jobs/<job_id>",
+            "/api/jobs/<job_id>/result",
+            "/api/jobs/<job_id>/cancel"
         ]
     })
 
@@ -27,6 +50,7 @@ def index():
 app.register_blueprint(file_upload_routes, url_prefix='/api/files')
 app.register_blueprint(scheduler_routes, url_prefix='/api/scheduler')
 app.register_blueprint(hydraulic_bp)  # 注册水力模拟API蓝图
+app.register_blueprint(jobs_bp)  # 注册异步任务API蓝图
 
 if __name__ == '__main__':
     print("已注册的路由:")
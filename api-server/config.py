@@ -0,0 +1,83 @@
+import os
+import tempfile
+
+# 管网模型缓存的内存上限（字节），超出后按LRU淘汰，可通过环境变量覆盖
+NETWORK_STORE_MAX_BYTES = int(os.environ.get('NETWORK_STORE_MAX_BYTES', 256 * 1024 * 1024))
+
+# 模拟结果缓存：进程内缓存的结果个数和内存上限（字节，多个管网共用，按LRU淘汰），以及多进程共享的磁盘缓存目录和文件个数上限
+SIM_CACHE_MEMORY_ENTRIES = int(os.environ.get('SIM_CACHE_MEMORY_ENTRIES', 8))
+SIM_CACHE_MEMORY_BYTES = int(os.environ.get('SIM_CACHE_MEMORY_BYTES', 256 * 1024 * 1024))
+SIM_CACHE_DIR = os.environ.get('SIM_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'water-utility-sim-cache'))
+SIM_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('SIM_CACHE_DISK_MAX_ENTRIES', 64))
+
+# 异步任务：工作线程数、默认运行时间上限（秒）、保留的已结束任务个数
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_TIME_LIMIT = float(os.environ.get('JOB_TIME_LIMIT', 600))
+JOB_HISTORY_SIZE = int(os.environ.get('JOB_HISTORY_SIZE', 200))
+
+# 管网INP文件所在目录（水力模拟、调度模块各一个），目录中的每个INP文件是一个管网，管网ID为文件名（不含扩展名）；
+# 请求未指定 network_id 时使用的默认管网；模拟进程池启动时只预加载这些ID的管网，其余管网在第一次使用时加载
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HYDRAULIC_NETWORK_DIR = os.environ.get('HYDRAULIC_NETWORK_DIR', os.path.join(BASE_DIR, 'Water-Hydraulic-Simulation', 'Networks'))
+SCHEDULER_NETWORK_DIR = os.environ.get('SCHEDULER_NETWORK_DIR', os.path.join(BASE_DIR, 'Water-Scheduling', 'networks'))
+NETWORK_DIRS = [HYDRAULIC_NETWORK_DIR, SCHEDULER_NETWORK_DIR]
+DEFAULT_NETWORK_ID = os.environ.get('DEFAULT_NETWORK_ID', 'Net2')
+NETWORK_PRELOAD_IDS = [i for i in os.environ.get('NETWORK_PRELOAD_IDS', DEFAULT_NETWORK_ID).split(',') if i]
+
+# EPANET模拟进程池：工作进程数（0表示在请求进程内模拟）、临时文件根目录（优先使用tmpfs）、单次模拟超时（秒）
+SIM_POOL_WORKERS = int(os.environ.get('SIM_POOL_WORKERS', min(4, os.cpu_count() or 1)))
+SIM_SCRATCH_DIR = os.environ.get('SIM_SCRATCH_DIR', '/dev/shm' if os.access('/dev/shm', os.W_OK) else tempfile.gettempdir())
+SIM_POOL_TIMEOUT = float(os.environ.get('SIM_POOL_TIMEOUT', 600))
+
+# 批量情景模拟：单次请求的情景个数上限
+BATCH_MAX_SCENARIOS = int(os.environ.get('BATCH_MAX_SCENARIOS', 1000))
+
+# 蒙特卡洛需水量不确定性分析：单次请求的样本数上限
+MONTE_CARLO_MAX_SAMPLES = int(os.environ.get('MONTE_CARLO_MAX_SAMPLES', 20000))
+
+# 全节点对距离矩阵：节点数上限（float32矩阵占 节点数²×4 字节）、磁盘目录和文件个数上限
+DISTANCE_MATRIX_MAX_NODES = int(os.environ.get('DISTANCE_MATRIX_MAX_NODES', 5000))
+DISTANCE_CACHE_DIR = os.environ.get('DISTANCE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'water-utility-distance-cache'))
+DISTANCE_CACHE_MAX_FILES = int(os.environ.get('DISTANCE_CACHE_MAX_FILES', 16))
+
+# 地标距离索引：地标个数；批量距离查询单次请求的节点对个数上限
+LANDMARK_COUNT = int(os.environ.get('LANDMARK_COUNT', 24))
+DISTANCE_QUERY_MAX_PAIRS = int(os.environ.get('DISTANCE_QUERY_MAX_PAIRS', 20000))
+
+# 响应压缩：小于该字节数的响应不压缩；gzip压缩级别和brotli质量（越高越慢）
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', 5))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', 5))
+
+# 视口查询：缩放级别上限；达到该级别或视口内元素数不超过上限时返回元素明细，否则按网格聚合；
+# 缩放级别为0时整个管网划分为 网格数×网格数 个格子
+VIEWPORT_MAX_ZOOM = int(os.environ.get('VIEWPORT_MAX_ZOOM', 20))
+VIEWPORT_DETAIL_ZOOM = int(os.environ.get('VIEWPORT_DETAIL_ZOOM', 6))
+VIEWPORT_MAX_ELEMENTS = int(os.environ.get('VIEWPORT_MAX_ELEMENTS', 5000))
+VIEWPORT_GRID_SIZE = int(os.environ.get('VIEWPORT_GRID_SIZE', 64))
+
+# 快速预览：骨架化时可合并、裁剪的管道直径上限（m，默认12英寸），误差报告中列出的压力误差最大节点数
+SKELETON_DIAMETER_THRESHOLD = float(os.environ.get('SKELETON_DIAMETER_THRESHOLD', 0.3048))
+SKELETON_REPORT_WORST_NODES = int(os.environ.get('SKELETON_REPORT_WORST_NODES', 10))
+
+# 单时刻查询（如0时刻的管网状态）优先使用进程内的GGA稳态求解器，不支持的管网自动退回EPANET模拟
+SNAPSHOT_SOLVER_ENABLED = os.environ.get('SNAPSHOT_SOLVER_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+# 管网编辑会话：未保存的修改追加写入INP文件旁的日志（<INP路径>.wal，重启后重放）；是否每次写入后fsync；
+# 最后一次修改后等待多少秒在后台把修改合并写回INP文件（0表示只在显式保存时写回）
+# 注意：编辑会话和日志只属于一个进程，编辑请求必须由单个进程处理（多个WSGI工作进程同时编辑同一管网会丢失修改，
+# 见 utils/network_session.py）
+NETWORK_WAL_FSYNC = os.environ.get('NETWORK_WAL_FSYNC', '1').lower() not in ('0', 'false', 'no')
+NETWORK_COMPACT_DELAY = float(os.environ.get('NETWORK_COMPACT_DELAY', 30))
+
+# 批量导入需水量：CSV每次解析的行数；返回的行级错误条数上限
+DEMAND_IMPORT_CHUNK_ROWS = int(os.environ.get('DEMAND_IMPORT_CHUNK_ROWS', 100000))
+DEMAND_IMPORT_MAX_ERRORS = int(os.environ.get('DEMAND_IMPORT_MAX_ERRORS', 200))
+
+# 管网版本：修改数组每块的元素个数（生成新版本时只复制被修改的块）；编辑会话保留的最近版本数
+# （正在运行的模拟和任务使用的旧版本在此范围内可以随时重新构建）
+NETWORK_VERSION_CHUNK = int(os.environ.get('NETWORK_VERSION_CHUNK', 4096))
+NETWORK_VERSION_HISTORY = int(os.environ.get('NETWORK_VERSION_HISTORY', 64))
+
+# 多管网：同时保持打开的EPANET工具箱项目（编辑会话的进程内求解）个数上限，超出后关闭最久未使用的项目
+NETWORK_MAX_OPEN_TOOLKITS = int(os.environ.get('NETWORK_MAX_OPEN_TOOLKITS', 4))
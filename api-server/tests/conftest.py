@@ -0,0 +1,40 @@
+"""
+测试环境
+
+在导入 config 之前设置环境变量：模拟在测试进程内运行，缓存目录和管网目录都指向临时目录
+（管网目录为仓库中INP文件的副本，测试中的修改不会写回仓库），EPANET临时文件也写在临时目录中。
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+API_SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_ROOT = tempfile.mkdtemp(prefix='water-utility-tests-')
+
+
+def _copy_networks(source, name):
+    target = os.path.join(TEST_ROOT, name)
+    shutil.copytree(source, target, ignore=shutil.ignore_patterns('*.wal', '*.tmp'))
+    return target
+
+
+os.environ['SIM_POOL_WORKERS'] = '0'
+os.environ['SIM_CACHE_DIR'] = os.path.join(TEST_ROOT, 'sim-cache')
+os.environ['DISTANCE_CACHE_DIR'] = os.path.join(TEST_ROOT, 'distance-cache')
+os.environ['SIM_SCRATCH_DIR'] = os.path.join(TEST_ROOT, 'scratch')
+os.environ['NETWORK_COMPACT_DELAY'] = '0'
+os.environ['NETWORK_WAL_FSYNC'] = '0'
+os.environ['HYDRAULIC_NETWORK_DIR'] = _copy_networks(
+    os.path.join(API_SERVER_DIR, 'Water-Hydraulic-Simulation', 'Networks'), 'hydraulic-networks')
+os.environ['SCHEDULER_NETWORK_DIR'] = _copy_networks(
+    os.path.join(API_SERVER_DIR, 'Water-Scheduling', 'networks'), 'scheduler-networks')
+os.makedirs(os.environ['SIM_SCRATCH_DIR'], exist_ok=True)
+
+sys.path.insert(0, API_SERVER_DIR)
+# EPANET在当前目录写临时文件
+os.chdir(TEST_ROOT)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_ROOT, ignore_errors=True)
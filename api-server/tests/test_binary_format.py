@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from utils.binary_format import (
+    MAGIC, DEFAULT_NODE_VARIABLES, DEFAULT_LINK_VARIABLES, check_variables, pack_timeseries, unpack_timeseries
+)
+from utils.result_arrays import SimulationArrays, NODE_VARIABLES, LINK_VARIABLES
+
+
+def make_results(node_count=5, link_count=3, steps=4):
+    rng = np.random.default_rng(0)
+    return SimulationArrays(
+        [f'N{i}' for i in range(node_count)],
+        [f'管段{i}' for i in range(link_count)],
+        np.arange(steps) * 3600,
+        rng.normal(size=(node_count, steps, len(NODE_VARIABLES))).astype(np.float32),
+        rng.normal(size=(link_count, steps, len(LINK_VARIABLES))).astype(np.float32),
+    )
+
+
+def test_round_trip():
+    results = make_results()
+    data = pack_timeseries(results)
+    assert data[:4] == MAGIC
+
+    header, arrays = unpack_timeseries(data)
+    assert header['node_ids'] == results.node_ids
+    assert header['link_ids'] == results.link_ids
+    assert header['times'] == results.times.tolist()
+    expected = [('node', name) for name in DEFAULT_NODE_VARIABLES] + [('link', name) for name in DEFAULT_LINK_VARIABLES]
+    assert list(arrays) == expected
+
+    for element, name in expected:
+        if element == 'node':
+            values = results.node_values[:, :, NODE_VARIABLES.index(name)]
+        else:
+            values = results.link_values[:, :, LINK_VARIABLES.index(name)]
+        # 每块按 时间步 × 元素 存放
+        np.testing.assert_array_equal(arrays[(element, name)], values.T)
+
+
+def test_block_alignment():
+    data = pack_timeseries(make_results(node_count=3, link_count=1, steps=1))
+    header, arrays = unpack_timeseries(data)
+    data_start = len(data) - sum(block['nbytes'] for block in header['blocks'])
+    assert data_start % 8 == 0
+    assert all(block['offset'] % 4 == 0 for block in header['blocks'])
+
+
+def test_selected_variables():
+    results = make_results()
+    header, arrays = unpack_timeseries(pack_timeseries(results, ['demand'], ['velocity', 'setting']))
+    assert list(arrays) == [('node', 'demand'), ('link', 'velocity'), ('link', 'setting')]
+    np.testing.assert_array_equal(arrays[('link', 'setting')], results.link_values[:, :, 4].T)
+
+
+def test_unpack_rejects_other_data():
+    with pytest.raises(ValueError):
+        unpack_timeseries(b'XXXX\x00\x00\x00\x00')
+
+
+@pytest.mark.parametrize('element, variables', [
+    ('node', 'pressure'),
+    ('node', [1, 2]),
+    ('node', ['flowrate']),
+    ('link', ['pressure']),
+    ('link', None),
+])
+def test_check_variables_rejects(element, variables):
+    with pytest.raises(ValueError):
+        check_variables(element, variables)
+
+
+def test_pack_rejects_unknown_variables():
+    with pytest.raises(ValueError):
+        pack_timeseries(make_results(), ['velocity'], [])
@@ -0,0 +1,37 @@
+import pytest
+
+from app import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.mark.parametrize('pairs', [
+    None,
+    'abc',
+    [['1']],
+    [['1', '2', '3']],
+    [[1, 2]],
+    [[['1'], '2']],
+    ['12'],
+])
+def test_malformed_pairs(client, pairs):
+    response = client.post('/api/hydraulic/distances', json={'pairs': pairs})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_unknown_nodes(client):
+    response = client.post('/api/hydraulic/distances', json={'pairs': [['1', 'no-such-node']]})
+    assert response.status_code == 404
+
+
+def test_distances(client):
+    response = client.post('/api/hydraulic/distances', json={'pairs': [['1', '1'], ['1', '2']], 'include_paths': True})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['distances'][0] == 0
+    assert data['distances'][1] > 0
+    assert data['paths'][1][0] == '1' and data['paths'][1][-1] == '2'
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pytest
+
+import config
+from utils.gga_solver import solve_snapshot
+from utils.network_store import NETWORK_STORE
+from utils.result_arrays import NODE_VARIABLES, LINK_VARIABLES
+from utils.result_cache import run_until_hour
+
+NETWORKS = [
+    os.path.join(config.HYDRAULIC_NETWORK_DIR, 'Net2.inp'),
+    os.path.join(config.SCHEDULER_NETWORK_DIR, 'Net3.inp'),
+]
+
+# 水头、压力、水头损失的容差（m），流量和需水量（水池、水箱为净出流量，m³/s）、流速（m/s）的容差
+NODE_TOLERANCE = {'demand': 1e-5, 'head': 1e-3, 'pressure': 1e-3}
+LINK_TOLERANCE = {'flowrate': 1e-5, 'velocity': 1e-4, 'headloss': 1e-3, 'status': 0, 'setting': 1e-6}
+
+
+@pytest.mark.parametrize('path', NETWORKS, ids=os.path.basename)
+def test_snapshot_matches_epanet(path):
+    digest = NETWORK_STORE.load_file(path)
+    snapshot = solve_snapshot(digest, 0)
+    assert snapshot is not None
+    assert len(snapshot.times) == 1
+
+    epanet = run_until_hour(digest, 0, inp_file_path=path)
+    step = epanet.time_index(0)
+    assert snapshot.node_ids == epanet.node_ids
+    assert snapshot.link_ids == epanet.link_ids
+    for k, name in enumerate(NODE_VARIABLES):
+        np.testing.assert_allclose(snapshot.node_values[:, 0, k], epanet.node_values[:, step, k],
+                                   rtol=0, atol=NODE_TOLERANCE[name], err_msg=name)
+    for k, name in enumerate(LINK_VARIABLES):
+        np.testing.assert_allclose(snapshot.link_values[:, 0, k], epanet.link_values[:, step, k],
+                                   rtol=0, atol=LINK_TOLERANCE[name], err_msg=name)
+
+
+def test_snapshot_is_cached():
+    digest = NETWORK_STORE.load_file(NETWORKS[0])
+    assert solve_snapshot(digest, 0) is solve_snapshot(digest, 0)
+
+
+def test_snapshot_disabled(monkeypatch):
+    monkeypatch.setattr(config, 'SNAPSHOT_SOLVER_ENABLED', False)
+    assert solve_snapshot(NETWORK_STORE.load_file(NETWORKS[0]), 0) is None
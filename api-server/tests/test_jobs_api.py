@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from app import app
+from utils.jobs import JOB_MANAGER, SUCCEEDED
+from utils.network_store import NETWORK_STORE
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def pins():
+    return {digest: count for digest, count in NETWORK_STORE._pins.items() if count}
+
+
+@pytest.mark.parametrize('time_limit', ['abc', -1, 0, True, [60]])
+def test_create_job_rejects_time_limit(client, time_limit):
+    before = pins()
+    response = client.post('/api/jobs', json={'kind': 'monte_carlo', 'params': {'samples': 2}, 'time_limit': time_limit})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+    # 参数错误时不固定管网版本
+    assert pins() == before
+
+
+@pytest.mark.parametrize('time_limit', ['abc', '-5', 'nan', 'inf'])
+def test_query_time_limit_rejected(client, time_limit):
+    response = client.post(f'/api/scheduler/network/monte-carlo?async=1&time_limit={time_limit}', json={'samples': 2})
+    assert response.status_code == 400
+
+
+def test_create_job_rejects_unknown_kind(client):
+    assert client.post('/api/jobs', json={'kind': 'no-such-kind'}).status_code == 400
+    assert client.post('/api/jobs', data='not json').status_code == 400
+
+
+@pytest.mark.parametrize('params', [
+    {'samples': 10 ** 9},
+    {'samples': 0},
+    {'samples': 2, 'seed': -1},
+    {'samples': 2, 'percentiles': [120]},
+    {'samples': 2, 'hour': 'noon'},
+])
+def test_create_job_rejects_monte_carlo_params(client, params):
+    before = pins()
+    response = client.post('/api/jobs', json={'kind': 'monte_carlo', 'params': params})
+    assert response.status_code == 400
+    assert pins() == before
+
+
+def test_create_job_rejects_batch_params(client):
+    assert client.post('/api/jobs', json={'kind': 'batch_simulate', 'params': {'scenarios': []}}).status_code == 400
+    response = client.post('/api/jobs', json={'kind': 'batch_simulate',
+                                              'params': {'scenarios': [{'demands': {'no-such-node': 0.1}}]}})
+    assert response.status_code == 400
+
+
+def test_unknown_network(client):
+    response = client.post('/api/jobs', json={'kind': 'monte_carlo', 'params': {'samples': 2, 'network_id': 'no-such-network'}})
+    assert response.status_code == 404
+    response = client.post('/api/scheduler/network/monte-carlo?network_id=no-such-network', json={'samples': 2})
+    assert response.status_code == 404
+    assert client.post('/api/jobs', json={'kind': 'monte_carlo', 'params': {'network_id': '../Net2'}}).status_code == 400
+
+
+def test_unknown_job(client):
+    assert client.get('/api/jobs/no-such-job').status_code == 404
+    assert client.get('/api/jobs/no-such-job/result').status_code == 404
+    assert client.post('/api/jobs/no-such-job/cancel').status_code == 404
+
+
+def test_job_pins_network_version_until_finished(client):
+    before = pins()
+    response = client.post('/api/jobs', json={'kind': 'monte_carlo', 'params': {'samples': 2, 'seed': 1},
+                                              'time_limit': 1e9})
+    assert response.status_code == 202
+    job = JOB_MANAGER.get(response.get_json()['job']['job_id'])
+    assert job.time_limit <= JOB_MANAGER.default_time_limit
+
+    assert job.wait(60)
+    assert job.status == SUCCEEDED
+    # 资源在任务函数退出后释放
+    for _ in range(100):
+        if job.release is None:
+            break
+        time.sleep(0.05)
+    assert pins() == before
+
+    response = client.get(f"/api/jobs/{job.id}/result")
+    assert response.status_code == 200
+    assert response.get_json()['samples'] == 2
@@ -0,0 +1,118 @@
+import os
+import shutil
+
+import pytest
+import wntr
+
+import config
+from utils.network_session import NetworkSession
+from utils.network_store import NETWORK_STORE
+
+
+@pytest.fixture
+def inp_file_path(tmp_path):
+    path = str(tmp_path / 'Net2.inp')
+    shutil.copy(os.path.join(config.HYDRAULIC_NETWORK_DIR, 'Net2.inp'), path)
+    return path
+
+
+def restart(session):
+    """模拟进程重启：关闭日志（不删除）后为同一文件新建会话"""
+    session._close_log()
+    session._close_toolkit()
+    return NetworkSession(session.inp_file_path)
+
+
+def test_edits_create_new_versions(inp_file_path):
+    session = NetworkSession(inp_file_path)
+    base = session.snapshot()
+    assert not base.has_edits()
+    assert session.digest() == NETWORK_STORE.load_file(inp_file_path)
+
+    digest = session.set_demand('2', 0.01)
+    assert digest.startswith(base.digest + '-edit-')
+    assert session.version(digest).edited_demands() == {'2': 0.01}
+    # 取得的旧版本不受之后的修改影响
+    assert not base.has_edits()
+    assert session.set_link('5', status='closed') != digest
+    assert session.version(digest).edited_statuses() == {}
+
+    with pytest.raises(KeyError):
+        session.set_demand('no-such-node', 0.01)
+    with pytest.raises(ValueError):
+        session.set_demand('2', float('nan'))
+    with pytest.raises(ValueError):
+        session.set_link('5', status='HALF')
+    assert session.snapshot().edit_count == 2
+
+
+def test_log_replay_restores_version(inp_file_path):
+    session = NetworkSession(inp_file_path)
+    session.set_demands({'2': 0.01, '3': 0.02})
+    session.set_link('5', status='CLOSED', setting=90)
+    digest = session.digest()
+    assert os.path.exists(session.wal_path)
+
+    restored = restart(session)
+    version = restored.snapshot()
+    # 重放后版本哈希与重启前相同
+    assert version.digest == digest
+    assert version.edited_demands() == {'2': 0.01, '3': 0.02}
+    assert version.edited_statuses() == {'5': 'CLOSED'}
+    assert version.edited_settings() == {'5': 90.0}
+
+    wn = NETWORK_STORE.get_by_digest(digest, copy=False)
+    assert wn.get_node('3').demand_timeseries_list[0].base_value == 0.02
+    assert wn.get_link('5').roughness == 90.0
+    restored._close_log()
+
+
+def test_log_with_torn_last_line(inp_file_path):
+    session = NetworkSession(inp_file_path)
+    session.set_demand('2', 0.01)
+    digest = session.digest()
+    session._close_log()
+    with open(session.wal_path, 'a', encoding='utf-8') as f:
+        f.write('{"demands": {"3": 0.')
+
+    restored = NetworkSession(inp_file_path)
+    assert restored.digest() == digest
+    restored._close_log()
+
+
+def test_log_for_other_base_is_discarded(inp_file_path):
+    session = NetworkSession(inp_file_path)
+    session.set_demand('2', 0.01)
+    session._close_log()
+    with open(inp_file_path, 'a', encoding='utf-8') as f:
+        f.write('\n')
+
+    restored = NetworkSession(inp_file_path)
+    assert not restored.has_edits()
+    assert not os.path.exists(restored.wal_path)
+
+
+def test_save_writes_inp_and_clears_log(inp_file_path):
+    session = NetworkSession(inp_file_path)
+    session.set_demand('2', 0.01)
+    session.set_link('5', status='CLOSED')
+    new_base = session.save()
+
+    assert not os.path.exists(session.wal_path)
+    assert not session.has_edits()
+    assert session.digest() == new_base == NETWORK_STORE.load_file(inp_file_path)
+    wn = wntr.network.WaterNetworkModel(inp_file_path)
+    assert wn.get_node('2').demand_timeseries_list[0].base_value == pytest.approx(0.01)
+    assert wn.get_link('5').initial_status == wntr.network.LinkStatus.Closed
+
+    # 重启后没有需要重放的修改
+    assert not restart(session).has_edits()
+
+
+def test_discard(inp_file_path):
+    session = NetworkSession(inp_file_path)
+    base_digest = session.digest()
+    session.set_demand('2', 0.01)
+    session.discard()
+    assert session.digest() == base_digest
+    assert not os.path.exists(session.wal_path)
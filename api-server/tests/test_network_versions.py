@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+import wntr
+
+import config
+from utils.network_session import NetworkSession
+from utils.network_store import NETWORK_STORE
+from utils.network_versions import ChunkedArray, NetworkVersion
+from utils.result_arrays import SimulationArrays, NODE_VARIABLES, LINK_VARIABLES
+from utils.result_cache import run_simulation
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(config, 'NETWORK_VERSION_CHUNK', 4)
+
+
+@pytest.fixture
+def session(tmp_path):
+    path = str(tmp_path / 'Net2.inp')
+    shutil.copy(os.path.join(config.HYDRAULIC_NETWORK_DIR, 'Net2.inp'), path)
+    session = NetworkSession(path)
+    yield session
+    session._close_log()
+    session._close_toolkit()
+
+
+def test_chunked_array_shares_unchanged_chunks(small_chunks):
+    array = ChunkedArray.full(10, np.nan, np.float64)
+    assert len(array.chunks) == 3
+    edited = array.set([5, 6, 5], [1.0, 2.0, 3.0])
+
+    assert edited.chunks[0] is array.chunks[0]
+    assert edited.chunks[2] is array.chunks[2]
+    assert edited.chunks[1] is not array.chunks[1]
+    # 原数组不变，所有块只读
+    assert np.isnan(array.to_array()).all()
+    assert not any(chunk.flags.writeable for chunk in edited.chunks)
+    with pytest.raises(ValueError):
+        edited.chunks[1][0] = 0
+
+    values = edited.to_array()
+    assert len(values) == 10
+    assert values[5] == 3.0 and values[6] == 2.0
+    assert edited.edited_positions().tolist() == [5, 6]
+    assert edited.changed_positions(array).tolist() == [5, 6]
+    assert edited.set([9], [4.0]).changed_positions(edited).tolist() == [9]
+    assert edited[[5, 6]].tolist() == [3.0, 2.0]
+
+
+def test_digest_chain_is_deterministic(session):
+    base = session.snapshot()
+    edit = {'demands': {'2': 0.01}}
+    first = base.with_edit(edit, json.dumps(edit))
+    again = NetworkVersion.base(base.base_digest).with_edit(edit, json.dumps(edit))
+    assert first.digest == again.digest
+    assert first.digest.startswith(base.digest + '-edit-')
+    # 同样的修改接在不同的版本之后得到不同的哈希
+    assert first.with_edit(edit, json.dumps(edit)).digest != first.digest
+
+    assert first.edited_demands() == {'2': 0.01}
+    assert base.edited_demands() == {}
+    assert first.changes_since(base) == edit
+    # 反向的修改为恢复原值（NaN）
+    assert list(base.changes_since(first)) == ['demands']
+    assert np.isnan(base.changes_since(first)['demands']['2'])
+
+
+def test_snapshot_is_unaffected_by_later_edits(session):
+    session.set_demand('2', 0.01)
+    snapshot = session.snapshot()
+    session.set_demand('2', 0.05)
+    session.set_link('5', status='CLOSED')
+
+    assert snapshot.edited_demands() == {'2': 0.01}
+    assert snapshot.edited_statuses() == {}
+    wn = NETWORK_STORE.get_by_digest(snapshot.digest, copy=False)
+    assert wn.get_node('2').demand_timeseries_list[0].base_value == 0.01
+    assert wn.get_link('5').initial_status == wntr.network.LinkStatus.Open
+
+
+def test_pinned_version_survives_history_overflow(session, monkeypatch):
+    monkeypatch.setattr(config, 'NETWORK_VERSION_HISTORY', 2)
+    digest = session.set_demand('2', 0.01)
+    NETWORK_STORE.pin(digest)
+    try:
+        for demand in (0.02, 0.03, 0.04):
+            session.set_demand('2', demand)
+        assert session.version(digest) is None
+        # 已被会话丢弃，但固定期间仍可构建
+        wn = NETWORK_STORE.get_by_digest(digest, copy=False)
+        assert wn.get_node('2').demand_timeseries_list[0].base_value == 0.01
+    finally:
+        NETWORK_STORE.unpin(digest)
+    assert digest not in NETWORK_STORE._versions
+    assert digest not in NETWORK_STORE._pins
+
+
+def test_pinned_model_survives_eviction(monkeypatch):
+    digest = NETWORK_STORE.load_file(os.path.join(config.HYDRAULIC_NETWORK_DIR, 'Net2.inp'))
+    other_digest = NETWORK_STORE.load_file(os.path.join(config.SCHEDULER_NETWORK_DIR, 'Net3.inp'))
+    NETWORK_STORE.get_by_digest(digest, copy=False)
+    NETWORK_STORE.pin(digest)
+    monkeypatch.setattr(NETWORK_STORE, 'max_bytes', 1)
+    try:
+        NETWORK_STORE.get_by_digest(other_digest, copy=False)
+        assert digest in NETWORK_STORE._entries
+    finally:
+        NETWORK_STORE.unpin(digest)
+    assert digest not in NETWORK_STORE._entries
+    assert digest not in NETWORK_STORE._pins
+
+
+def test_toolkit_solve_matches_epanet(session):
+    session.set_demands({'2': 0.01, '10': 0.004})
+    session.set_link('5', setting=90)
+    version = session.snapshot()
+
+    results = run_simulation(version.digest, inp_file_path=session.inp_file_path)
+    wn = version.build_model()
+    expected = SimulationArrays.from_results(wntr.sim.EpanetSimulator(wn).run_sim(file_prefix='test-network-versions'))
+    assert results.node_ids == expected.node_ids
+    assert results.link_ids == expected.link_ids
+    np.testing.assert_array_equal(results.times, expected.times)
+
+    # Net2中部分节点在某些时刻与水源断开，EPANET给出的水头没有意义，不参与比较
+    disconnected = expected.node_values[:, :, NODE_VARIABLES.index('head')] < -1e3
+    ends = np.array([[expected.node_index[wn.get_link(link_id).start_node_name],
+                      expected.node_index[wn.get_link(link_id).end_node_name]] for link_id in expected.link_ids])
+    link_disconnected = disconnected[ends[:, 0]] | disconnected[ends[:, 1]]
+    for k, name in enumerate(NODE_VARIABLES):
+        np.testing.assert_allclose(results.node_values[:, :, k][~disconnected],
+                                   expected.node_values[:, :, k][~disconnected],
+                                   rtol=1e-5, atol=1e-5, err_msg=name)
+    for k, name in enumerate(LINK_VARIABLES):
+        np.testing.assert_allclose(results.link_values[:, :, k][~link_disconnected],
+                                   expected.link_values[:, :, k][~link_disconnected],
+                                   rtol=1e-5, atol=1e-5, err_msg=name)
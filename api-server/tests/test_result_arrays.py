@@ -0,0 +1,75 @@
+import math
+import os
+
+import numpy as np
+import wntr
+
+import config
+from utils.result_arrays import (
+    SimulationArrays, NODE_VARIABLES, LINK_VARIABLES, report_time, round_significant, rounded_list
+)
+
+
+def test_round_significant_float32_values():
+    value = float(np.float32(0.04205744))
+    assert value != 0.04205744
+    assert rounded_list(np.array([value], dtype=np.float32)) == [0.04205744]
+
+
+def test_round_significant_relative_error():
+    rng = np.random.default_rng(1)
+    values = (rng.normal(size=10000) * 10.0 ** rng.integers(-8, 9, size=10000)).astype(np.float32)
+    rounded = np.array(rounded_list(values))
+    exact = values.astype(np.float64)
+    assert np.all(np.abs(rounded - exact) <= 5e-7 * np.abs(exact))
+
+
+def test_round_significant_special_values():
+    rounded = round_significant([0.0, -0.0, math.nan, math.inf, -math.inf, 123456789.0, -1.23456789e-30, 3.4e38])
+    assert rounded[0] == 0 and rounded[1] == 0
+    assert math.isnan(rounded[2])
+    assert rounded[3] == math.inf and rounded[4] == -math.inf
+    assert rounded[5] == 123456800.0
+    assert rounded[6] == -1.234568e-30
+    # 超出10的22次幂时只保证最接近到一个ulp
+    assert abs(rounded[7] - 3.4e38) <= np.spacing(3.4e38)
+
+
+def test_rounded_list_decimals():
+    assert rounded_list(np.array([1.23456, -2.5e-5]), decimals=2) == [1.23, -0.0]
+
+
+def test_from_results_matches_dataframes():
+    wn = wntr.network.WaterNetworkModel(os.path.join(config.HYDRAULIC_NETWORK_DIR, 'Net2.inp'))
+    results = wntr.sim.EpanetSimulator(wn).run_sim(file_prefix='test-result-arrays')
+    arrays = SimulationArrays.from_results(results)
+
+    assert arrays.node_ids == [str(n) for n in results.node['pressure'].columns]
+    assert arrays.link_ids == [str(n) for n in results.link['flowrate'].columns]
+    np.testing.assert_array_equal(arrays.times, results.node['pressure'].index.to_numpy())
+    for k, name in enumerate(NODE_VARIABLES):
+        np.testing.assert_allclose(arrays.node_values[:, :, k].T, results.node[name].to_numpy(), rtol=1e-6, atol=1e-6)
+    for k, name in enumerate(LINK_VARIABLES):
+        np.testing.assert_allclose(arrays.link_values[:, :, k].T, results.link[name].to_numpy(), rtol=1e-6, atol=1e-6)
+
+    step = arrays.time_index(1)
+    node_id = arrays.node_ids[3]
+    assert arrays.node_series('pressure', step)[node_id] == arrays.node_values[3, step, NODE_VARIABLES.index('pressure')]
+
+
+def test_time_index():
+    arrays = SimulationArrays([], [], [0, 3600, 7200, 10800],
+                              np.zeros((0, 4, 3), dtype=np.float32), np.zeros((0, 4, 5), dtype=np.float32))
+    assert arrays.time_index(2) == 2
+    assert arrays.time_index(1.4) == 1
+    assert arrays.time_index(1.6) == 2
+    assert arrays.time_index(-1) == 0
+    assert arrays.time_index(100) == 3
+
+
+def test_report_time():
+    wn = wntr.network.WaterNetworkModel(os.path.join(config.HYDRAULIC_NETWORK_DIR, 'Net2.inp'))
+    time_options = wn.options.time
+    assert report_time(time_options, 0) == time_options.report_start
+    assert report_time(time_options, 1e6) == time_options.duration
+    assert report_time(time_options, 1) % time_options.report_timestep == 0
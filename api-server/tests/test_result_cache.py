@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+
+import config
+from utils.network_store import NETWORK_STORE
+from utils.result_arrays import SimulationArrays
+from utils.result_cache import SimulationCache, DEFAULT_SIM_OPTIONS, SIMULATION_CACHE, run_simulation
+
+DIGEST = 'a' * 64
+
+
+def make_results(size):
+    return SimulationArrays(['N1'], ['P1'], [0],
+                            np.zeros((size, 1, 3), dtype=np.float32), np.zeros((0, 1, 5), dtype=np.float32))
+
+
+def test_key_is_stable_and_ignores_option_order():
+    key = SimulationCache.make_key(DIGEST, {'simulator': 'EPANET', 'version': 2.2})
+    assert key == SimulationCache.make_key(DIGEST, {'version': 2.2, 'simulator': 'EPANET'})
+    assert key.startswith(DIGEST + '-')
+
+
+def test_key_depends_on_digest_and_options():
+    key = SimulationCache.make_key(DIGEST, DEFAULT_SIM_OPTIONS)
+    assert key != SimulationCache.make_key('b' * 64, DEFAULT_SIM_OPTIONS)
+    assert key != SimulationCache.make_key(DIGEST, {**DEFAULT_SIM_OPTIONS, 'duration': 3600})
+
+
+def test_disk_tier_is_shared_and_invalidated(tmp_path):
+    cache = SimulationCache(str(tmp_path), memory_entries=4, disk_entries=8)
+    key = SimulationCache.make_key(DIGEST, DEFAULT_SIM_OPTIONS)
+    other_key = SimulationCache.make_key('b' * 64, DEFAULT_SIM_OPTIONS)
+    cache.put(key, make_results(2))
+    cache.put(other_key, make_results(2))
+
+    # 另一个进程（新的缓存实例）从磁盘读取
+    shared = SimulationCache(str(tmp_path), memory_entries=4, disk_entries=8)
+    assert shared.get(key).node_values.shape == (2, 1, 3)
+
+    cache.invalidate(DIGEST)
+    assert cache.get(key) is None
+    assert SimulationCache(str(tmp_path), memory_entries=4, disk_entries=8).get(key) is None
+    assert cache.get(other_key) is not None
+
+
+def test_memory_bytes_limit_keeps_latest_entry(tmp_path):
+    cache = SimulationCache(str(tmp_path), memory_entries=10, disk_entries=10, memory_bytes=100)
+    cache.put('x-1', make_results(8))
+    cache.put('x-2', make_results(8))
+    assert list(cache._memory) == ['x-2']
+    # 超过上限的单个结果仍然保留
+    cache.put('x-3', make_results(100))
+    assert list(cache._memory) == ['x-3']
+
+
+def test_disk_entries_limit(tmp_path):
+    cache = SimulationCache(str(tmp_path), memory_entries=10, disk_entries=2)
+    for i in range(4):
+        cache.put(f'x-{i}', make_results(1))
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.pkl')]) == 2
+
+
+def test_run_simulation_uses_cache():
+    path = os.path.join(config.HYDRAULIC_NETWORK_DIR, 'Net2.inp')
+    digest = NETWORK_STORE.load_file(path)
+    SIMULATION_CACHE.invalidate(digest)
+
+    first = run_simulation(digest, inp_file_path=path)
+    assert first.node_values.shape[1] == len(first.times) > 1
+    assert run_simulation(digest, inp_file_path=path) is first
+    assert os.path.exists(SIMULATION_CACHE._disk_path(SimulationCache.make_key(digest, DEFAULT_SIM_OPTIONS)))
@@ -0,0 +1,120 @@
+"""
+全时段模拟结果的紧凑二进制格式
+
+布局（小端序）:
+    4字节    魔数 b'WTS1'
+    4字节    uint32，JSON头部长度（含补齐的空格）
+    N字节    UTF-8 JSON头部: node_ids、link_ids、times（秒）以及各数据块的描述
+    数据区   依次排列的float32数据块，每块按 时间步 × 元素 存放
+
+头部长度补齐到8字节的整数倍，数据块偏移均为4的倍数，
+前端可以直接用 new Float32Array(buffer, dataStart + offset, length) 取得某一变量，
+拖动时间轴时第t帧即为该块中连续的一段。
+"""
+import json
+import struct
+
+import numpy as np
+
+from utils.result_arrays import NODE_VARIABLES, LINK_VARIABLES
+
+MAGIC = b'WTS1'
+MIMETYPE = 'application/octet-stream'
+
+# 元素类型的中文名称，用于错误提示
+ELEMENT_NAMES = {'node': '节点', 'link': '管段'}
+
+# 默认导出的变量
+DEFAULT_NODE_VARIABLES = ('pressure', 'head', 'demand')
+DEFAULT_LINK_VARIABLES = ('flowrate', 'status')
+
+
+def check_variables(element, variables):
+    """
+    检查导出的变量列表
+
+    参数:
+        element (str): 'node' 或 'link'
+        variables: 请求中的变量列表
+
+    返回:
+        tuple: 变量名
+
+    不是字符串列表或包含不支持的变量时抛出ValueError
+    """
+    if not isinstance(variables, (list, tuple)) or not all(isinstance(name, str) for name in variables):
+        raise ValueError(f"{element}_variables 必须是变量名列表")
+    known = NODE_VARIABLES if element == 'node' else LINK_VARIABLES
+    for name in variables:
+        if name not in known:
+            raise ValueError(f"不支持的{ELEMENT_NAMES[element]}变量: {name}")
+    return tuple(variables)
+
+
+def pack_timeseries(results, node_variables=DEFAULT_NODE_VARIABLES, link_variables=DEFAULT_LINK_VARIABLES):
+    """
+    将列式模拟结果打包为二进制数据
+
+    参数:
+        results (SimulationArrays): 列式模拟结果
+        node_variables (tuple): 导出的节点变量
+        link_variables (tuple): 导出的管段变量
+
+    返回:
+        bytes: 二进制数据
+
+    变量列表不合法时抛出ValueError（见 check_variables）
+    """
+    blocks = []
+    arrays = []
+    offset = 0
+    for element, variables, known, values in (
+            ('node', node_variables, NODE_VARIABLES, results.node_values),
+            ('link', link_variables, LINK_VARIABLES, results.link_values)):
+        for name in check_variables(element, variables):
+            # 转置为 时间步 × 元素，使每一帧在内存中连续
+            block = np.ascontiguousarray(values[:, :, known.index(name)].T, dtype='<f4')
+            blocks.append({
+                'name': name,
+                'element': element,
+                'dtype': 'float32',
+                'shape': list(block.shape),
+                'offset': offset,
+                'nbytes': block.nbytes,
+            })
+            arrays.append(block)
+            offset += block.nbytes
+
+    header = json.dumps({
+        'node_ids': results.node_ids,
+        'link_ids': results.link_ids,
+        'times': results.times.tolist(),
+        'blocks': blocks,
+    }, ensure_ascii=False).encode('utf-8')
+    # 魔数和长度共8字节，头部补齐到8字节的整数倍
+    header += b' ' * (-len(header) % 8)
+
+    parts = [MAGIC, struct.pack('<I', len(header)), header]
+    parts.extend(block.tobytes() for block in arrays)
+    return b''.join(parts)
+
+
+def unpack_timeseries(data):
+    """
+    解析 pack_timeseries 生成的二进制数据
+
+    返回:
+        tuple: (header, arrays)，arrays为 {(element, name): ndarray}，数组直接引用data中的内存
+    """
+    if data[:4] != MAGIC:
+        raise ValueError("不是有效的时间序列数据")
+    header_length = struct.unpack('<I', data[4:8])[0]
+    header = json.loads(data[8:8 + header_length].decode('utf-8'))
+    data_start = 8 + header_length
+    arrays = {}
+    for block in header['blocks']:
+        count = block['shape'][0] * block['shape'][1]
+        arrays[(block['element'], block['name'])] = np.frombuffer(
+            data, dtype='<f4', count=count, offset=data_start + block['offset']
+        ).reshape(block['shape'])
+    return header, arrays
@@ -0,0 +1,137 @@
+"""
+批量导入用户节点需水量
+
+逐行用 csv.reader 解析、每行在节点ID列表中线性查找，导入N个节点的代价是O(N²)。这里：
+- 用户节点ID的哈希索引（pandas.Index）按管网版本缓存在 NETWORK_STORE 中，随模型一起淘汰
+- 上传文件由pandas的C解析器按块流式读取（不把整个文件解码为字符串），每块内数值转换、
+  ID查找（Index.get_indexer）和错误判断都是向量化的
+- 通过检查的行汇总为 (用户节点序号, 需水量) 两个数组，由编辑会话一次性赋值
+  （同一节点出现多次时以最后一行为准）
+- 行级错误以紧凑的表格返回：{"columns": ["row", "node_id", "error"], "rows": [[行号, 节点ID, 错误], ...]}
+
+CSV格式：每行 "节点ID,需水量(m³/s)"，无表头，多余的列忽略。
+"""
+import numpy as np
+import pandas as pd
+
+import config
+from utils.network_store import NETWORK_STORE
+
+ERROR_COLUMNS = ['row', 'node_id', 'error']
+
+
+class JunctionIndex:
+    """用户节点ID -> 序号（与 wn.junction_name_list 的顺序相同）的哈希索引"""
+
+    def __init__(self, wn):
+        self.junction_ids = pd.Index(wn.junction_name_list)
+        self.node_ids = pd.Index(wn.node_name_list)
+
+    def __len__(self):
+        return len(self.junction_ids)
+
+    def locate(self, node_ids):
+        """
+        查找用户节点序号
+
+        参数:
+            node_ids: 节点ID序列
+
+        返回:
+            ndarray: 用户节点序号，节点不存在或不是用户节点时为-1
+        """
+        return self.junction_ids.get_indexer(node_ids)
+
+    def contains_node(self, node_ids):
+        """各ID是否为管网中的节点（任意类型）"""
+        return self.node_ids.get_indexer(node_ids) >= 0
+
+
+def get_junction_index(digest):
+    """管网版本对应的用户节点索引（按版本缓存，只读）"""
+    return NETWORK_STORE.get_artifact(digest, 'junction_index', JunctionIndex)
+
+
+class DemandImport:
+    """
+    一次导入的解析结果
+
+    属性:
+        positions (ndarray): 通过检查的用户节点序号（已去重）
+        values (ndarray): 对应的需水量（m³/s）
+        node_ids (list): 对应的节点ID
+        error_count (int): 出错的行数
+        errors (list): 出错的行 [行号, 节点ID, 错误]，最多 config.DEMAND_IMPORT_MAX_ERRORS 行
+    """
+
+    def __init__(self):
+        self.positions = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.float64)
+        self.node_ids = []
+        self.error_count = 0
+        self.errors = []
+
+    def error_table(self):
+        """行级错误的紧凑表格"""
+        return {"columns": ERROR_COLUMNS, "rows": self.errors, "total": self.error_count}
+
+    def _add_errors(self, rows, node_ids, message):
+        self.error_count += len(rows)
+        room = config.DEMAND_IMPORT_MAX_ERRORS - len(self.errors)
+        if room > 0:
+            self.errors.extend([int(row), node_id, message]
+                               for row, node_id in zip(rows[:room], node_ids[:room]))
+
+
+def read_demand_csv(stream, index, chunk_rows=None):
+    """
+    流式解析需水量CSV并检查节点
+
+    参数:
+        stream: 上传文件的二进制流
+        index (JunctionIndex): 用户节点索引
+        chunk_rows (int): 每块的行数，默认为 config.DEMAND_IMPORT_CHUNK_ROWS
+
+    返回:
+        DemandImport: 解析结果（行号从1开始，与原文件的行对应）
+    """
+    result = DemandImport()
+    positions, values = [], []
+    reader = pd.read_csv(stream, header=None, names=['node_id', 'demand'], usecols=[0, 1], dtype=str,
+                         keep_default_na=False, skip_blank_lines=False, encoding='utf-8',
+                         chunksize=chunk_rows or config.DEMAND_IMPORT_CHUNK_ROWS)
+    for chunk in reader:
+        rows = chunk.index.to_numpy() + 1
+        node_ids = chunk['node_id'].str.strip().to_numpy()
+        raw = chunk['demand'].str.strip()
+        demands = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=np.float64)
+        located = index.locate(node_ids)
+
+        missing_value = (raw == '').to_numpy()
+        invalid_value = ~missing_value & ~np.isfinite(demands)
+        unknown = ~missing_value & ~invalid_value & (located < 0)
+        for mask, message in ((missing_value, "格式错误: 缺少需水量"),
+                              (invalid_value, "格式错误: 需水量不是有效数字")):
+            if mask.any():
+                result._add_errors(rows[mask], node_ids[mask].tolist(), message)
+        if unknown.any():
+            is_node = index.contains_node(node_ids[unknown])
+            for mask, message in ((~is_node, "节点不存在"), (is_node, "不是Junction类型，无法设置需水量")):
+                if mask.any():
+                    result._add_errors(rows[unknown][mask], node_ids[unknown][mask].tolist(), message)
+
+        valid = located >= 0
+        valid[missing_value | invalid_value] = False
+        positions.append(located[valid])
+        values.append(demands[valid])
+
+    if positions:
+        positions = np.concatenate(positions)
+        values = np.concatenate(values)
+        # 同一节点出现多次时保留最后一行
+        keep = ~pd.Index(positions).duplicated(keep='last')
+        result.positions = positions[keep].astype(np.int64)
+        result.values = values[keep]
+        result.node_ids = index.junction_ids[result.positions].tolist()
+    result.errors.sort(key=lambda error: error[0])
+    return result
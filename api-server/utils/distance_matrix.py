@@ -0,0 +1,102 @@
+"""
+全节点对最短路径距离矩阵
+
+对中小规模管网，在拓扑图（utils/network_graph.py）上一次算出按管长加权的全节点对最短路径距离，
+以float32保存到磁盘（文件名为管网内容哈希），之后以内存映射方式读取：
+- 同一台机器上的多个进程共享同一份文件和页缓存
+- 距离查询、监测点覆盖半径等都变为数组查找
+节点数超过 config.DISTANCE_MATRIX_MAX_NODES 的管网不建立矩阵。
+"""
+import glob
+import os
+import tempfile
+
+import numpy as np
+
+import config
+from utils.network_graph import get_network_graph
+from utils.network_store import NETWORK_STORE
+
+# 文件格式版本，格式变化时旧文件自动失效
+MATRIX_FORMAT = 'v1'
+
+
+class DistanceMatrix:
+    """节点间最短路径距离（米），不连通的节点对为inf"""
+
+    def __init__(self, node_ids, matrix):
+        self.node_ids = node_ids
+        self.node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.matrix = matrix
+
+    def distance(self, source, target):
+        """两节点间的最短路径距离"""
+        return float(self.matrix[self.node_index[source], self.node_index[target]])
+
+    def nearest(self, sources):
+        """
+        每个节点到一组节点中最近者的距离和该节点在sources中的序号
+
+        返回:
+            tuple: (距离数组, 最近者序号数组)
+        """
+        rows = np.asarray(self.matrix[[self.node_index[node_id] for node_id in sources]])
+        nearest = rows.argmin(axis=0)
+        return rows[nearest, np.arange(rows.shape[1])], nearest
+
+
+def _matrix_path(digest):
+    return os.path.join(config.DISTANCE_CACHE_DIR, f"{digest}-{MATRIX_FORMAT}.npy")
+
+
+def _prune_disk():
+    # 磁盘上的矩阵文件超出上限时删除最旧的
+    paths = glob.glob(os.path.join(config.DISTANCE_CACHE_DIR, '*.npy'))
+    if len(paths) <= config.DISTANCE_CACHE_MAX_FILES:
+        return
+    paths.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+    for path in paths[:len(paths) - config.DISTANCE_CACHE_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def load_or_build(digest, graph):
+    """从磁盘以内存映射方式读取距离矩阵，不存在时计算并写入；节点过多时返回None"""
+    node_ids = graph.node_ids
+    n = len(node_ids)
+    if n > config.DISTANCE_MATRIX_MAX_NODES:
+        return None
+
+    path = _matrix_path(digest)
+    try:
+        matrix = np.load(path, mmap_mode='r')
+        if matrix.shape == (n, n) and matrix.dtype == np.float32:
+            return DistanceMatrix(node_ids, matrix)
+    except (OSError, ValueError):
+        pass
+
+    distances = graph.shortest_distances(np.arange(n)).astype(np.float32)
+
+    os.makedirs(config.DISTANCE_CACHE_DIR, exist_ok=True)
+    # 先写临时文件再原子替换，其他进程不会读到写了一半的文件
+    fd, tmp_path = tempfile.mkstemp(dir=config.DISTANCE_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, distances)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"写入距离矩阵失败: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return DistanceMatrix(node_ids, distances)
+    _prune_disk()
+    return DistanceMatrix(node_ids, np.load(path, mmap_mode='r'))
+
+
+def get_distance_matrix(digest):
+    """获取管网版本的距离矩阵（随模型缓存在 NETWORK_STORE 中），节点过多时返回None"""
+    matrix = NETWORK_STORE.get_artifact(digest, 'distance_matrix',
+                                        lambda wn: load_or_build(digest, get_network_graph(digest)) or False)
+    return matrix or None
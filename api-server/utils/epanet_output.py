@@ -0,0 +1,204 @@
+"""
+EPANET二进制输出文件（.bin）的内存映射读取
+
+wntr 读取输出文件时把12个结果变量全部读入内存并构建 DataFrame，即使只需要其中一个时刻的压力。
+这里用 numpy.memmap 映射输出文件：
+- 文件头（prolog：元素个数、单位、报告时间、元素ID）和文件尾（epilog：报告期数、警告标志）只解析一次
+- 结果区按 期数 × (4×节点数 + 8×管段数) 的float32矩阵映射，某个变量在某个时间范围内的结果
+  是该矩阵的跨步视图，不复制数据；只有用整数数组选取元素子集时才复制被选中的部分
+- 单位换算系数与 wntr 相同（均为线性换算），只作用在取出的切片上
+
+文件格式见 EPANET 2.2 手册附录 "Binary Output File Format"。
+"""
+import numpy as np
+from wntr.epanet.util import EN, FlowUnits, HydParam, to_si
+
+from utils.result_arrays import LINK_VARIABLES, NODE_VARIABLES, SimulationArrays
+
+MAGIC_NUMBER = 516114521
+# 元素ID的定长字节数（EPANET 2.x 的 MAXID + 1）
+ID_LENGTH = 32
+PROLOG_INTS = 15
+EPILOG_BYTES = 28
+
+# 输出文件中每个报告期的节点、管段变量（顺序即文件中的顺序）
+FILE_NODE_VARIABLES = ('demand', 'head', 'pressure', 'quality')
+FILE_LINK_VARIABLES = ('flowrate', 'velocity', 'headloss', 'quality', 'status', 'setting',
+                       'reaction_rate', 'friction_factor')
+
+
+def _scaled(view, factors):
+    """换算系数先转为float32再相乘，与wntr对float32数据的换算结果逐位一致"""
+    return np.multiply(view, np.asarray(factors, dtype=np.float32), dtype=np.float32)
+
+
+class EpanetOutput:
+    """
+    内存映射的EPANET输出文件
+
+    属性:
+        node_ids (list): 节点ID列表（与INP文件中的顺序相同）
+        link_ids (list): 管段ID列表
+        link_types (ndarray): 管段类型代码（EN.CVPIPE、EN.PIPE、EN.PUMP、阀门类型）
+        times (ndarray): 各报告期的模拟时间（秒）
+        flow_units (FlowUnits): 结果的流量单位
+        warning (int): EPANET警告标志，非0时结果可能不完整
+    """
+
+    def __init__(self, path, darcy_weisbach=False):
+        self.path = path
+        self.darcy_weisbach = darcy_weisbach
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        size = len(self._map)
+        if size < PROLOG_INTS * 4 + EPILOG_BYTES:
+            raise ValueError(f"EPANET输出文件不完整: {path}")
+
+        prolog = self._map[:PROLOG_INTS * 4].view('<i4')
+        epilog = self._map[size - 12:].view('<i4')
+        if prolog[0] != MAGIC_NUMBER or epilog[2] != MAGIC_NUMBER:
+            raise ValueError(f"不是有效的EPANET输出文件（或模拟未正常结束）: {path}")
+        nodes, tanks, links, pumps = int(prolog[2]), int(prolog[3]), int(prolog[4]), int(prolog[5])
+        if int(prolog[11]) != 0:
+            raise ValueError("输出文件为统计结果（STATISTICS不为NONE），不包含各报告期的结果")
+        self.flow_units = FlowUnits(int(prolog[9]))
+        report_start, report_step = int(prolog[12]), int(prolog[13])
+        self.periods = int(epilog[0])
+        self.warning = int(epilog[1])
+
+        # prolog：标题3行×80、INP和报告文件名各260、化学物质名和单位、元素ID、管段两端和类型、水箱、
+        # 标高、管长、管径
+        offset = PROLOG_INTS * 4 + 240 + 260 + 260 + 2 * ID_LENGTH
+        self.node_ids = self._read_ids(offset, nodes)
+        offset += nodes * ID_LENGTH
+        self.link_ids = self._read_ids(offset, links)
+        offset += links * ID_LENGTH
+        offset += 2 * links * 4
+        self.link_types = np.array(self._map[offset:offset + links * 4].view('<i4'))
+        offset += links * 4
+        offset += 2 * tanks * 4 + nodes * 4 + 2 * links * 4
+        # 能耗部分：每台水泵一个序号和6个float32，最后是需量电费
+        offset += pumps * 28 + 4
+
+        self.node_count, self.link_count = nodes, links
+        self._period_floats = 4 * nodes + 8 * links
+        if offset + self.periods * self._period_floats * 4 + EPILOG_BYTES > size:
+            raise ValueError(f"EPANET输出文件的结果区不完整: {path}")
+        self._results = np.ndarray((self.periods, self._period_floats), dtype='<f4', buffer=self._map,
+                                   offset=offset)
+        self.times = report_start + report_step * np.arange(self.periods, dtype=np.int64)
+        self.node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.link_index = {link_id: i for i, link_id in enumerate(self.link_ids)}
+
+    def _read_ids(self, offset, count):
+        raw = self._map[offset:offset + count * ID_LENGTH].tobytes()
+        return [raw[i:i + ID_LENGTH].split(b'\x00', 1)[0].decode('utf-8') for i in range(0, len(raw), ID_LENGTH)]
+
+    def close(self):
+        """释放对内存映射的引用；已经取出的视图仍然有效，全部释放后文件映射随之关闭"""
+        self._results = None
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def time_range(self, start_hour=None, end_hour=None):
+        """
+        报告期范围 [start_hour, end_hour]（小时）对应的行切片
+
+        返回:
+            slice: 可直接作为 node_view / link_view 的 times 参数
+        """
+        start = 0 if start_hour is None else int(np.searchsorted(self.times, start_hour * 3600, side='left'))
+        stop = self.periods if end_hour is None else int(np.searchsorted(self.times, end_hour * 3600, side='right'))
+        return slice(start, stop)
+
+    def _view(self, column, count, variable_names, variable, elements, times):
+        k = variable_names.index(variable)
+        block = self._results[times if times is not None else slice(None), column + k * count:column + (k + 1) * count]
+        if elements is None:
+            return block
+        return block[:, elements]
+
+    def node_view(self, variable, elements=None, times=None):
+        """
+        节点结果的原始值（输出文件的单位）
+
+        参数:
+            variable (str): FILE_NODE_VARIABLES 中的变量名
+            elements: 节点序号（None为全部；切片不复制数据，整数数组只复制选中的节点）
+            times: 报告期的切片或序号（None为全部，见 time_range）
+
+        返回:
+            ndarray: 形状为 (报告期数, 节点数) 的float32数组，通常是内存映射的视图
+        """
+        return self._view(0, self.node_count, FILE_NODE_VARIABLES, variable, elements, times)
+
+    def link_view(self, variable, elements=None, times=None):
+        """管段结果的原始值（输出文件的单位），参数同 node_view"""
+        return self._view(4 * self.node_count, self.link_count, FILE_LINK_VARIABLES, variable, elements, times)
+
+    def _link_factors(self, variable):
+        """管段变量到国际单位的换算系数（各管段类型可能不同）"""
+        units = self.flow_units
+        if variable == 'flowrate':
+            return to_si(units, 1.0, HydParam.Flow)
+        if variable == 'velocity':
+            return to_si(units, 1.0, HydParam.Velocity)
+        if variable == 'headloss':
+            # 水泵和阀门为水头损失；管道为每1000单位管长的水头损失，在 link_values 中单独换算
+            return to_si(units, 1.0, HydParam.Length)
+        if variable == 'setting':
+            factors = np.ones(self.link_count)
+            types = self.link_types
+            factors[types == EN.PIPE] = to_si(units, 1.0, HydParam.RoughnessCoeff, darcy_weisbach=self.darcy_weisbach)
+            factors[np.isin(types, (EN.PRV, EN.PSV, EN.PBV))] = to_si(units, 1.0, HydParam.Pressure)
+            factors[types == EN.FCV] = to_si(units, 1.0, HydParam.Flow)
+            return factors
+        return 1.0
+
+    def node_values(self, variable, elements=None, times=None):
+        """节点结果（国际单位，与wntr相同），参数同 node_view；返回新数组"""
+        view = self.node_view(variable, elements, times)
+        if variable == 'quality':
+            return np.array(view)
+        param = {'demand': HydParam.Demand, 'head': HydParam.HydraulicHead, 'pressure': HydParam.Pressure}[variable]
+        return _scaled(view, to_si(self.flow_units, 1.0, param))
+
+    def link_values(self, variable, elements=None, times=None):
+        """管段结果（国际单位，状态按wntr的约定为 0关闭/1开启/2调节），参数同 node_view；返回新数组"""
+        view = self.link_view(variable, elements, times)
+        if variable == 'status':
+            status = np.ones(view.shape, dtype=np.float32)
+            status[view <= 2] = 0
+            status[view == 4] = 2
+            return status
+        factors = self._link_factors(variable)
+        if np.ndim(factors):
+            factors = factors[elements] if elements is not None else factors
+        values = _scaled(view, factors)
+        if variable == 'headloss':
+            # 与wntr相同按除以1000换算为单位管长的水头损失（m/m）
+            types = self.link_types[elements] if elements is not None else self.link_types
+            pipes = types <= EN.PIPE
+            values[:, pipes] = view[:, pipes] / np.float32(1000)
+        return values
+
+    def to_arrays(self, times=None):
+        """
+        转换为列式结果（只包含 NODE_VARIABLES 和 LINK_VARIABLES），逐个变量从内存映射中换算写入
+
+        参数:
+            times: 报告期的切片（None为全部）
+        """
+        times = times if times is not None else slice(None)
+        selected = self.times[times]
+        node_values = np.empty((self.node_count, len(selected), len(NODE_VARIABLES)), dtype=np.float32)
+        for k, name in enumerate(NODE_VARIABLES):
+            node_values[:, :, k] = self.node_values(name, times=times).T
+        link_values = np.empty((self.link_count, len(selected), len(LINK_VARIABLES)), dtype=np.float32)
+        for k, name in enumerate(LINK_VARIABLES):
+            link_values[:, :, k] = self.link_values(name, times=times).T
+        return SimulationArrays(self.node_ids, self.link_ids, selected, node_values, link_values)
@@ -0,0 +1,453 @@
+"""
+进程内的稳态水力求解（全局梯度算法，GGA）
+
+查询某一时刻（尤其是0时刻）的管网状态时不必启动一次完整的EPANET延时模拟：
+每个管网版本把求解需要的数据整理为数组一次（缓存在 NETWORK_STORE 中），之后每次只需
+按时间模式算出需水量和水池水头，用scipy.sparse组装并求解 A12ᵀ·P·A12 线性方程组，
+迭代公式与EPANET相同（Todini & Pilati 的全局梯度算法，见 EPANET hydcoeffs.c）。
+
+支持的元件：
+- 节点：用户节点（需水量驱动）；水池和水箱作为已知水头节点（水箱取初始水位）
+- 管道：Hazen-Williams / Darcy-Weisbach 水头损失、局部损失、止回阀
+- 水泵：按扬程曲线（1点或3点曲线拟合的 h = A - B·Q^C）和转速比，扬程不足时自动关闭
+- 阀门：TCV（局部损失系数为设定值），以及状态固定为开启或关闭的其他阀门
+- 控制：0时刻（以及没有水箱的管网的任意时刻）生效的定时控制和水箱水位控制
+
+其他情况（PRV/PSV/FCV/PBV/GPV处于调节状态、恒定功率水泵、射流器、压力驱动模拟、
+规则控制、水箱初始水位处于上下限等）抛出 SolverNotSupported，由调用方退回EPANET模拟。
+"""
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import spsolve
+from wntr.network.controls import Comparison, Control, SimTimeCondition, TankLevelCondition
+
+import config
+from utils.network_store import NETWORK_STORE
+from utils.result_arrays import LINK_VARIABLES, NODE_VARIABLES, SimulationArrays, report_time
+from utils.result_cache import SIMULATION_CACHE, SimulationCache
+
+NODE_COLUMN = {name: k for k, name in enumerate(NODE_VARIABLES)}
+LINK_COLUMN = {name: k for k, name in enumerate(LINK_VARIABLES)}
+
+GRAVITY = 9.81
+# 20℃水的运动粘度（m²/s），与EPANET的 VISCOS 默认值 1.1e-5 ft²/s 相同
+WATER_VISCOSITY = 1.022e-6
+# EPANET的 RQtol（1e-7 ft/cfs）换算为 m/(m³/s)：水头损失梯度的下限，流量接近0时按线性关系处理
+RQ_TOL = 1e-7 * 0.3048 / 0.028316846592
+# 关闭的管段按极小的导纳处理（EPANET的 CBIG）
+CLOSED_CONDUCTANCE = 1e-8
+# 判断止回阀、水泵状态时的水头容差（m）
+HEAD_TOL = 0.0005 * 0.3048
+# 初始流量对应的流速（m/s），与EPANET相同为1 ft/s
+INITIAL_VELOCITY = 0.3048
+
+PIPE, PUMP, VALVE = 0, 1, 2
+
+
+class SolverNotSupported(Exception):
+    """管网包含求解器不支持的元件或设置"""
+
+
+class SolverNotConverged(Exception):
+    """迭代次数达到上限仍未收敛"""
+
+
+def _pattern_value(pattern, t):
+    return pattern.at(t) if pattern is not None else 1.0
+
+
+class HydraulicArrays:
+    """稳态求解所需的管网数组（每个管网版本构建一次）"""
+
+    def __init__(self, wn):
+        options = wn.options.hydraulic
+        if options.demand_model not in ('DD', 'DDA'):
+            raise SolverNotSupported("只支持需水量驱动模拟")
+        self.accuracy = options.accuracy
+        self.trials = options.trials
+        self.viscosity = WATER_VISCOSITY * options.viscosity
+        self.headloss = options.headloss
+        if self.headloss not in ('H-W', 'D-W'):
+            raise SolverNotSupported(f"不支持 {self.headloss} 水头损失公式")
+        self.time_options = wn.options.time
+
+        self.node_ids = list(wn.node_name_list)
+        node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        n = len(self.node_ids)
+        self.elevations = np.zeros(n)
+        self.fixed = np.zeros(n, dtype=bool)
+        self.fixed_heads = np.zeros(n)
+        self.reservoir_patterns = []
+        self.tanks = []
+        for i, node_id in enumerate(self.node_ids):
+            node = wn.get_node(node_id)
+            if node.node_type == 'Junction':
+                self.elevations[i] = node.elevation
+                if node.emitter_coefficient:
+                    raise SolverNotSupported(f"节点 {node_id} 设置了射流器")
+            elif node.node_type == 'Reservoir':
+                self.fixed[i] = True
+                self.fixed_heads[i] = node.head_timeseries.base_value
+                self.elevations[i] = self.fixed_heads[i]
+                if node.head_pattern_name:
+                    self.reservoir_patterns.append((i, wn.get_pattern(node.head_pattern_name)))
+            else:
+                # 水箱在稳态求解中取初始水位作为已知水头；处于上下限时流向受限，交给EPANET处理
+                if not node.min_level < node.init_level < node.max_level:
+                    raise SolverNotSupported(f"水箱 {node_id} 的初始水位处于上下限")
+                self.fixed[i] = True
+                self.elevations[i] = node.elevation
+                self.fixed_heads[i] = node.elevation + node.init_level
+                self.tanks.append(node_id)
+        self.unknown = np.flatnonzero(~self.fixed)
+        self.known = np.flatnonzero(self.fixed)
+
+        self._prepare_demands(wn, node_index)
+        self._prepare_links(wn, node_index)
+        self._prepare_controls(wn)
+
+    def _prepare_demands(self, wn, node_index):
+        """用户节点需水量 = 基本需水量矩阵 × 各时间模式在该时刻的系数"""
+        default_pattern = wn.options.hydraulic.pattern
+        if default_pattern not in wn.pattern_name_list:
+            default_pattern = None
+        self.patterns = []
+        pattern_index = {}
+        rows, columns, values = [], [], []
+        for junction_id in wn.junction_name_list:
+            for demand in wn.get_node(junction_id).demand_timeseries_list:
+                name = demand.pattern_name or default_pattern
+                if name not in pattern_index:
+                    pattern_index[name] = len(self.patterns)
+                    self.patterns.append(wn.get_pattern(name) if name is not None else None)
+                rows.append(node_index[junction_id])
+                columns.append(pattern_index[name])
+                values.append(demand.base_value)
+        self.demand_bases = csr_matrix((values, (rows, columns)), shape=(len(self.node_ids), len(self.patterns)))
+        self.demand_multiplier = wn.options.hydraulic.demand_multiplier
+
+    def _prepare_links(self, wn, node_index):
+        self.link_ids = list(wn.link_name_list)
+        self.link_index = {link_id: k for k, link_id in enumerate(self.link_ids)}
+        count = len(self.link_ids)
+        self.kinds = np.zeros(count, dtype=np.int8)
+        self.ends = np.zeros((count, 2), dtype=np.int64)
+        self.lengths = np.zeros(count)
+        self.diameters = np.zeros(count)
+        self.roughness = np.zeros(count)
+        # 局部损失 m·|Q|·Q 的系数 m = K / (2g·A²)
+        self.minor = np.zeros(count)
+        self.check_valves = np.zeros(count, dtype=bool)
+        self.initial_open = np.ones(count, dtype=bool)
+        self.initial_settings = np.zeros(count)
+        # 水泵扬程曲线 h = A - B·Q^C 的系数，及设计流量（迭代初值）
+        self.pump_curves = np.zeros((count, 3))
+        self.design_flows = np.zeros(count)
+
+        for k, link_id in enumerate(self.link_ids):
+            link = wn.get_link(link_id)
+            self.ends[k] = node_index[link.start_node_name], node_index[link.end_node_name]
+            self.initial_open[k] = str(link.initial_status).lower() != 'closed'
+            if link.link_type == 'Pipe':
+                self.kinds[k] = PIPE
+                self.lengths[k] = link.length
+                self.diameters[k] = link.diameter
+                self.roughness[k] = link.roughness
+                self.initial_settings[k] = link.roughness
+                self.check_valves[k] = bool(link.check_valve)
+                self.minor[k] = link.minor_loss
+            elif link.link_type == 'Pump':
+                self.kinds[k] = PUMP
+                if link.pump_type != 'HEAD':
+                    raise SolverNotSupported(f"水泵 {link_id} 不是按扬程曲线定义的")
+                if link.speed_pattern_name:
+                    raise SolverNotSupported(f"水泵 {link_id} 设置了转速模式")
+                try:
+                    self.pump_curves[k] = link.get_head_curve_coefficients()
+                except Exception as e:
+                    raise SolverNotSupported(f"水泵 {link_id} 的扬程曲线无法拟合: {str(e)}")
+                points = link.get_pump_curve().points
+                self.design_flows[k] = points[len(points) // 2][0]
+                self.initial_settings[k] = link.speed_timeseries.base_value
+            else:
+                self.kinds[k] = VALVE
+                self.diameters[k] = link.diameter
+                status = str(link.initial_status).lower()
+                # 状态固定为开启的阀门按普通管段处理，TCV在调节状态下按设定值作为局部损失系数
+                if link.valve_type == 'TCV' and status == 'active':
+                    self.minor[k] = link.initial_setting
+                elif status == 'active':
+                    raise SolverNotSupported(f"阀门 {link_id}（{link.valve_type}）处于调节状态")
+                else:
+                    self.minor[k] = link.minor_loss
+                self.initial_settings[k] = link.initial_setting or 0.0
+
+        self.areas = np.pi * self.diameters ** 2 / 4
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.minor = np.where(self.areas > 0, self.minor / (2 * GRAVITY * self.areas ** 2), 0.0)
+        pipes = self.kinds == PIPE
+        self.hw = np.zeros(count)
+        if self.headloss == 'H-W':
+            self.hw[pipes] = (10.667 * self.lengths[pipes]
+                              / (self.roughness[pipes] ** 1.852 * self.diameters[pipes] ** 4.871))
+        # 关联矩阵：管段从起点流向终点为正，B[k, 起点] = 1，B[k, 终点] = -1
+        rows = np.repeat(np.arange(count), 2)
+        incidence = csr_matrix((np.tile([1.0, -1.0], count), (rows, self.ends.ravel())),
+                               shape=(count, len(self.node_ids)))
+        self.incidence_unknown = incidence[:, self.unknown].tocsc()
+        self.incidence_known = incidence[:, self.known].tocsc()
+        self.incidence = incidence
+
+    def _prepare_controls(self, wn):
+        """整理简单控制：定时控制 (时间, 顺序, 管段, 属性, 值) 和水箱水位控制"""
+        self.timer_controls = []
+        self.level_controls = []
+        for order, (name, control) in enumerate(wn.controls()):
+            if not isinstance(control, Control):
+                raise SolverNotSupported(f"不支持规则控制 {name}")
+            condition = control.condition
+            actions = []
+            for action in control.actions():
+                link, attribute = action.target()
+                if attribute not in ('status', 'setting', 'base_speed') or link.name not in self.link_index:
+                    raise SolverNotSupported(f"控制 {name} 的动作不受支持")
+                actions.append((self.link_index[link.name], attribute, action._value))
+            if isinstance(condition, SimTimeCondition) and not condition._repeat:
+                for action in actions:
+                    self.timer_controls.append((condition._threshold, order) + action)
+            elif isinstance(condition, TankLevelCondition) and condition._source_attr == 'level':
+                if condition._relation in (Comparison.lt, Comparison.le):
+                    below = True
+                elif condition._relation in (Comparison.gt, Comparison.ge):
+                    below = False
+                else:
+                    raise SolverNotSupported(f"控制 {name} 的条件不受支持")
+                tank = condition._source_obj
+                for action in actions:
+                    self.level_controls.append((tank.init_level, below, condition._threshold) + action)
+            else:
+                raise SolverNotSupported(f"控制 {name} 的条件不受支持")
+        self.timer_controls.sort(key=lambda control: control[:2])
+
+    def supports_time(self, t):
+        """有水箱时只有0时刻的水位已知，没有水箱时任意时刻都可以单独求解"""
+        return t == 0 or not self.tanks
+
+    def report_time(self, hour):
+        """与EPANET延时模拟结果中最接近指定小时的报告时刻相同"""
+        return report_time(self.time_options, hour)
+
+    def _link_state(self, t):
+        """t时刻的管段开关状态和设定值（初始状态上依次执行已经触发的控制）"""
+        is_open = self.initial_open.copy()
+        settings = self.initial_settings.copy()
+
+        def apply(k, attribute, value):
+            if attribute == 'status':
+                is_open[k] = int(value) != 0
+            else:
+                settings[k] = value
+                if self.kinds[k] == PUMP:
+                    is_open[k] = value > 0
+
+        for threshold, _, k, attribute, value in self.timer_controls:
+            if threshold <= t:
+                apply(k, attribute, value)
+        # 水位控制只在0时刻使用（supports_time 保证有水箱时 t == 0），与EPANET一样带水头容差
+        for level, below, threshold, k, attribute, value in self.level_controls:
+            if (level <= threshold + HEAD_TOL) if below else (level >= threshold - HEAD_TOL):
+                apply(k, attribute, value)
+        return is_open, settings
+
+    def _losses(self, flows, is_open, settings):
+        """各管段的水头损失 h(Q) 和梯度 dh/dQ（水泵为负的扬程）"""
+        q = np.abs(flows)
+        losses = np.zeros_like(flows)
+        gradients = np.zeros_like(flows)
+
+        pipes = self.kinds == PIPE
+        if self.headloss == 'H-W':
+            qp = q[pipes]
+            losses[pipes] = self.hw[pipes] * qp ** 0.852 * flows[pipes]
+            gradients[pipes] = 1.852 * self.hw[pipes] * qp ** 0.852
+        else:
+            # Swamee-Jain 摩阻系数，层流区 f = 64/Re；忽略 f 对流量的导数（与EPANET 2.0相同）
+            d = self.diameters[pipes]
+            area = self.areas[pipes]
+            qp = np.maximum(q[pipes], 1e-12)
+            reynolds = qp / area * d / self.viscosity
+            with np.errstate(divide='ignore', invalid='ignore'):
+                turbulent = 0.25 / np.log10(self.roughness[pipes] / (3.7 * d) + 5.74 / reynolds ** 0.9) ** 2
+            friction = np.where(reynolds < 2000, 64 / np.maximum(reynolds, 1e-12), turbulent)
+            resistance = friction * self.lengths[pipes] / (2 * GRAVITY * d * area ** 2)
+            losses[pipes] = resistance * qp * flows[pipes]
+            gradients[pipes] = np.where(reynolds < 2000, 1.0, 2.0) * resistance * qp
+        losses += self.minor * q * flows
+        gradients += 2 * self.minor * q
+
+        pumps = self.kinds == PUMP
+        if pumps.any():
+            a, b, c = self.pump_curves[pumps].T
+            speed = settings[pumps]
+            qp = np.maximum(q[pumps], 1e-12)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                coefficient = b * np.where(speed > 0, speed, 1.0) ** (2 - c)
+            losses[pumps] = -speed ** 2 * a + coefficient * qp ** c
+            gradients[pumps] = c * coefficient * qp ** (c - 1)
+
+        # 梯度过小时按线性关系处理（EPANET的RQtol），y = Q
+        small = gradients < RQ_TOL
+        gradients[small] = RQ_TOL
+        losses[small] = RQ_TOL * flows[small]
+        return losses, gradients
+
+    def solve(self, t=0):
+        """
+        求解t时刻的稳态水力状态
+
+        参数:
+            t (int): 模拟时间（秒），决定需水量模式系数、水池水头模式和已触发的控制
+
+        返回:
+            SimulationArrays: 只有一个时间步的结果，变量与EPANET模拟结果相同
+        """
+        if not self.supports_time(t):
+            raise SolverNotSupported("有水箱的管网只能单独求解0时刻")
+        multipliers = np.array([_pattern_value(pattern, t) for pattern in self.patterns])
+        demands = (self.demand_bases @ multipliers) * self.demand_multiplier if len(multipliers) else \
+            np.zeros(len(self.node_ids))
+        heads = self.fixed_heads.copy()
+        for i, pattern in self.reservoir_patterns:
+            heads[i] *= pattern.at(t)
+        known_heads = heads[self.known]
+
+        is_open, settings = self._link_state(t)
+        pumps = self.kinds == PUMP
+        is_open &= ~(pumps & (settings <= 0))
+        # 求解器自行判断的关闭状态：止回阀反向、水泵扬程不足
+        closed_by_status = np.zeros_like(is_open)
+        flows = np.where(pumps, np.maximum(self.design_flows, 1e-6), INITIAL_VELOCITY * self.areas)
+
+        demand_unknown = demands[self.unknown]
+        b_unknown, b_known = self.incidence_unknown, self.incidence_known
+        b_unknown_t = b_unknown.T.tocsr()
+        converged = False
+        for trial in range(1, max(self.trials, 1) + 1):
+            losses, gradients = self._losses(flows, is_open, settings)
+            conductance = 1.0 / gradients
+            y = conductance * losses
+            closed = ~is_open | closed_by_status
+            conductance[closed] = CLOSED_CONDUCTANCE
+            y[closed] = flows[closed]
+
+            # (B_uᵀ P B_u) H_u = -B_uᵀ (Q - y) - D_u - B_uᵀ P B_k H_k
+            weighted = b_unknown.multiply(conductance[:, None]).tocsc()
+            matrix = (b_unknown_t @ weighted).tocsc()
+            rhs = -(b_unknown_t @ (flows - y)) - demand_unknown - b_unknown_t @ (conductance * (b_known @ known_heads))
+            heads[self.unknown] = spsolve(matrix, rhs)
+
+            difference = self.incidence @ heads
+            new_flows = flows - y + conductance * difference
+            change = np.abs(new_flows - flows).sum() / max(np.abs(new_flows).sum(), 1e-12)
+            flows = new_flows
+
+            if change <= self.accuracy:
+                changed = self._check_status(flows, difference, is_open, settings, closed_by_status)
+                if not changed:
+                    converged = True
+                    break
+        if not converged:
+            raise SolverNotConverged(f"{self.trials} 次迭代内未收敛")
+        return self._results(t, heads, flows, demands, is_open & ~closed_by_status, settings)
+
+    def _check_status(self, flows, difference, is_open, settings, closed_by_status):
+        """止回阀和水泵的状态检查（就地更新 closed_by_status），返回状态是否有变化"""
+        before = closed_by_status.copy()
+        cv = self.check_valves & is_open
+        # 止回阀：反向流动或下游水头更高时关闭
+        closed_by_status[cv] = (difference[cv] < -HEAD_TOL) | ((difference[cv] <= HEAD_TOL) & (flows[cv] < 0))
+        pumps = (self.kinds == PUMP) & is_open
+        if pumps.any():
+            # 水泵：需要的扬程超过关死扬程时关闭
+            shutoff = settings[pumps] ** 2 * self.pump_curves[pumps, 0]
+            closed_by_status[pumps] = -difference[pumps] > shutoff + HEAD_TOL
+        return bool((before != closed_by_status).any())
+
+    def _results(self, t, heads, flows, demands, is_open, settings):
+        flows = np.where(is_open, flows, 0.0)
+        node_values = np.zeros((len(self.node_ids), 1, len(NODE_VARIABLES)), dtype=np.float32)
+        pressure = heads - self.elevations
+        # 水池压力为0；水箱和水池的需水量为净流入量（向管网供水时为负）
+        inflow = -(self.incidence.T @ flows)
+        net_demand = np.where(self.fixed, inflow, demands)
+        pressure[self.fixed & (self.elevations == self.fixed_heads)] = 0.0
+        node_values[:, 0, NODE_COLUMN['demand']] = net_demand
+        node_values[:, 0, NODE_COLUMN['head']] = heads
+        node_values[:, 0, NODE_COLUMN['pressure']] = pressure
+
+        difference = self.incidence @ heads
+        link_values = np.zeros((len(self.link_ids), 1, len(LINK_VARIABLES)), dtype=np.float32)
+        pipes = self.kinds == PIPE
+        with np.errstate(divide='ignore', invalid='ignore'):
+            velocity = np.where(self.areas > 0, np.abs(flows) / self.areas, 0.0)
+            # 管道为单位长度水头损失（m/m），水泵为负的扬程，阀门为水头损失（与wntr的结果一致）
+            headloss = np.where(pipes, np.abs(difference) / np.where(self.lengths > 0, self.lengths, 1.0), difference)
+        headloss[~is_open] = 0.0
+        velocity[self.kinds == PUMP] = 0.0
+        link_values[:, 0, LINK_COLUMN['flowrate']] = flows
+        link_values[:, 0, LINK_COLUMN['velocity']] = velocity
+        link_values[:, 0, LINK_COLUMN['headloss']] = headloss
+        link_values[:, 0, LINK_COLUMN['status']] = is_open.astype(np.float32)
+        link_values[:, 0, LINK_COLUMN['setting']] = settings
+        return SimulationArrays(self.node_ids, self.link_ids, [t], node_values, link_values)
+
+
+def _build_hydraulic_arrays(wn):
+    try:
+        return HydraulicArrays(wn)
+    except SolverNotSupported as e:
+        # 不支持的管网也缓存结果，避免每次请求都重新检查
+        return e
+
+
+def get_hydraulic_arrays(digest):
+    """获取管网版本的稳态求解数组（随模型缓存在 NETWORK_STORE 中），不支持时抛出 SolverNotSupported"""
+    arrays = NETWORK_STORE.get_artifact(digest, 'hydraulic_arrays', _build_hydraulic_arrays)
+    if isinstance(arrays, SolverNotSupported):
+        raise arrays
+    return arrays
+
+
+def solve_snapshot(digest, hour=0):
+    """
+    用进程内的GGA求解器计算单个时刻的结果，结果按 (管网版本, 时刻) 缓存
+
+    参数:
+        digest (str): 管网内容哈希（模型须已在 NETWORK_STORE 中）
+        hour (float): 要获取的模拟时间（小时），取最接近的报告时刻
+
+    返回:
+        SimulationArrays: 只有一个时间步的结果；管网或时刻不受支持、或未收敛时返回None，
+        调用方应退回完整的EPANET模拟
+    """
+    if not config.SNAPSHOT_SOLVER_ENABLED:
+        return None
+    try:
+        arrays = get_hydraulic_arrays(digest)
+        t = arrays.report_time(hour)
+        if not arrays.supports_time(t):
+            return None
+        key = SimulationCache.make_key(digest, {'solver': 'gga', 'time': t})
+        results = SIMULATION_CACHE.get(key)
+        if results is not None:
+            return results
+        started = time.perf_counter()
+        results = arrays.solve(t)
+        print(f"GGA稳态求解完成: t={t}秒, 用时 {(time.perf_counter() - started) * 1000:.1f} ms")
+    except (SolverNotSupported, SolverNotConverged) as e:
+        print(f"GGA稳态求解不可用，改用EPANET模拟: {str(e)}")
+        return None
+    SIMULATION_CACHE.put(key, results)
+    return results
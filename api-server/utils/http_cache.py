@@ -0,0 +1,105 @@
+"""
+按管网版本预先序列化的响应与条件GET
+
+管网拓扑只在上传或编辑INP文件后变化，而前端会反复轮询拓扑数据接口：
+- 响应体按管网内容哈希构建并序列化一次，缓存在 NETWORK_STORE 中，随模型一起淘汰
+- ETag 由管网内容哈希和响应种类得出，无需构建响应体即可判断客户端缓存是否有效
+- 客户端带 If-None-Match / If-Modified-Since 且未变化时直接返回 304，不解析、不序列化、不传输响应体
+- 按请求协商的格式、结构和压缩方式（见 utils/response_encoding.py）得到的各种表示也只编码一次，
+  各自有不同的ETag
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+from flask import Response, current_app, request
+
+import config
+from utils.network_store import NETWORK_STORE
+from utils.response_encoding import (MSGPACK_MIMETYPE, compress, encoded_etag, negotiate_encoding,
+                                     negotiate_format, negotiate_shape)
+
+
+class PreparedResponse:
+    """预先序列化的JSON响应体，以及按需生成并缓存的其他表示"""
+
+    def __init__(self, body):
+        self.body = body
+        # (格式, 结构, 压缩方式) -> (响应体, 实际使用的压缩方式)
+        self._variants = {}
+
+    def variant(self, response_format, shape, encoding):
+        """指定表示的响应体，第一次请求时由JSON响应体转换得到"""
+        key = (response_format, shape, encoding)
+        cached = self._variants.get(key)
+        if cached is None:
+            body = self.body
+            if response_format != 'json' or shape is not None:
+                body = current_app.json.encode(json.loads(body), response_format, shape)
+            used = encoding if encoding is not None and len(body) >= config.RESPONSE_COMPRESS_MIN_BYTES else None
+            cached = self._variants.setdefault(key, (compress(body, used), used))
+        return cached
+
+
+def version_etag(digest, name):
+    """管网版本和响应种类对应的ETag（不含引号）"""
+    return hashlib.sha1(f"{digest}:{name}".encode('utf-8')).hexdigest()
+
+
+def file_last_modified(path):
+    """INP文件的修改时间（HTTP日期精确到秒）"""
+    return datetime.fromtimestamp(int(os.stat(path).st_mtime), tz=timezone.utc)
+
+
+def not_modified(etag, last_modified):
+    """
+    客户端缓存是否仍然有效
+
+    有 If-None-Match 时只比较ETag，否则比较 If-Modified-Since
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since is not None and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def _make_response(status, etag, last_modified, body=b'', mimetype='application/json', encoding=None):
+    response = Response(body, status=status, mimetype=mimetype)
+    response.set_etag(etag)
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # 允许浏览器缓存，但每次使用前都要向服务器校验
+    response.cache_control.no_cache = True
+    return response
+
+
+def cached_json_response(digest, name, build, inp_file_path=None):
+    """
+    返回按管网版本缓存的JSON响应，客户端缓存有效时返回304
+
+    参数:
+        digest (str): 管网内容哈希（模型须已在 NETWORK_STORE 中）
+        name (str): 响应种类，同一管网版本的不同响应用不同名称区分
+        build (callable): 构建响应数据的函数 build()，只在该版本第一次请求时调用
+        inp_file_path (str): INP文件路径，用其修改时间作为 Last-Modified
+
+    返回:
+        Response: 200（预先序列化的响应体）或 304
+    """
+    response_format, shape, encoding = negotiate_format(), negotiate_shape(), negotiate_encoding()
+    etag = encoded_etag(version_etag(digest, name), response_format, shape, encoding)
+    last_modified = file_last_modified(inp_file_path) if inp_file_path else None
+    if not_modified(etag, last_modified):
+        return _make_response(304, etag, last_modified)
+
+    # 响应数据由 build 自行读取所需的模型，派生版本无需为此构建完整模型
+    prepared = NETWORK_STORE.get_artifact(digest, f"response:{name}",
+                                          lambda: PreparedResponse(current_app.json.encode(build())), model=False)
+    body, used = prepared.variant(response_format, shape, encoding)
+    mimetype = MSGPACK_MIMETYPE if response_format == 'msgpack' else 'application/json'
+    return _make_response(200, etag, last_modified, body, mimetype, used)
@@ -0,0 +1,297 @@
+"""
+异步任务子系统
+
+耗时的模拟/调度/绘图任务提交到有界线程池中运行，提交后立即返回任务ID，
+通过任务ID查询状态、进度和结果，或取消任务。每个任务有运行时间上限。
+
+Python线程无法被强制终止，因此取消和超时采用协作方式：
+任务被取消或超时后立即标记为结束、结果被丢弃，任务函数在下一个检查点
+（JobContext.check / JobContext.run_subprocess）退出，子进程会被直接终止。
+"""
+import subprocess
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+# 任务状态
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMEOUT = 'timeout'
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED, TIMEOUT)
+
+# 二进制任务结果（例如热力图PNG）
+BinaryResult = namedtuple('BinaryResult', ['data', 'mimetype', 'download_name'])
+
+
+class JobCancelled(Exception):
+    """任务已被取消或超时"""
+
+
+class JobContext:
+    """传给任务函数的上下文，用于汇报进度和检查是否需要退出"""
+
+    def __init__(self, job):
+        self._job = job
+
+    @property
+    def cancelled(self):
+        return self._job.cancel_event.is_set()
+
+    def check(self):
+        """任务已被取消或超时时抛出 JobCancelled"""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def set_progress(self, progress, message=None):
+        """汇报进度（0~1）并检查是否需要退出"""
+        self._job.progress = progress
+        if message is not None:
+            self._job.message = message
+        self.check()
+
+    def run_subprocess(self, args, cwd=None, poll_interval=0.2):
+        """
+        运行子进程，任务被取消或超时时终止子进程
+
+        返回:
+            subprocess.CompletedProcess: 运行结果（文本模式）
+        """
+        proc = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=poll_interval)
+                return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                if self.cancelled:
+                    proc.kill()
+                    proc.communicate()
+                    raise JobCancelled()
+
+
+class Job:
+    """一个异步任务"""
+
+    def __init__(self, kind, time_limit):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = PENDING
+        self.progress = 0.0
+        self.message = None
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.time_limit = time_limit
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.context = JobContext(self)
+        # 任务结束后释放资源的函数（见 JobManager.register 的 release）
+        self.release = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def deadline(self):
+        if self.started_at is None or not self.time_limit:
+            return None
+        return self.started_at + self.time_limit
+
+    def wait(self, timeout=None):
+        """等待任务结束，返回任务是否已结束"""
+        return self.done_event.wait(timeout)
+
+    def to_dict(self):
+        """任务状态（不含结果）"""
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': round(self.progress, 4),
+            'message': self.message,
+            'error': self.error,
+            'time_limit': self.time_limit,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    """有界线程池上的任务调度器"""
+
+    def __init__(self, max_workers, default_time_limit, history_size):
+        self.default_time_limit = default_time_limit
+        self.history_size = history_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._kinds = {}
+        self._prepares = {}
+        self._releases = {}
+        self._jobs = OrderedDict()
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._watchdog = None
+
+    def register(self, kind, func, prepare=None, release=None):
+        """
+        注册任务类型
+
+        参数:
+            kind (str): 任务类型
+            func (callable): 任务函数，签名为 func(context, **params)
+            prepare (callable): 检查客户端参数的函数，签名为 prepare(request_params)，返回传给任务函数的参数，
+                                参数错误时抛出ValueError；未提供时该类型的任务不接受客户端参数（见 prepare）
+            release (callable): 任务结束（或排队时被取消）后调用 release(params)，释放 prepare 占用的资源
+        """
+        self._kinds[kind] = func
+        if prepare is not None:
+            self._prepares[kind] = prepare
+        if release is not None:
+            self._releases[kind] = release
+
+    @property
+    def kinds(self):
+        return sorted(self._kinds)
+
+    def prepare(self, kind, request_params):
+        """
+        检查客户端提交的任务参数，返回传给任务函数的参数
+
+        任务函数的参数中有版本哈希等由服务端确定的值，客户端参数必须经过该类型注册的检查函数，
+        客户端不能直接指定任务函数的参数。参数错误时抛出ValueError
+        """
+        if kind not in self._kinds:
+            raise KeyError(f"未知的任务类型: {kind}")
+        if not isinstance(request_params, dict):
+            raise ValueError("任务参数必须是JSON对象")
+        prepare = self._prepares.get(kind)
+        if prepare is None:
+            raise ValueError(f"任务类型 {kind} 不接受客户端参数")
+        return prepare(request_params)
+
+    def submit(self, kind, params=None, time_limit=None):
+        """
+        提交任务，立即返回
+
+        参数:
+            kind (str): 已注册的任务类型
+            params (dict): 传给任务函数的关键字参数（客户端参数先经过 prepare 检查）
+            time_limit (float): 运行时间上限（秒），默认使用配置值
+
+        返回:
+            Job: 新建的任务
+        """
+        if kind not in self._kinds:
+            raise KeyError(f"未知的任务类型: {kind}")
+        job = Job(kind, time_limit or self.default_time_limit)
+        release = self._releases.get(kind)
+        if release is not None:
+            job.release = lambda: release(params or {})
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+            self._start_watchdog()
+            self._futures[job.id] = self._executor.submit(self._run, job, self._kinds[kind], params or {})
+        return job
+
+    def get(self, job_id):
+        """按ID获取任务，不存在返回None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """取消任务，返回任务是否由本次调用取消"""
+        job = self.get(job_id)
+        if job is None:
+            return False
+        job.cancel_event.set()
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            # 任务还未开始运行，_run 不会再被调用
+            self._release(job)
+        return self._finish(job, CANCELLED, error='任务已取消')
+
+    def _run(self, job, func, params):
+        try:
+            with self._lock:
+                if job.status != PENDING:
+                    return
+                job.status = RUNNING
+                job.started_at = time.time()
+            try:
+                result = func(job.context, **params)
+            except JobCancelled:
+                # 状态已由 cancel 或超时检查设置
+                return
+            except Exception as e:
+                self._finish(job, FAILED, error=str(e), traceback=traceback.format_exc())
+            else:
+                self._finish(job, SUCCEEDED, result=result, progress=1.0)
+        finally:
+            # 被取消或超时的任务在任务函数真正退出后才释放资源
+            self._release(job)
+
+    def _release(self, job):
+        release, job.release = job.release, None
+        if release is not None:
+            try:
+                release()
+            except Exception:
+                print(f"释放任务 {job.id} 的资源时出错:\n{traceback.format_exc()}")
+
+    def _finish(self, job, status, **fields):
+        with self._lock:
+            if job.finished:
+                return False
+            job.status = status
+            job.finished_at = time.time()
+            for name, value in fields.items():
+                setattr(job, name, value)
+            self._futures.pop(job.id, None)
+        if status in (CANCELLED, TIMEOUT):
+            job.cancel_event.set()
+        job.done_event.set()
+        return True
+
+    def _prune(self):
+        # 只保留最近的若干个已结束任务
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history_size)]:
+            del self._jobs[job_id]
+
+    def _start_watchdog(self):
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name='job-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(0.5)
+            now = time.time()
+            for job in self.list():
+                # 单个任务出错不能让检查线程退出，否则之后所有任务的时间上限都不再生效
+                try:
+                    deadline = job.deadline
+                    if job.status == RUNNING and deadline is not None and now > deadline:
+                        self._finish(job, TIMEOUT, error=f"任务运行超过时间上限 {job.time_limit} 秒")
+                except Exception:
+                    print(f"检查任务 {job.id} 的时间上限时出错:\n{traceback.format_exc()}")
+
+
+JOB_MANAGER = JobManager(config.JOB_WORKERS, config.JOB_TIME_LIMIT, config.JOB_HISTORY_SIZE)
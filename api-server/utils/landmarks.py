@@ -0,0 +1,217 @@
+"""
+基于地标（ALT）的最短路径距离索引
+
+全节点对距离矩阵不适用于十万节点以上的城市级管网，此时用地标索引回答任意节点对的距离查询：
+- 按最远点策略选出若干分布均匀的地标节点，预先计算每个地标到所有节点的距离
+- 查询时用三角不等式 |d(L,t) - d(L,v)| 作为A*搜索的下界，并与由节点坐标得到的
+  直线距离下界取较大者（坐标按全部管段中 管长/直线长度 的最小比值换算为管长）
+- 同一起点的查询较多时改为从该起点做一次完整的Dijkstra
+"""
+import heapq
+
+import numpy as np
+
+import config
+from utils.distance_matrix import get_distance_matrix
+from utils.network_graph import get_network_graph
+from utils.network_store import NETWORK_STORE
+
+# 同一起点的查询数达到该值时，从起点做一次完整的Dijkstra代替逐个A*搜索
+FULL_SEARCH_THRESHOLD = 8
+# 每次A*搜索使用的地标个数
+ACTIVE_LANDMARKS = 4
+
+
+class LandmarkIndex:
+    """地标距离索引"""
+
+    def __init__(self, wn, graph, landmark_count):
+        self.graph = graph
+        self.node_ids = graph.node_ids
+        self.node_index = graph.node_index
+        self.components = graph.components
+        n = len(graph)
+        self._indptr, self._indices, self._weights = graph.adjacency_lists()
+
+        # 最远点策略选地标：第一个取离0号节点最远的节点，之后每次取离已选地标最远的节点
+        # （不连通的节点距离为inf，会优先被选中，因此每个连通分量都会有地标）
+        self.landmarks = []
+        rows = []
+        nearest = graph.shortest_distances(0) if n else np.zeros(0)
+        for _ in range(min(landmark_count, n)):
+            candidates = nearest.copy()
+            candidates[self.landmarks] = -1
+            landmark = int(np.argmax(candidates))
+            row = graph.shortest_distances(landmark)
+            self.landmarks.append(landmark)
+            rows.append(row)
+            nearest = row if len(rows) == 1 else np.minimum(nearest, row)
+        self.landmark_distances = np.array(rows).reshape(len(rows), n)
+
+        self.coordinates, self.coordinate_scale = self._coordinate_bound(wn)
+
+    def _coordinate_bound(self, wn):
+        """节点坐标及其换算为管长下界的比例；缺少坐标时比例为0（不使用坐标下界）"""
+        coordinates = np.zeros((len(self.node_ids), 2))
+        for i, node_id in enumerate(self.node_ids):
+            node_coordinates = wn.get_node(node_id).coordinates
+            if node_coordinates is None:
+                return coordinates, 0.0
+            coordinates[i] = node_coordinates
+
+        ends = self.graph.link_ends
+        straight = np.hypot(*(coordinates[ends[:, 0]] - coordinates[ends[:, 1]]).T)
+        valid = straight > 0
+        if not valid.any():
+            return coordinates, 0.0
+        # 任意路径的管长之和 >= 比例 × 各段直线长度之和 >= 比例 × 起终点直线距离
+        return coordinates, float(np.min(self.graph.link_weights[valid] / straight[valid]))
+
+    def lower_bounds(self, target, source=None):
+        """
+        所有节点到target的距离下界
+
+        给出source时只使用对该节点对下界最紧的 ACTIVE_LANDMARKS 个地标，减少每次查询的计算量
+        """
+        to_target = self.landmark_distances[:, target]
+        # 与target不连通的地标无法给出下界；与target不连通的节点不会被搜索到，其下界为inf也无妨
+        usable = np.flatnonzero(np.isfinite(to_target))
+        if source is not None and len(usable) > ACTIVE_LANDMARKS:
+            gaps = np.abs(to_target[usable] - self.landmark_distances[usable, source])
+            usable = usable[np.argsort(gaps)[-ACTIVE_LANDMARKS:]]
+
+        bounds = np.zeros(len(self.node_ids))
+        if len(usable):
+            bounds = np.abs(to_target[usable, None] - self.landmark_distances[usable]).max(axis=0)
+        if self.coordinate_scale > 0:
+            straight = np.hypot(*(self.coordinates - self.coordinates[target]).T)
+            bounds = np.maximum(bounds, self.coordinate_scale * straight)
+        return bounds
+
+    def bounded_pairs(self, sources, targets):
+        """
+        由地标距离批量计算节点对的距离上下界
+
+        返回:
+            tuple: (上下界相等的布尔数组, 上界数组)
+        """
+        from_sources = self.landmark_distances[:, sources]
+        to_targets = self.landmark_distances[:, targets]
+        # 不连通的节点对不在此判断，交给搜索处理
+        connected = self.components[sources] == self.components[targets]
+        with np.errstate(invalid='ignore'):
+            upper = np.min(from_sources + to_targets, axis=0) if len(self.landmarks) else np.full(len(sources), np.inf)
+            differences = np.abs(from_sources - to_targets)
+            lower = np.max(np.where(np.isfinite(differences), differences, 0), axis=0) if len(self.landmarks) else np.zeros(len(sources))
+        exact = connected & np.isfinite(upper) & (upper - lower <= 1e-9 * np.maximum(upper, 1))
+        return exact, upper
+
+    def astar(self, source, target):
+        """
+        A*搜索两节点间的最短路径
+
+        返回:
+            tuple: (距离, 节点序号路径)，不连通时为 (inf, None)
+        """
+        if self.components[source] != self.components[target]:
+            return float('inf'), None
+        h = self.lower_bounds(target, source).tolist()
+        indptr, indices, weights = self._indptr, self._indices, self._weights
+        dist = {source: 0.0}
+        parent = {source: -1}
+        closed = set()
+        heap = [(h[source], source)]
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in closed:
+                continue
+            if u == target:
+                return dist[u], self._path(parent, target)
+            closed.add(u)
+            du = dist[u]
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                nd = du + weights[k]
+                if v not in closed and nd < dist.get(v, float('inf')):
+                    dist[v] = nd
+                    parent[v] = u
+                    heapq.heappush(heap, (nd + h[v], v))
+        return float('inf'), None
+
+    @staticmethod
+    def _path(parent, target):
+        path = []
+        while target != -1:
+            path.append(target)
+            target = parent[target]
+        return path[::-1]
+
+    def query(self, pairs, include_paths=False, matrix=None):
+        """
+        批量查询节点对的最短路径距离
+
+        参数:
+            pairs (list): [(起点ID, 终点ID), ...]
+            include_paths (bool): 是否返回路径
+            matrix (DistanceMatrix): 全节点对距离矩阵，有则不需要路径时直接查表
+
+        返回:
+            tuple: (距离列表（不连通为inf）, 路径列表（节点ID列表，不连通为None；不需要路径时为None）)
+        """
+        sources = [self.node_index[source] for source, _ in pairs]
+        targets = [self.node_index[target] for _, target in pairs]
+        if matrix is not None and not include_paths:
+            rows = np.array([matrix.node_index[self.node_ids[i]] for i in sources], dtype=np.int64)
+            columns = np.array([matrix.node_index[self.node_ids[i]] for i in targets], dtype=np.int64)
+            return np.asarray(matrix.matrix[rows, columns], dtype=np.float64).tolist(), None
+
+        distances = [float('inf')] * len(pairs)
+        paths = [None] * len(pairs) if include_paths else None
+        by_source = {}
+        if include_paths:
+            pending = range(len(pairs))
+        else:
+            # 地标给出的上下界相等时（枝状管网中很常见）无需搜索
+            exact, bounds = self.bounded_pairs(sources, targets)
+            for k in np.flatnonzero(exact):
+                distances[k] = float(bounds[k])
+            pending = np.flatnonzero(~exact).tolist()
+        for k in pending:
+            by_source.setdefault(sources[k], []).append(k)
+
+        for source, queries in by_source.items():
+            if len(queries) >= FULL_SEARCH_THRESHOLD:
+                result = self.graph.shortest_distances(source, return_predecessors=include_paths)
+                row, predecessors = result if include_paths else (result, None)
+                for k in queries:
+                    distances[k] = float(row[targets[k]])
+                    if include_paths and np.isfinite(row[targets[k]]):
+                        paths[k] = self._predecessor_path(predecessors, targets[k])
+            else:
+                for k in queries:
+                    distances[k], path = self.astar(source, targets[k])
+                    if include_paths:
+                        paths[k] = path
+
+        if include_paths:
+            paths = [[self.node_ids[i] for i in path] if path is not None else None for path in paths]
+        return distances, paths
+
+    @staticmethod
+    def _predecessor_path(predecessors, target):
+        path = []
+        while target >= 0:
+            path.append(int(target))
+            target = predecessors[target]
+        return path[::-1]
+
+
+def get_landmark_index(digest):
+    """获取管网版本的地标索引（随模型缓存在 NETWORK_STORE 中）"""
+    return NETWORK_STORE.get_artifact(digest, 'landmark_index',
+                                      lambda wn: LandmarkIndex(wn, get_network_graph(digest), config.LANDMARK_COUNT))
+
+
+def query_distances(digest, pairs, include_paths=False):
+    """批量查询节点对的最短路径距离，参见 LandmarkIndex.query"""
+    return get_landmark_index(digest).query(pairs, include_paths, matrix=get_distance_matrix(digest))
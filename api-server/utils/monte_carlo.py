@@ -0,0 +1,262 @@
+"""
+需水量不确定性的蒙特卡洛分析
+
+按分布规格一次性生成 样本数×用户节点数 的需水量矩阵，分块分发到模拟进程池并行求解，
+统计各节点压力的分位数以及压力低于下限的概率。
+
+- 需水量矩阵和每个样本的压力结果都放在共享内存中（见 utils/shared_arrays.py）
+- 每个任务只打开一次EPANET工具箱项目，逐个样本用 ENsetnodevalue 修改基本需水量后重新求解，
+  不会为每个样本改写或重新生成INP文件
+
+分布规格（需水量单位为 m³/s）:
+    {"distribution": "uniform", "low": 0, "high": 0.01}
+    {"distribution": "normal", "mean": 1.0, "std": 0.1, "relative": true, "min": 0}
+    可选分布: uniform(low, high)、normal(mean, std)、lognormal(mean, sigma)、triangular(left, mode, right)
+    relative为true时抽样值作为原基本需水量的倍数；min/max为截断范围
+按优先级为每个用户节点选择分布: junctions中的节点规格 > classes中的需水类别规格 > default。
+需水类别为节点需水量的类别名，未设置时为其时间模式名。
+"""
+import json
+import math
+
+import numpy as np
+import wntr
+from wntr.epanet.util import FlowUnits, HydParam, from_si, to_si
+
+from utils.epanet_stepper import EN_PRESSURE, EN_REPORTSTEP, EN_REPORTSTART
+from utils.network_store import NETWORK_STORE
+from utils.result_arrays import report_time
+from utils.shared_arrays import SharedArrays
+from utils.sim_pool import SIM_POOL, worker_network, scratch_prefix
+
+EN_BASEDEMAND = 1
+
+DISTRIBUTIONS = {
+    'uniform': ('low', 'high'),
+    'normal': ('mean', 'std'),
+    'lognormal': ('mean', 'sigma'),
+    'triangular': ('left', 'mode', 'right'),
+}
+
+# 与 /network/generate-random 相同的默认分布
+DEFAULT_DISTRIBUTION = {'distribution': 'uniform', 'low': 0.0, 'high': 0.01}
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+# 每个进程池任务至多包含的样本数（兼顾分发开销和进度汇报的粒度）
+MAX_SAMPLES_PER_TASK = 100
+
+
+def normalize_distribution(spec):
+    """检查并规范化一个分布规格，不合法时抛出ValueError"""
+    if not isinstance(spec, dict):
+        raise ValueError("分布规格必须是JSON对象")
+    name = spec.get('distribution')
+    if name not in DISTRIBUTIONS:
+        raise ValueError(f"不支持的分布: {name}，可选: {list(DISTRIBUTIONS)}")
+
+    normalized = {'distribution': name, 'relative': bool(spec.get('relative', False))}
+    for key in DISTRIBUTIONS[name] + ('min', 'max'):
+        value = spec.get(key)
+        if value is None and key in ('min', 'max'):
+            continue
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+            raise ValueError(f"分布 {name} 的参数 {key} 必须是有限数值")
+        normalized[key] = float(value)
+
+    if name == 'uniform' and normalized['low'] > normalized['high']:
+        raise ValueError("uniform分布要求 low <= high")
+    if name in ('normal', 'lognormal') and normalized[DISTRIBUTIONS[name][1]] < 0:
+        raise ValueError(f"{name}分布的标准差不能为负数")
+    if name == 'triangular' and not normalized['left'] <= normalized['mode'] <= normalized['right']:
+        raise ValueError("triangular分布要求 left <= mode <= right")
+    return normalized
+
+
+def normalize_spec(wn, spec):
+    """
+    检查并规范化分布规格，不合法时抛出ValueError
+
+    返回:
+        tuple: (默认分布或None, {类别: 分布}, {节点ID: 分布})
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("分布规格必须是JSON对象")
+    default = spec.get('default')
+    default = normalize_distribution(default) if default is not None else None
+    classes = {str(name): normalize_distribution(dist) for name, dist in (spec.get('classes') or {}).items()}
+    junctions = {}
+    for junction_id, dist in (spec.get('junctions') or {}).items():
+        if junction_id not in wn.junction_name_list:
+            raise ValueError(f"节点 {junction_id} 不存在或不是用户节点")
+        junctions[junction_id] = normalize_distribution(dist)
+    return default, classes, junctions
+
+
+def demand_class(junction):
+    """用户节点的需水类别：需水量类别名，未设置时为时间模式名"""
+    if len(junction.demand_timeseries_list) == 0:
+        return None
+    demand = junction.demand_timeseries_list[0]
+    return demand.category or demand.pattern_name
+
+
+def _draw(rng, dist, size):
+    if dist['distribution'] == 'uniform':
+        return rng.uniform(dist['low'], dist['high'], size)
+    if dist['distribution'] == 'normal':
+        return rng.normal(dist['mean'], dist['std'], size)
+    if dist['distribution'] == 'lognormal':
+        return rng.lognormal(dist['mean'], dist['sigma'], size)
+    if dist['left'] == dist['right']:
+        return np.full(size, dist['left'])
+    return rng.triangular(dist['left'], dist['mode'], dist['right'], size)
+
+
+def sample_demands(wn, spec, samples, seed=None):
+    """
+    按分布规格生成需水量样本矩阵
+
+    参数:
+        wn (WaterNetworkModel): 管网模型（只读）
+        spec (dict): {"default": 分布, "classes": {类别: 分布}, "junctions": {节点ID: 分布}}
+        samples (int): 样本数
+        seed (int): 随机种子，相同的种子和管网得到相同的样本
+
+    返回:
+        tuple: (抽样的用户节点ID列表, 形状为(样本数, 节点数)的需水量矩阵(m³/s))
+    """
+    default, classes, junctions = normalize_spec(wn, spec)
+
+    # 分布相同的节点合为一组，每组一次抽取 样本数×组内节点数 个值
+    junction_ids = []
+    base_demands = []
+    groups = {}
+    for junction_id in wn.junction_name_list:
+        junction = wn.get_node(junction_id)
+        dist = junctions.get(junction_id) or classes.get(demand_class(junction)) or default
+        if dist is None:
+            continue
+        key = json.dumps(dist, sort_keys=True)
+        groups.setdefault(key, (dist, []))[1].append(len(junction_ids))
+        junction_ids.append(junction_id)
+        base_demands.append(junction.base_demand)
+
+    rng = np.random.default_rng(seed)
+    base_demands = np.array(base_demands, dtype=np.float64)
+    matrix = np.empty((samples, len(junction_ids)), dtype=np.float64)
+    for dist, columns in groups.values():
+        values = _draw(rng, dist, (samples, len(columns)))
+        if dist['relative']:
+            values = values * base_demands[columns]
+        if 'min' in dist or 'max' in dist:
+            values = np.clip(values, dist.get('min'), dist.get('max'))
+        matrix[:, columns] = values
+    return junction_ids, matrix
+
+
+def _solve_rows(en, rows, junction_indices, node_indices, flow_units, target_time, demands, pressures):
+    """逐个样本修改基本需水量并求解，结果写入pressures的对应行；返回失败的样本数"""
+    report_step = en.ENgettimeparam(EN_REPORTSTEP)
+    report_start = en.ENgettimeparam(EN_REPORTSTART)
+    failed = 0
+    en.ENopenH()
+    try:
+        for row in rows:
+            values = from_si(flow_units, demands[row].astype(np.float64), HydParam.Demand)
+            for index, value in zip(junction_indices, values):
+                en.ENsetnodevalue(index, EN_BASEDEMAND, float(value))
+            try:
+                en.ENinitH(0)
+                minimum = None
+                while True:
+                    t = en.ENrunH()
+                    if t >= report_start and (t - report_start) % report_step == 0:
+                        current = np.array([en.ENgetnodevalue(i, EN_PRESSURE) for i in node_indices])
+                        if target_time is not None:
+                            if t >= target_time:
+                                minimum = current
+                                break
+                        else:
+                            minimum = current if minimum is None else np.minimum(minimum, current)
+                    if en.ENnextH() <= 0:
+                        break
+                pressures[row] = to_si(flow_units, minimum, HydParam.Pressure)
+            except Exception as e:
+                # 该样本保持为NaN，不影响其他样本
+                print(f"样本 {row} 求解失败: {str(e)}")
+                failed += 1
+    finally:
+        en.ENcloseH()
+    return failed
+
+
+def _run_samples(digest, inp_file_path, blob, junction_ids, node_ids, rows, target_time, layout):
+    """在工作进程中用一个工具箱项目依次求解多个样本"""
+    wn = worker_network(digest, inp_file_path, blob)
+    with scratch_prefix() as file_prefix:
+        inp_file = file_prefix + '.inp'
+        wntr.network.io.write_inpfile(wn, inp_file, units=wn.options.hydraulic.inpfile_units)
+        en = wntr.epanet.toolkit.ENepanet()
+        en.ENopen(inp_file, file_prefix + '.rpt', '')
+        try:
+            flow_units = FlowUnits(en.ENgetflowunits())
+            junction_indices = [en.ENgetnodeindex(junction_id) for junction_id in junction_ids]
+            node_indices = [en.ENgetnodeindex(node_id) for node_id in node_ids]
+            with SharedArrays.attach(layout) as shared:
+                return _solve_rows(en, rows, junction_indices, node_indices, flow_units, target_time,
+                                   shared['demands'], shared['pressures'])
+        finally:
+            en.ENclose()
+
+
+def run_monte_carlo(digest, spec, samples, seed=None, pressure_floor=20.0, percentiles=DEFAULT_PERCENTILES,
+                    hour=None, inp_file_path=None, callback=None):
+    """
+    需水量不确定性的蒙特卡洛分析
+
+    参数:
+        digest (str): 管网内容哈希（模型须已在 NETWORK_STORE 中）
+        spec (dict): 分布规格，格式见模块说明
+        samples (int): 样本数
+        seed (int): 随机种子
+        pressure_floor (float): 压力下限(m)
+        percentiles (list): 要计算的压力分位数
+        hour (float): 为None时统计每个样本模拟期内的最低压力，否则统计该小时（最近的报告时刻）的压力
+        inp_file_path (str): 管网INP文件路径，供工作进程加载模型
+        callback (callable): 每完成一个任务调用 callback(完成数, 总数)
+
+    返回:
+        dict: node_ids、各分位数的压力 percentiles、平均压力 mean、
+              低于压力下限的概率 violation_probability，以及有效和失败的样本数
+    """
+    wn = NETWORK_STORE.get_by_digest(digest, copy=False)
+    junction_ids, matrix = sample_demands(wn, spec, samples, seed)
+    if len(junction_ids) == 0:
+        raise ValueError("分布规格没有覆盖任何用户节点")
+    node_ids = list(wn.junction_name_list)
+
+    # 取与请求小时最近的报告时刻
+    target_time = report_time(wn.options.time, hour) if hour is not None else None
+
+    task_size = min(MAX_SAMPLES_PER_TASK, max(1, math.ceil(samples / (max(SIM_POOL.workers, 1) * 4))))
+    with SharedArrays.create({'demands': matrix.shape, 'pressures': (samples, len(node_ids))}) as shared:
+        shared['demands'][:] = matrix
+        tasks = [(junction_ids, node_ids, range(start, min(start + task_size, samples)), target_time, shared.layout)
+                 for start in range(0, samples, task_size)]
+        failures = SIM_POOL.map_network(_run_samples, digest, inp_file_path, tasks, callback=callback)
+        pressures = np.array(shared['pressures'], dtype=np.float64)
+
+    valid = pressures[~np.isnan(pressures).any(axis=1)]
+    if len(valid) == 0:
+        raise RuntimeError("所有样本求解失败")
+    percentile_values = np.percentile(valid, percentiles, axis=0)
+    return {
+        'node_ids': node_ids,
+        'sampled_junctions': junction_ids,
+        'percentiles': {str(p): values for p, values in zip(percentiles, percentile_values)},
+        'mean': valid.mean(axis=0),
+        'violation_probability': (valid < pressure_floor).mean(axis=0),
+        'samples': len(valid),
+        'failed_samples': int(sum(failures)),
+        'target_time': target_time,
+    }
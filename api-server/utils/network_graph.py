@@ -0,0 +1,111 @@
+"""
+管网拓扑图（CSR）
+
+每个管网版本只构建一次，所有接口共用：
+- 节点以整数编号，邻接关系保存为CSR数组 indptr / indices / weights（双向，保持管段顺序，并联管段各占一条边）
+- matrix 为 scipy.sparse 邻接矩阵（并联管段取最短者），遍历算法使用 scipy.sparse.csgraph 的编译实现：
+  Dijkstra、多源最近点、连通分量
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+
+from utils.network_store import NETWORK_STORE
+
+# 与已选监测点不连通的节点的距离（沿用原覆盖率计算的约定）
+UNREACHABLE = 1e9
+
+
+def link_weight(link):
+    """管段长度作为距离，没有长度的元件（水泵、阀门）记为1"""
+    return link.length if hasattr(link, 'length') and link.length else 1
+
+
+class NetworkGraph:
+    """管网拓扑图"""
+
+    def __init__(self, wn):
+        self.node_ids = list(wn.node_name_list)
+        self.node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.link_ids = list(wn.link_name_list)
+        n = len(self.node_ids)
+
+        starts, ends, weights = [], [], []
+        for link_id in self.link_ids:
+            link = wn.get_link(link_id)
+            starts.append(self.node_index[link.start_node_name])
+            ends.append(self.node_index[link.end_node_name])
+            weights.append(link_weight(link))
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+        weights = np.array(weights, dtype=np.float64)
+        self.link_ends = np.stack([starts, ends], axis=1) if len(starts) else np.zeros((0, 2), dtype=np.int64)
+        self.link_weights = weights
+
+        # 双向边按 (起点, 管段顺序) 稳定排序得到CSR数组
+        sources = np.concatenate([starts, ends])
+        targets = np.concatenate([ends, starts])
+        edge_links = np.concatenate([np.arange(len(starts)), np.arange(len(starts))])
+        order = np.lexsort((edge_links, sources))
+        self.indices = targets[order]
+        self.weights = weights[edge_links[order]]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=self.indptr[1:])
+
+        # 供csgraph使用的邻接矩阵：并联管段只保留最短者（csr_matrix会把重复项相加）
+        shortest = {}
+        for i, j, w in zip(sources.tolist(), targets.tolist(), np.concatenate([weights, weights]).tolist()):
+            if (i, j) not in shortest or w < shortest[(i, j)]:
+                shortest[(i, j)] = w
+        if shortest:
+            pairs = np.array(list(shortest.keys()), dtype=np.int64)
+            self.matrix = csr_matrix((np.array(list(shortest.values())), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+        else:
+            self.matrix = csr_matrix((n, n))
+
+        self.component_count, self.components = connected_components(self.matrix, directed=False)
+        self._adjacency_lists = None
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def neighbors(self, node_id):
+        """节点的相邻节点ID（按管段顺序，并联管段会重复出现）"""
+        i = self.node_index[node_id]
+        return [self.node_ids[j] for j in self.indices[self.indptr[i]:self.indptr[i + 1]].tolist()]
+
+    def adjacency_lists(self):
+        """CSR数组转换为Python列表（首次调用时转换），供纯Python的搜索循环使用"""
+        if self._adjacency_lists is None:
+            self._adjacency_lists = (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist())
+        return self._adjacency_lists
+
+    def shortest_distances(self, sources, limit=np.inf, return_predecessors=False):
+        """
+        从一个或多个起点出发的最短路径距离（Dijkstra）
+
+        参数:
+            sources (int | list): 起点序号
+            limit (float): 只计算不超过该距离的节点，更远的为inf
+
+        返回:
+            ndarray: 距离（sources为列表时每个起点一行）；return_predecessors时另返回前驱数组
+        """
+        return dijkstra(self.matrix, directed=False, indices=sources, limit=limit,
+                        return_predecessors=return_predecessors)
+
+    def nearest_source(self, sources):
+        """
+        每个节点到一组起点中最近者的距离（多源Dijkstra）
+
+        返回:
+            tuple: (距离数组（不连通为inf）, 最近起点序号数组（不连通为-9999）)
+        """
+        distances, _, nearest = dijkstra(self.matrix, directed=False, indices=sources,
+                                         min_only=True, return_predecessors=True)
+        return distances, nearest
+
+
+def get_network_graph(digest):
+    """获取管网版本的拓扑图（随模型缓存在 NETWORK_STORE 中）"""
+    return NETWORK_STORE.get_artifact(digest, 'network_graph', NetworkGraph)
@@ -0,0 +1,161 @@
+"""
+管网注册表
+
+一个目录中的每个INP文件是一个管网，管网ID为文件名（不含扩展名）。请求通过 network_id 指定管网，
+未指定时使用默认管网。注册表本身只记录文件位置：
+- 模型、派生数据（空间索引、图结构等）在第一次使用时由 NETWORK_STORE 加载，所有管网共用其内存上限，按LRU淘汰
+- 模拟结果按管网版本缓存在 result_cache 中，同样按内存上限淘汰
+- 编辑会话（utils/network_session.py）按INP文件各一个
+因此一个服务进程可以在多个管网之间切换，切换回来时只要模型未被淘汰就无需重新解析。
+"""
+import os
+import re
+import tempfile
+import threading
+
+import config
+from utils.network_session import get_session
+from utils.network_store import NETWORK_STORE
+
+# 管网ID只能由字母、数字、下划线、点和减号组成（直接用作文件名）
+NETWORK_ID_PATTERN = re.compile(r'^[A-Za-z0-9_\-][A-Za-z0-9_.\-]{0,63}$')
+
+
+class UnknownNetwork(KeyError):
+    """请求的管网不存在"""
+
+
+def validate_network_id(network_id):
+    """检查管网ID，不合法时抛出ValueError"""
+    if not isinstance(network_id, str) or not NETWORK_ID_PATTERN.match(network_id):
+        raise ValueError("管网ID只能包含字母、数字、下划线、点和减号（不超过64个字符）")
+    return network_id
+
+
+class NetworkRegistry:
+    """一个目录中的管网（线程安全）"""
+
+    def __init__(self, directory, default_id=None):
+        self.directory = directory
+        self._default_id = default_id
+        self._lock = threading.Lock()
+
+    def ids(self):
+        """目录中的全部管网ID（每次重新扫描目录，新放入的文件无需重启即可使用）"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(self.directory)
+                      if name.lower().endswith('.inp') and NETWORK_ID_PATTERN.match(name[:-4]))
+
+    @property
+    def default_id(self):
+        """
+        默认管网ID：最近设置的默认管网（如最近上传的管网），其次为 config.DEFAULT_NETWORK_ID，
+        都不存在时为目录中的第一个管网；目录中没有管网时为None
+        """
+        with self._lock:
+            preferred = self._default_id
+        for network_id in (preferred, config.DEFAULT_NETWORK_ID):
+            if network_id and os.path.exists(self._file_path(network_id)):
+                return network_id
+        ids = self.ids()
+        return ids[0] if ids else None
+
+    def set_default(self, network_id):
+        """设置默认管网"""
+        with self._lock:
+            self._default_id = validate_network_id(network_id)
+
+    def _file_path(self, network_id):
+        return os.path.join(self.directory, f"{network_id}.inp")
+
+    def resolve(self, network_id=None):
+        """
+        确定请求使用的管网
+
+        参数:
+            network_id (str): 管网ID，为None或空字符串时使用默认管网
+
+        返回:
+            str: 管网ID
+
+        管网ID不合法时抛出ValueError，管网不存在时抛出UnknownNetwork
+        """
+        if not network_id:
+            network_id = self.default_id
+            if network_id is None:
+                raise UnknownNetwork(f"{self.directory} 中没有管网，请先上传INP文件")
+            return network_id
+        validate_network_id(network_id)
+        if not os.path.exists(self._file_path(network_id)):
+            raise UnknownNetwork(f"管网 {network_id} 不存在")
+        return network_id
+
+    def path(self, network_id=None):
+        """管网的INP文件路径，参见 resolve"""
+        return self._file_path(self.resolve(network_id))
+
+    def session(self, network_id=None):
+        """管网的编辑会话"""
+        return get_session(self.path(network_id))
+
+    def digest(self, network_id=None):
+        """管网INP文件当前内容的哈希（模型不在缓存中时加载）"""
+        return NETWORK_STORE.load_file(self.path(network_id))
+
+    def describe(self):
+        """
+        全部管网的概况
+
+        返回:
+            list: [{"network_id", "file_name", "file_size", "default", "loaded", "memory_bytes"}, ...]，
+                  loaded 表示模型当前是否在缓存中（未加载的管网在第一次使用时加载）
+        """
+        default_id = self.default_id
+        networks = []
+        for network_id in self.ids():
+            path = self._file_path(network_id)
+            try:
+                file_size = os.path.getsize(path)
+                digest = NETWORK_STORE.digest_file(path)
+            except OSError:
+                continue
+            memory = NETWORK_STORE.memory_usage([digest]).get(digest)
+            networks.append({
+                'network_id': network_id,
+                'file_name': os.path.basename(path),
+                'file_size': file_size,
+                'default': network_id == default_id,
+                'loaded': memory is not None,
+                'memory_bytes': memory or 0,
+            })
+        return networks
+
+    def save_file(self, network_id, data):
+        """
+        保存上传的INP文件（已存在时替换）
+
+        先写到临时文件并解析验证，再整体替换：正在读取旧文件的请求和任务不会读到写了一半的文件，
+        文件无效时原文件保持不变（抛出解析时的异常）
+
+        返回:
+            str: INP内容哈希值
+        """
+        validate_network_id(network_id)
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.inp.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            NETWORK_STORE.load_file(temp_path, data=data)
+            path = self._file_path(network_id)
+            os.replace(temp_path, path)
+        finally:
+            NETWORK_STORE.forget_file(temp_path)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return NETWORK_STORE.load_file(path, data=data)
+
+
+HYDRAULIC_NETWORKS = NetworkRegistry(config.HYDRAULIC_NETWORK_DIR)
+SCHEDULER_NETWORKS = NetworkRegistry(config.SCHEDULER_NETWORK_DIR)
@@ -0,0 +1,515 @@
+"""
+管网编辑会话
+
+修改需水量、管段状态或设定值时不再"读取INP -> 修改 -> 整体写回INP -> 重新解析"：
+- 每个INP文件对应一个长期存在的会话。会话的当前版本是一个不可变的 NetworkVersion
+  （见 utils/network_versions.py）：基础INP文件加上各元素的修改，未变化的修改数组块在版本之间共享
+- 每次修改生成新版本并替换当前版本，只有写入者之间加锁；读取者（导出、模拟、批量任务）取得某个版本后
+  一直使用它，不加锁，也不会被写入者阻塞
+- 版本以 "<基础哈希>-edit-<修改链哈希>" 为键登记在 NETWORK_STORE 中，模型在第一次需要时才构建，
+  拓扑导出、派生数据、结果缓存等按管网版本工作的功能无需改动。会话保留最近
+  config.NETWORK_VERSION_HISTORY 个版本，正在运行的任务使用的旧版本仍可模拟
+- 会话持有一个打开的EPANET工具箱项目。模拟某个版本时只把它与工具箱中已应用版本的差异写入工具箱，
+  然后重新求解（ENsolveH + ENsolveQ，结果由内存映射的输出文件读取），不写INP、不重新解析、不经过模拟进程池。
+  所有会话同时打开的项目不超过 config.NETWORK_MAX_OPEN_TOOLKITS 个，超出时关闭最久未使用的项目
+- 每次修改追加一行到INP文件旁的日志（<INP路径>.wal，第一行记录基础版本的哈希），进程重启后重放，
+  修改的代价与管网规模无关
+- 最后一次修改后等待 config.NETWORK_COMPACT_DELAY 秒，在后台把修改合并写回INP文件
+  （期间的新修改重新计时）；也可以显式保存（save）。INP文件先写到临时文件再整体替换，
+  读取者不会读到写了一半的文件；写文件期间的新修改保留在新的日志中
+
+INP文件被其他途径改写（上传、调度脚本）后，以新文件为基础，未保存的修改（和日志）作废。
+
+会话状态只在本进程中：编辑接口（修改需水量、管段，保存、放弃）要求由单个进程提供服务。
+日志由持有会话的进程追加、重写和删除，没有跨进程的文件锁；多个WSGI工作进程同时编辑同一管网时，
+日志中的修改会交错，一个进程合并写回时会替换或删除另一个进程的日志而丢失其修改。
+多进程部署时应只用一个进程（可以多线程）处理编辑请求，只读接口和结果缓存（见 utils/result_cache.py）不受此限制。
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import wntr
+from wntr.epanet.util import EN, FlowUnits, HydParam, from_si
+
+import config
+from utils.epanet_output import EpanetOutput
+from utils.network_store import NETWORK_STORE, hash_inp_bytes
+from utils.network_versions import NetworkVersion
+from utils.result_cache import invalidate_results, register_local_solver, unregister_local_solver
+
+# 工具箱会话使用的EPANET版本，其他版本的模拟仍由模拟进程池运行
+SESSION_EPANET_VERSION = 2.2
+
+LINK_STATUSES = ('OPEN', 'CLOSED')
+
+
+class NetworkSession:
+    """一个INP文件的编辑会话（线程安全）"""
+
+    def __init__(self, inp_file_path):
+        self.inp_file_path = inp_file_path
+        # 当前版本（整体替换，读取时不加锁）；最近的版本 哈希 -> NetworkVersion
+        self._head = None
+        self._history = OrderedDict()
+        self.wal_path = inp_file_path + '.wal'
+        self._wal = None
+        self._compact_timer = None
+        # 写入者之间的锁
+        self._lock = threading.RLock()
+        # EPANET工具箱项目、其中已应用的版本和被修改元素的原始值
+        self._toolkit_lock = threading.Lock()
+        self._toolkit = None
+        self._applied = None
+        self._originals = {}
+        self._scratch_dir = None
+
+    # ---- 读取 ----
+
+    def snapshot(self):
+        """
+        当前版本（不可变，可在任意线程中一直使用）
+
+        INP文件未被改写时不加锁；文件被改写时以新文件为基础
+        """
+        head = self._head
+        if head is not None and NETWORK_STORE.digest_file(self.inp_file_path) == head.base_digest:
+            return head
+        with self._lock:
+            self._sync_base()
+            return self._head
+
+    def digest(self):
+        """
+        当前版本（INP文件加上未保存的修改）的管网哈希，可直接用于 NETWORK_STORE（模型按需构建）
+
+        返回:
+            str: 没有修改时即INP文件的内容哈希
+        """
+        return self.snapshot().digest
+
+    def version(self, digest):
+        """按哈希获取会话保留的版本，不存在时返回None"""
+        return self._history.get(digest)
+
+    def has_edits(self):
+        """是否有未保存的修改"""
+        return self.snapshot().has_edits()
+
+    def base_model(self):
+        """基础模型（只读）"""
+        return NETWORK_STORE.get_by_digest(self.snapshot().base_digest, copy=False)
+
+    def junction_index(self):
+        """当前版本的用户节点索引（utils.demand_import.JunctionIndex），set_demand_values 使用其中的序号"""
+        return self.snapshot().junctions
+
+    def _sync_base(self):
+        """确保基础版本与INP文件一致；文件被改写时丢弃未保存的修改（调用方持有写锁）"""
+        digest = NETWORK_STORE.load_file(self.inp_file_path)
+        if self._head is None or digest != self._head.base_digest:
+            first_load = self._head is None
+            if not first_load and self._head.has_edits():
+                print(f"{self.inp_file_path} 已被改写，丢弃未保存的修改")
+            self._reset(digest, keep_log=first_load)
+            if first_load:
+                self._replay_log()
+
+    def _reset(self, base_digest, keep_log=False):
+        self._commit(NetworkVersion.base(base_digest))
+        if not keep_log:
+            self._close_log(remove=True)
+
+    def _commit(self, version):
+        """登记新版本并设为当前版本（调用方持有写锁）"""
+        version.register()
+        if version.has_edits():
+            register_local_solver(version.digest, self._solve)
+        self._history[version.digest] = version
+        self._history.move_to_end(version.digest)
+        while len(self._history) > max(config.NETWORK_VERSION_HISTORY, 1):
+            digest, _ = self._history.popitem(last=False)
+            NETWORK_STORE.unregister_version(digest)
+            unregister_local_solver(digest)
+        self._head = version
+        return version.digest
+
+    # ---- 修改 ----
+
+    def set_demands(self, demands):
+        """
+        修改用户节点的基本需水量
+
+        参数:
+            demands (dict): 节点ID -> 基本需水量（m³/s）
+
+        返回:
+            str: 修改后版本的哈希
+
+        节点不存在时抛出KeyError，不是用户节点时抛出ValueError（此时不做任何修改）
+        """
+        with self._lock:
+            self._sync_base()
+            index = self._head.junctions
+            node_ids = list(demands)
+            positions = index.locate(node_ids)
+            if (positions < 0).any():
+                node_id = node_ids[int(np.argmax(positions < 0))]
+                if not index.contains_node([node_id])[0]:
+                    raise KeyError(f"节点 {node_id} 不存在")
+                raise ValueError(f"节点 {node_id} 不是Junction类型，无法设置需水量")
+            return self.set_demand_values(positions, np.array(list(demands.values()), dtype=np.float64))
+
+    def set_demand_values(self, positions, values):
+        """
+        按用户节点序号一次性修改基本需水量
+
+        参数:
+            positions (ndarray): 用户节点序号（不重复，见 junction_index）
+            values (ndarray): 基本需水量（m³/s）
+
+        返回:
+            str: 修改后版本的哈希
+
+        需水量不是有限数值时抛出ValueError（此时不做任何修改）
+        """
+        with self._lock:
+            self._sync_base()
+            head = self._head
+            positions = np.asarray(positions, dtype=np.int64)
+            values = np.asarray(values, dtype=np.float64)
+            if len(positions) == 0:
+                return head.digest
+            if not np.isfinite(values).all():
+                raise ValueError("需水量必须是有效的数值")
+            line = self._log({'demands': dict(zip(head.junctions.junction_ids[positions], values.tolist()))})
+            return self._commit(head.with_demands(positions, values, line))
+
+    def set_demand(self, node_id, demand):
+        """修改单个用户节点的基本需水量，参见 set_demands"""
+        return self.set_demands({node_id: demand})
+
+    def set_link(self, link_id, status=None, setting=None):
+        """
+        修改管段的初始状态（'OPEN'/'CLOSED'）和/或设定值（管道为粗糙系数，水泵为转速比，阀门为阀门设定值）
+
+        返回:
+            str: 修改后版本的哈希
+
+        管段不存在时抛出KeyError，取值不合法时抛出ValueError
+        """
+        with self._lock:
+            self._sync_base()
+            head = self._head
+            if head.links.locate([link_id])[0] < 0:
+                raise KeyError(f"管段 {link_id} 不存在")
+            if status is not None:
+                status = str(status).upper()
+                if status not in LINK_STATUSES:
+                    raise ValueError(f"管段状态必须是 {'/'.join(LINK_STATUSES)} 之一")
+            if setting is not None:
+                setting = float(setting)
+                if setting < 0:
+                    raise ValueError("设定值不能为负数")
+            edit = {}
+            if status is not None:
+                edit['statuses'] = {link_id: status}
+            if setting is not None:
+                edit['settings'] = {link_id: setting}
+            if not edit:
+                return head.digest
+            line = self._log(edit)
+            return self._commit(head.with_edit(edit, line))
+
+    def discard(self):
+        """丢弃全部未保存的修改"""
+        with self._lock:
+            self._reset(NETWORK_STORE.load_file(self.inp_file_path))
+
+    def save(self):
+        """
+        把当前版本写回INP文件，之后以新文件为基础
+
+        构建模型和写文件时不持有写锁，期间的新修改保留为相对新文件的修改
+
+        返回:
+            str: 保存后INP文件的内容哈希
+        """
+        version = self.snapshot()
+        if not version.has_edits():
+            return version.base_digest
+        wn = NETWORK_STORE.get_by_digest(version.digest, copy=False)
+        # 先写临时文件再替换，读取INP文件的其他请求和调度脚本不会读到写了一半的文件
+        fd, temp_path = tempfile.mkstemp(suffix='.inp.tmp', dir=os.path.dirname(self.inp_file_path))
+        os.close(fd)
+        try:
+            wntr.network.io.write_inpfile(wn, temp_path)
+            with open(temp_path, 'rb') as f:
+                data = f.read()
+            with self._lock:
+                if NETWORK_STORE.digest_file(self.inp_file_path) != version.base_digest:
+                    raise RuntimeError(f"{self.inp_file_path} 在保存期间已被改写")
+                new_base = hash_inp_bytes(data)
+                # 写文件期间的新修改
+                remaining = self._head.changes_since(version)
+                self._close_log()
+                if remaining:
+                    line = json.dumps(remaining)
+                    self._write_log([json.dumps({'base': new_base}), line])
+                os.replace(temp_path, self.inp_file_path)
+                if not remaining and os.path.exists(self.wal_path):
+                    os.remove(self.wal_path)
+                # 新文件的模型就是刚刚写出的模型，不重新解析
+                NETWORK_STORE.put_model(new_base, wn, size=NETWORK_STORE.model_size(version.digest) or None)
+                NETWORK_STORE.load_file(self.inp_file_path, data=data)
+                rebased = NetworkVersion.base(new_base)
+                if remaining:
+                    rebased = rebased.with_edit(remaining, line)
+                    self._wal = open(self.wal_path, 'a', encoding='utf-8')
+                    self._schedule_compaction()
+                self._commit(rebased)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        # 删除旧版本管网的模拟结果缓存
+        invalidate_results(version.base_digest)
+        return new_base
+
+    # ---- 修改日志和后台合并 ----
+
+    def _log(self, edit):
+        """把一次修改追加到日志并重新开始合并计时，返回日志中的这一行（参与计算版本哈希）"""
+        if self._wal is None:
+            self._wal = open(self.wal_path, 'w', encoding='utf-8')
+            self._wal.write(json.dumps({'base': self._head.base_digest}) + '\n')
+        line = json.dumps(edit)
+        self._wal.write(line + '\n')
+        self._wal.flush()
+        if config.NETWORK_WAL_FSYNC:
+            os.fsync(self._wal.fileno())
+        self._schedule_compaction()
+        return line
+
+    def _write_log(self, lines):
+        """整体改写日志（先写临时文件再替换）"""
+        temp_path = self.wal_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(''.join(line + '\n' for line in lines))
+            f.flush()
+            if config.NETWORK_WAL_FSYNC:
+                os.fsync(f.fileno())
+        os.replace(temp_path, self.wal_path)
+
+    def _replay_log(self):
+        """首次加载时重放上次运行留下的日志（基础版本已变化时删除日志）"""
+        if not os.path.exists(self.wal_path):
+            return
+        with open(self.wal_path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            header = {}
+        version = self._head
+        if header.get('base') != version.base_digest:
+            print(f"{self.wal_path} 与当前INP文件不一致，丢弃其中的修改")
+            os.remove(self.wal_path)
+            return
+        replayed = 0
+        for line in lines[1:]:
+            try:
+                edit = json.loads(line)
+            except ValueError:
+                # 写入时中断的最后一行
+                break
+            # 与写入时相同，以日志行计算版本哈希，重启前后同一版本的哈希不变
+            version = version.with_edit(edit, line)
+            replayed += 1
+        self._wal = open(self.wal_path, 'a', encoding='utf-8')
+        if replayed:
+            self._commit(version)
+            print(f"已从 {self.wal_path} 恢复 {replayed} 次未保存的修改")
+            self._schedule_compaction()
+
+    def _close_log(self, remove=False):
+        if self._compact_timer is not None:
+            self._compact_timer.cancel()
+            self._compact_timer = None
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+        if remove and os.path.exists(self.wal_path):
+            os.remove(self.wal_path)
+
+    def _schedule_compaction(self):
+        if config.NETWORK_COMPACT_DELAY <= 0:
+            return
+        if self._compact_timer is not None:
+            self._compact_timer.cancel()
+        self._compact_timer = threading.Timer(config.NETWORK_COMPACT_DELAY, self._compact)
+        self._compact_timer.daemon = True
+        self._compact_timer.start()
+
+    def _compact(self):
+        """后台合并：把修改写回INP文件（由计时器线程调用）"""
+        try:
+            with self._lock:
+                if self._compact_timer is threading.current_thread():
+                    self._compact_timer = None
+            self.save()
+        except Exception as e:
+            print(f"合并 {self.inp_file_path} 的修改失败: {str(e)}")
+
+    # ---- EPANET工具箱 ----
+
+    def _ensure_toolkit(self, base_digest):
+        """打开基础版本对应的工具箱项目（调用方持有工具箱锁），INP文件已不是该版本时返回None"""
+        if self._toolkit is not None and self._applied.base_digest == base_digest:
+            return self._toolkit
+        self._close_toolkit()
+        if NETWORK_STORE.digest_file(self.inp_file_path) != base_digest:
+            return None
+        _close_idle_toolkits(self)
+        self._scratch_dir = tempfile.mkdtemp(prefix='session-', dir=config.SIM_SCRATCH_DIR)
+        toolkit = wntr.epanet.toolkit.ENepanet(version=SESSION_EPANET_VERSION)
+        # 基础版本就是INP文件本身，直接由工具箱读取
+        toolkit.ENopen(self.inp_file_path, os.path.join(self._scratch_dir, 'session.rpt'), self._output_file())
+        self._toolkit = toolkit
+        self._applied = NetworkVersion.base(base_digest)
+        if NETWORK_STORE.digest_file(self.inp_file_path) != base_digest:
+            # 打开期间文件被替换
+            self._close_toolkit()
+            return None
+        self._flow_units = FlowUnits(toolkit.ENgetflowunits())
+        self._duration = toolkit.ENgettimeparam(EN.DURATION)
+        base_model = NETWORK_STORE.get_by_digest(base_digest, copy=False)
+        self._darcy_weisbach = base_model.options.hydraulic.headloss == 'D-W'
+        self._link_indices = {}
+        return toolkit
+
+    def _output_file(self):
+        return os.path.join(self._scratch_dir, 'session.bin')
+
+    def _close_toolkit(self):
+        with _OPEN_TOOLKITS_LOCK:
+            _OPEN_TOOLKITS.pop(self, None)
+        if self._toolkit is not None:
+            try:
+                self._toolkit.ENclose()
+            except Exception as e:
+                print(f"关闭EPANET工具箱项目失败: {str(e)}")
+            self._toolkit = None
+        self._applied = None
+        self._originals = {}
+        if self._scratch_dir is not None:
+            shutil.rmtree(self._scratch_dir, ignore_errors=True)
+            self._scratch_dir = None
+
+    def _set_value(self, setter, getter, index, code, value):
+        """写入工具箱，value为None时恢复为基础版本的原始值（第一次修改前读取）"""
+        key = (setter.__name__, index, code)
+        if key not in self._originals:
+            self._originals[key] = getter(index, code)
+        setter(index, code, self._originals[key] if value is None else value)
+
+    def _link_index(self, position):
+        index = self._link_indices.get(position)
+        if index is None:
+            index = self._link_indices[position] = self._toolkit.ENgetlinkindex(self._applied.links.link_ids[position])
+        return index
+
+    def _apply_version(self, version):
+        """把版本与工具箱中已应用版本的差异写入工具箱（调用方持有工具箱锁）"""
+        toolkit = self._toolkit
+        applied = self._applied
+        positions = version.demands.changed_positions(applied.demands)
+        for position, demand in zip(positions.tolist(), version.demands[positions].tolist()):
+            # EPANET中用户节点排在最前，按INP文件中的顺序编号（从1开始），与 junction_name_list 的顺序相同
+            self._set_value(toolkit.ENsetnodevalue, toolkit.ENgetnodevalue, position + 1, EN.BASEDEMAND,
+                            None if np.isnan(demand) else from_si(self._flow_units, demand, HydParam.Demand))
+        positions = version.statuses.changed_positions(applied.statuses)
+        for position, status in zip(positions.tolist(), version.statuses[positions].tolist()):
+            self._set_value(toolkit.ENsetlinkvalue, toolkit.ENgetlinkvalue, self._link_index(position),
+                            EN.INITSTATUS, None if status < 0 else float(status))
+        positions = version.settings.changed_positions(applied.settings)
+        for position, setting in zip(positions.tolist(), version.settings[positions].tolist()):
+            index = self._link_index(position)
+            self._set_value(toolkit.ENsetlinkvalue, toolkit.ENgetlinkvalue, index, EN.INITSETTING,
+                            None if np.isnan(setting) else self._setting_units(index, setting))
+        self._applied = version
+
+    def _setting_units(self, index, setting):
+        link_type = self._toolkit.ENgetlinktype(index)
+        if link_type in (EN.PRV, EN.PSV, EN.PBV):
+            return from_si(self._flow_units, setting, HydParam.Pressure)
+        if link_type == EN.FCV:
+            return from_si(self._flow_units, setting, HydParam.Flow)
+        if link_type <= EN.PIPE and self._darcy_weisbach:
+            return from_si(self._flow_units, setting, HydParam.RoughnessCoeff, darcy_weisbach=True)
+        return setting
+
+    def _solve(self, digest, options):
+        """
+        在工具箱中求解会话保留的某个版本（由 result_cache.run_simulation 调用）
+
+        返回:
+            SimulationArrays；版本已不在会话中、INP文件已被改写或选项不适用时返回None，由模拟进程池模拟
+        """
+        if float(options.get('version', SESSION_EPANET_VERSION)) != SESSION_EPANET_VERSION:
+            return None
+        version = self.version(digest)
+        if version is None:
+            return None
+        with self._toolkit_lock:
+            toolkit = self._ensure_toolkit(version.base_digest)
+            if toolkit is None:
+                return None
+            with _OPEN_TOOLKITS_LOCK:
+                _OPEN_TOOLKITS[self] = True
+                _OPEN_TOOLKITS.move_to_end(self)
+            self._apply_version(version)
+            duration = options.get('duration')
+            toolkit.ENsettimeparam(EN.DURATION, int(duration if duration is not None else self._duration))
+            toolkit.ENsolveH()
+            # 与 run_epanet 相同接着进行水质模拟，结果写入输出文件
+            toolkit.ENsolveQ()
+            with EpanetOutput(self._output_file(), darcy_weisbach=self._darcy_weisbach) as output:
+                return output.to_arrays()
+
+
+# 打开了工具箱项目的会话，按最近使用排序
+_OPEN_TOOLKITS = OrderedDict()
+_OPEN_TOOLKITS_LOCK = threading.Lock()
+
+
+def _close_idle_toolkits(opening):
+    """即将打开新的工具箱项目时，关闭其他会话中最久未使用的项目，使打开的项目数不超过上限"""
+    with _OPEN_TOOLKITS_LOCK:
+        others = [session for session in _OPEN_TOOLKITS if session is not opening]
+        excess = len(others) + 1 - max(config.NETWORK_MAX_OPEN_TOOLKITS, 1)
+        candidates = others[:max(excess, 0)]
+    for session in candidates:
+        # 正在求解的会话跳过，之后打开新项目时再关闭（不等待，避免两个会话互相等待）
+        if session._toolkit_lock.acquire(blocking=False):
+            try:
+                session._close_toolkit()
+            finally:
+                session._toolkit_lock.release()
+
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def get_session(inp_file_path):
+    """获取INP文件的编辑会话（每个文件一个）"""
+    inp_file_path = os.path.abspath(inp_file_path)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(inp_file_path)
+        if session is None:
+            session = _SESSIONS[inp_file_path] = NetworkSession(inp_file_path)
+        return session
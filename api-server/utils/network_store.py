@@ -0,0 +1,401 @@
+"""
+管网模型共享缓存
+
+按INP文件内容的哈希值缓存解析后的 WaterNetworkModel，所有蓝图共用同一份。
+- 只读访问直接返回缓存中的模型（调用方不得修改）
+- 需要修改模型时返回副本（由缓存的pickle字节反序列化，比重新解析INP快）
+- 按LRU在内存上限内淘汰，多个管网共用同一个上限，切换管网时只加载用到的管网；
+  被淘汰的模型再次按哈希访问时，若INP文件内容未变则从文件重新加载
+- 由模型派生的数据（图结构、布点顺序等）按管网版本缓存在条目中，其估算大小计入内存上限，随模型一起淘汰
+- 由基础版本派生的版本（带有未保存修改的版本，见 utils/network_versions.py）只登记构建函数，
+  模型在第一次需要时才构建；只依赖拓扑的派生数据直接与基础版本共享
+- 排队和运行中的任务固定（pin）其使用的版本：固定的版本及其基础版本不会被淘汰，派生版本的登记也一直保留
+"""
+import hashlib
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+import wntr
+
+import config
+
+# 解析后模型的内存占用约为其pickle字节数的倍数（经验值，用于估算内存）
+MODEL_SIZE_FACTOR = 6
+
+
+def hash_inp_bytes(data):
+    """计算INP文件内容的哈希值"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def estimate_size(value, depth=3):
+    """
+    派生数据内存占用的粗略估算（字节）
+
+    数组、索引（有 nbytes 属性的对象）和字节串按实际大小，稀疏矩阵按其三个数组，
+    容器和普通对象逐层累加（超过 depth 层的只计对象本身）
+    """
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return sys.getsizeof(value)
+    if all(hasattr(value, name) for name in ('data', 'indices', 'indptr')):
+        return sum(estimate_size(getattr(value, name), 0) for name in ('data', 'indices', 'indptr'))
+    size = sys.getsizeof(value)
+    if depth <= 0:
+        return size
+    if isinstance(value, dict):
+        return size + sum(estimate_size(k, 0) + estimate_size(v, depth - 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(estimate_size(v, depth - 1) for v in value)
+    if hasattr(value, '__dict__'):
+        return size + estimate_size(vars(value), depth)
+    slots = getattr(type(value), '__slots__', ())
+    return size + sum(estimate_size(getattr(value, name, None), depth - 1) for name in slots)
+
+
+class NetworkEntry:
+    """缓存中的一个管网模型（派生版本的模型可能尚未构建，此时wn为None）"""
+
+    def __init__(self, digest, wn, blob=None, size=None):
+        self.digest = digest
+        self.wn = wn
+        self._blob = blob
+        # 模型的估算内存占用；size 另外包括派生数据，按 size 计入缓存的内存上限
+        self.model_size = size if size is not None else (len(blob) * MODEL_SIZE_FACTOR if blob is not None else 0)
+        self.size = self.model_size
+        # 名称 -> 由该版本模型派生的数据
+        self.artifacts = {}
+        # 构建派生版本的模型时加锁，并发请求只构建一次
+        self.build_lock = threading.Lock()
+
+    @property
+    def blob(self):
+        """模型的pickle字节（派生版本在第一次需要时才序列化）"""
+        if self._blob is None:
+            self._blob = pickle.dumps(self.wn, protocol=pickle.HIGHEST_PROTOCOL)
+        return self._blob
+
+
+class VersionSource:
+    """登记的派生版本：基础版本哈希、构建模型的函数、与基础版本共享的派生数据名称"""
+
+    def __init__(self, base_digest, build, shared_artifacts):
+        self.base_digest = base_digest
+        self.build = build
+        self.shared_artifacts = frozenset(shared_artifacts)
+
+
+class NetworkStore:
+    """以INP内容哈希为键、带内存上限的LRU管网模型缓存"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        # 文件路径 -> (mtime_ns, size, digest)，文件未变化时无需重新读取和计算哈希
+        self._file_digests = {}
+        # 派生版本的哈希 -> VersionSource；条目被淘汰后仍可重新构建
+        self._versions = {}
+        # 版本哈希 -> 固定次数；固定的派生版本 -> 其基础版本哈希
+        self._pins = {}
+        self._pinned_bases = {}
+        # 已取消登记、但仍被固定的派生版本（解除固定后再删除）
+        self._unregistered = set()
+        self._lock = threading.RLock()
+
+    def __contains__(self, digest):
+        with self._lock:
+            return digest in self._entries or digest in self._versions
+
+    def digest_file(self, path, data=None):
+        """
+        获取INP文件内容的哈希值
+
+        参数:
+            path (str): INP文件路径
+            data (bytes): 文件内容，已读入内存时传入可避免再次读取
+        """
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._file_digests.get(path)
+            if data is None and cached is not None and cached[:2] == key:
+                return cached[2]
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        digest = hash_inp_bytes(data)
+        with self._lock:
+            self._file_digests[path] = (key[0], key[1], digest)
+        return digest
+
+    def forget_file(self, path):
+        """删除文件的哈希记录（临时文件删除后调用）"""
+        with self._lock:
+            self._file_digests.pop(path, None)
+
+    def load_file(self, path, data=None):
+        """
+        确保INP文件对应的模型已在缓存中，内容相同的文件不会重复解析
+
+        返回:
+            str: INP内容哈希值
+        """
+        digest = self.digest_file(path, data)
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return digest
+
+        # 在锁外解析，避免阻塞其他请求
+        wn = wntr.network.WaterNetworkModel(path)
+        self._insert(NetworkEntry(digest, wn, pickle.dumps(wn, protocol=pickle.HIGHEST_PROTOCOL)))
+        return digest
+
+    def get(self, path, copy=True):
+        """
+        获取INP文件对应的管网模型
+
+        参数:
+            path (str): INP文件路径
+            copy (bool): True返回可修改的副本；False返回共享的只读模型
+
+        返回:
+            WaterNetworkModel: 管网模型
+        """
+        return self.get_by_digest(self.load_file(path), copy=copy)
+
+    def _entry(self, digest, model=True):
+        """获取条目；派生版本在 model 为True时构建模型（在锁外构建）"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            source = self._versions.get(digest)
+            if entry is None and source is not None:
+                entry = NetworkEntry(digest, None)
+                self._entries[digest] = entry
+            if entry is not None:
+                self._entries.move_to_end(digest)
+        if entry is None:
+            return self._reload(digest)
+        if model and entry.wn is None:
+            with entry.build_lock:
+                if entry.wn is None:
+                    if source is None:
+                        raise KeyError(digest)
+                    wn = source.build()
+                    with self._lock:
+                        base = self._entries.get(source.base_digest)
+                        entry.wn = wn
+                        # 派生版本与基础版本的规模相同，不为估算内存而序列化
+                        size = base.model_size if base is not None and base.model_size else len(entry.blob) * MODEL_SIZE_FACTOR
+                        entry.model_size = size
+                        self._grow(entry, size)
+        return entry
+
+    def _reload(self, digest):
+        """
+        重新加载已被淘汰的INP文件模型（多个管网共用内存上限时，不常用的管网会被淘汰）
+
+        只在某个已知文件的内容仍是该版本时加载，否则抛出KeyError
+        """
+        with self._lock:
+            paths = [path for path, cached in self._file_digests.items() if cached[2] == digest]
+        for path in paths:
+            try:
+                if self.digest_file(path) != digest:
+                    continue
+                self.load_file(path)
+            except OSError:
+                continue
+            with self._lock:
+                entry = self._entries.get(digest)
+                if entry is not None:
+                    return entry
+        raise KeyError(digest)
+
+    def get_by_digest(self, digest, copy=True):
+        """按内容哈希获取管网模型，不存在时抛出KeyError"""
+        entry = self._entry(digest)
+        if copy:
+            return pickle.loads(entry.blob)
+        return entry.wn
+
+    def get_blob(self, digest):
+        """按内容哈希获取模型的pickle字节（用于发送给其他进程），不存在时抛出KeyError"""
+        return self._entry(digest).blob
+
+    def get_artifact(self, digest, name, factory, model=True):
+        """
+        获取与管网版本绑定的派生数据，不存在时调用 factory(wn) 构建
+
+        参数:
+            digest (str): 管网内容哈希
+            name (str): 派生数据名称
+            factory (callable): 由只读模型构建派生数据的函数
+            model (bool): factory 是否需要模型；为False时调用 factory()，派生版本无需构建模型
+
+        返回:
+            factory 的返回值（同一版本的所有调用方共享，不得修改）
+        """
+        with self._lock:
+            source = self._versions.get(digest)
+        if source is not None and name in source.shared_artifacts:
+            # 只依赖拓扑的派生数据与基础版本共享
+            return self.get_artifact(source.base_digest, name, factory, model)
+        entry = self._entry(digest, model=False)
+        with self._lock:
+            artifact = entry.artifacts.get(name)
+        if artifact is None:
+            # 在锁外构建；并发构建时保留先完成的一份
+            artifact = factory(self._entry(digest).wn) if model else factory()
+            size = estimate_size(artifact)
+            with self._lock:
+                if name not in entry.artifacts:
+                    entry.artifacts[name] = artifact
+                    self._grow(entry, size)
+                artifact = entry.artifacts[name]
+        return artifact
+
+    def put_model(self, digest, wn, size=None):
+        """
+        加入在内存中构建的模型，调用方之后不得再修改wn
+
+        参数:
+            size (int): 估算的内存占用（字节），不提供时由pickle字节数估算
+        """
+        self._insert(NetworkEntry(digest, wn, None if size is not None else pickle.dumps(wn, protocol=pickle.HIGHEST_PROTOCOL),
+                                  size))
+
+    def model_size(self, digest):
+        """已构建模型的估算内存占用（字节，不含派生数据），未构建或不存在时为0"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            return entry.model_size if entry is not None else 0
+
+    def memory_usage(self, digests):
+        """
+        若干管网版本的缓存占用（模型和派生数据的估算字节数）
+
+        返回:
+            dict: 已缓存的版本哈希 -> 字节数（未缓存的版本不在其中）
+        """
+        with self._lock:
+            return {digest: self._entries[digest].size for digest in digests if digest in self._entries}
+
+    def register_version(self, digest, base_digest, build, shared_artifacts=()):
+        """
+        登记由基础版本派生的管网版本，模型在第一次需要时才调用 build() 构建
+
+        参数:
+            digest (str): 派生版本的哈希
+            base_digest (str): 基础版本的哈希
+            build (callable): 返回该版本模型的函数（返回的模型之后只读）
+            shared_artifacts: 与基础版本相同、直接共享的派生数据名称
+        """
+        with self._lock:
+            self._versions[digest] = VersionSource(base_digest, build, shared_artifacts)
+            self._unregistered.discard(digest)
+
+    def unregister_version(self, digest):
+        """取消登记派生版本（已构建的模型仍按LRU淘汰）；版本被固定时推迟到解除固定后"""
+        with self._lock:
+            if self._pins.get(digest):
+                self._unregistered.add(digest)
+                return
+            self._versions.pop(digest, None)
+            self._drop_unbuilt(digest)
+
+    def pin(self, digest):
+        """
+        固定管网版本，直到调用同样次数的 unpin：版本（派生版本还有其基础版本）的模型不会被淘汰，
+        派生版本的登记不会被删除。用于排队和运行中的任务，保证任务开始时版本仍然可用
+
+        版本不存在时抛出KeyError
+        """
+        with self._lock:
+            source = self._versions.get(digest)
+        base_digest = source.base_digest if source is not None else digest
+        # 确认基础模型在缓存中后在锁内固定；两步之间被淘汰时重试一次
+        for _ in range(2):
+            self._entry(base_digest, model=False)
+            with self._lock:
+                if source is not None and self._versions.get(digest) is not source:
+                    raise KeyError(digest)
+                if base_digest not in self._entries:
+                    continue
+                self._pins[digest] = self._pins.get(digest, 0) + 1
+                if source is not None:
+                    self._pinned_bases[digest] = base_digest
+                    self._pins[base_digest] = self._pins.get(base_digest, 0) + 1
+                return
+        raise KeyError(base_digest)
+
+    def unpin(self, digest):
+        """解除一次 pin"""
+        with self._lock:
+            base_digest = self._pinned_bases.get(digest)
+            if base_digest is not None:
+                self._release(base_digest)
+            self._release(digest)
+            self._evict()
+
+    def _release(self, digest):
+        # 固定次数减一（调用方持有锁），减到0时完成推迟的取消登记
+        count = self._pins.get(digest, 0) - 1
+        if count > 0:
+            self._pins[digest] = count
+            return
+        self._pins.pop(digest, None)
+        self._pinned_bases.pop(digest, None)
+        if digest in self._unregistered:
+            self._unregistered.discard(digest)
+            self._versions.pop(digest, None)
+            self._drop_unbuilt(digest)
+
+    def _drop_unbuilt(self, digest):
+        # 未构建模型的条目只有派生数据，随登记一起删除（调用方持有锁）
+        entry = self._entries.get(digest)
+        if entry is not None and entry.wn is None:
+            del self._entries[digest]
+            self.current_bytes -= entry.size
+
+    def put_blob(self, digest, blob):
+        """加入由其他进程发送来的模型pickle字节"""
+        self._insert(NetworkEntry(digest, pickle.loads(blob), blob))
+
+    def _insert(self, entry):
+        with self._lock:
+            if entry.digest not in self._entries:
+                self._entries[entry.digest] = entry
+                self.current_bytes += entry.size
+                self._evict()
+
+    def _grow(self, entry, size):
+        """条目的内存占用增加（调用方持有锁），已被淘汰的条目不再计入"""
+        entry.size += size
+        if self._entries.get(entry.digest) is entry:
+            self.current_bytes += size
+            self._evict()
+
+    def _evict(self):
+        # 至少保留最近使用的一个模型；被固定的模型不淘汰（此时可能暂时超过内存上限）
+        for digest in list(self._entries)[:-1]:
+            if self.current_bytes <= self.max_bytes:
+                break
+            if self._pins.get(digest):
+                continue
+            entry = self._entries.pop(digest)
+            self.current_bytes -= entry.size
+
+
+NETWORK_STORE = NetworkStore(config.NETWORK_STORE_MAX_BYTES)
+
+
+def load_network(path, copy=True):
+    """从共享缓存获取管网模型，参见 NetworkStore.get"""
+    return NETWORK_STORE.get(path, copy=copy)
@@ -0,0 +1,272 @@
+"""
+管网的不可变版本（多版本并发控制）
+
+编辑会话（utils/network_session.py）的每次修改都生成一个新版本，旧版本保持不变：
+- 版本 = 基础INP文件 + 各用户节点的基本需水量、各管段的初始状态和设定值的修改
+- 修改按元素序号保存在分块数组中（未修改为NaN/-1）。生成新版本时只复制被修改元素所在的块，
+  其余块与旧版本共享，修改的代价与管网规模无关
+- 版本哈希由上一版本的哈希和本次修改链式得出，不需要扫描整个数组
+- 读取者（导出、模拟、批量任务）取得某个版本后一直使用它，写入者只替换会话中的当前版本，
+  读取者和写入者互不等待
+- 版本的完整模型（WaterNetworkModel）只在需要时才构建（见 NetworkStore.register_version），
+  只依赖拓扑的派生数据与基础版本共享
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+import wntr
+
+import config
+from utils.demand_import import get_junction_index
+from utils.network_store import NETWORK_STORE
+
+# 不受需水量、管段状态和设定值修改影响、与基础版本共享的派生数据
+TOPOLOGY_ARTIFACTS = ('junction_index', 'link_index', 'spatial_index', 'network_graph', 'landmark_index',
+                      'distance_matrix', 'farthest_point_placement')
+
+LINK_STATUSES = ('CLOSED', 'OPEN')
+
+
+class ChunkedArray:
+    """
+    不可变的分块数组
+
+    数组按 config.NETWORK_VERSION_CHUNK 个元素分块，所有块都是只读的。修改返回新的数组，
+    只有被修改的块是新分配的，其余块与原数组共享（全部未修改的初始数组只有一个共享块）。
+    """
+
+    __slots__ = ('chunks', 'length', 'fill')
+
+    def __init__(self, chunks, length, fill):
+        self.chunks = chunks
+        self.length = length
+        self.fill = fill
+
+    @classmethod
+    def full(cls, length, fill, dtype):
+        """所有元素都为fill的数组"""
+        size = config.NETWORK_VERSION_CHUNK
+        chunk = np.full(size, fill, dtype=dtype)
+        chunk.flags.writeable = False
+        return cls((chunk,) * ((length + size - 1) // size), length, fill)
+
+    def _is_fill(self, values):
+        return np.isnan(values) if isinstance(self.fill, float) and np.isnan(self.fill) else values == self.fill
+
+    def set(self, positions, values):
+        """
+        返回修改后的新数组
+
+        参数:
+            positions (ndarray): 元素序号
+            values (ndarray): 新值（与 positions 一一对应，序号重复时以最后一个为准）
+        """
+        size = config.NETWORK_VERSION_CHUNK
+        positions = np.asarray(positions, dtype=np.int64)
+        values = np.asarray(values)
+        chunks = list(self.chunks)
+        order = np.argsort(positions // size, kind='stable')
+        chunk_ids, starts = np.unique(positions[order] // size, return_index=True)
+        for chunk_id, start, stop in zip(chunk_ids.tolist(), starts.tolist(), starts[1:].tolist() + [len(order)]):
+            selected = order[start:stop]
+            chunk = chunks[chunk_id].copy()
+            chunk[positions[selected] - chunk_id * size] = values[selected]
+            chunk.flags.writeable = False
+            chunks[chunk_id] = chunk
+        return ChunkedArray(tuple(chunks), self.length, self.fill)
+
+    def to_array(self):
+        """合并为普通数组（新分配）"""
+        if not self.chunks:
+            return np.empty(0, dtype=type(self.fill))
+        return np.concatenate(self.chunks)[:self.length]
+
+    def edited_positions(self):
+        """值不是fill的元素序号"""
+        size = config.NETWORK_VERSION_CHUNK
+        positions = []
+        for chunk_id, chunk in enumerate(self.chunks):
+            found = np.flatnonzero(~self._is_fill(chunk))
+            if len(found):
+                positions.append(found + chunk_id * size)
+        if not positions:
+            return np.empty(0, dtype=np.int64)
+        positions = np.concatenate(positions)
+        return positions[positions < self.length]
+
+    def changed_positions(self, other):
+        """与另一个（由同一数组派生的）数组取值不同的元素序号，共享的块直接跳过"""
+        size = config.NETWORK_VERSION_CHUNK
+        positions = []
+        for chunk_id, (chunk, other_chunk) in enumerate(zip(self.chunks, other.chunks)):
+            if chunk is other_chunk:
+                continue
+            different = (chunk != other_chunk) & ~(self._is_fill(chunk) & self._is_fill(other_chunk))
+            found = np.flatnonzero(different)
+            if len(found):
+                positions.append(found + chunk_id * size)
+        if not positions:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(positions)
+
+    def __getitem__(self, positions):
+        return self.to_array()[positions]
+
+
+class LinkIndex:
+    """管段ID -> 序号（与 wn.link_name_list 的顺序相同）的哈希索引"""
+
+    def __init__(self, wn):
+        self.link_ids = pd.Index(wn.link_name_list)
+
+    def __len__(self):
+        return len(self.link_ids)
+
+    def locate(self, link_ids):
+        """管段序号，不存在时为-1"""
+        return self.link_ids.get_indexer(link_ids)
+
+
+def get_link_index(digest):
+    """管网版本对应的管段索引（按版本缓存，只读）"""
+    return NETWORK_STORE.get_artifact(digest, 'link_index', LinkIndex)
+
+
+class NetworkVersion:
+    """
+    管网的一个不可变版本
+
+    属性:
+        base_digest (str): 基础INP文件的内容哈希
+        digest (str): 本版本的哈希（没有修改时等于 base_digest）
+        demands (ChunkedArray): 各用户节点修改后的基本需水量（m³/s），未修改为NaN
+        statuses (ChunkedArray): 各管段修改后的初始状态（0关闭/1开启），未修改为-1
+        settings (ChunkedArray): 各管段修改后的设定值，未修改为NaN
+    """
+
+    __slots__ = ('base_digest', 'digest', 'junctions', 'links', 'demands', 'statuses', 'settings', 'edit_count')
+
+    def __init__(self, base_digest, digest, junctions, links, demands, statuses, settings, edit_count):
+        self.base_digest = base_digest
+        self.digest = digest
+        self.junctions = junctions
+        self.links = links
+        self.demands = demands
+        self.statuses = statuses
+        self.settings = settings
+        self.edit_count = edit_count
+
+    @classmethod
+    def base(cls, base_digest):
+        """没有修改的基础版本"""
+        junctions = get_junction_index(base_digest)
+        links = get_link_index(base_digest)
+        return cls(base_digest, base_digest, junctions, links,
+                   ChunkedArray.full(len(junctions), np.nan, np.float64),
+                   ChunkedArray.full(len(links), -1, np.int8),
+                   ChunkedArray.full(len(links), np.nan, np.float64), 0)
+
+    def has_edits(self):
+        """是否有相对基础版本的修改"""
+        return self.edit_count > 0
+
+    def _derive(self, edit_key, demands=None, statuses=None, settings=None):
+        chained = hashlib.sha256(f"{self.digest}\n{edit_key}".encode('utf-8')).hexdigest()[:16]
+        return NetworkVersion(self.base_digest, f"{self.base_digest}-edit-{chained}", self.junctions, self.links,
+                              self.demands if demands is None else demands,
+                              self.statuses if statuses is None else statuses,
+                              self.settings if settings is None else settings,
+                              self.edit_count + 1)
+
+    def with_demands(self, positions, values, edit_key):
+        """
+        修改用户节点基本需水量后的新版本
+
+        参数:
+            positions (ndarray): 用户节点序号（见 junctions）
+            values (ndarray): 基本需水量（m³/s）
+            edit_key (str): 本次修改的唯一描述（参与计算版本哈希）
+        """
+        return self._derive(edit_key, demands=self.demands.set(positions, values))
+
+    def with_edit(self, edit, edit_key):
+        """
+        应用一次按ID描述的修改后的新版本（修改日志中的一行）
+
+        参数:
+            edit (dict): {"demands": {节点ID: 需水量}, "statuses": {管段ID: 'OPEN'/'CLOSED'},
+                          "settings": {管段ID: 设定值}}，各项均可省略；不存在的ID忽略
+            edit_key (str): 本次修改的唯一描述（参与计算版本哈希）
+        """
+        def located(index, values):
+            positions = index.locate(list(values))
+            found = positions >= 0
+            return positions[found], np.array(list(values.values()))[found]
+
+        demands = statuses = settings = None
+        if edit.get('demands'):
+            demands = self.demands.set(*located(self.junctions, edit['demands']))
+        if edit.get('statuses'):
+            positions, values = located(self.links, edit['statuses'])
+            statuses = self.statuses.set(positions, [LINK_STATUSES.index(status) for status in values])
+        if edit.get('settings'):
+            settings = self.settings.set(*located(self.links, edit['settings']))
+        return self._derive(edit_key, demands=demands, statuses=statuses, settings=settings)
+
+    def changes_since(self, other):
+        """
+        本版本相对另一个（同一基础版本的）版本的修改，格式同 with_edit 的 edit
+
+        只比较不共享的块，代价与修改的元素数成正比
+        """
+        edit = {}
+        positions = self.demands.changed_positions(other.demands)
+        if len(positions):
+            edit['demands'] = dict(zip(self.junctions.junction_ids[positions], self.demands[positions].tolist()))
+        positions = self.statuses.changed_positions(other.statuses)
+        if len(positions):
+            edit['statuses'] = {link_id: LINK_STATUSES[status] for link_id, status
+                                in zip(self.links.link_ids[positions], self.statuses[positions].tolist())}
+        positions = self.settings.changed_positions(other.settings)
+        if len(positions):
+            edit['settings'] = dict(zip(self.links.link_ids[positions], self.settings[positions].tolist()))
+        return edit
+
+    def edited_demands(self):
+        """已修改的基本需水量 {节点ID: 需水量}"""
+        positions = self.demands.edited_positions()
+        return dict(zip(self.junctions.junction_ids[positions], self.demands[positions].tolist()))
+
+    def edited_statuses(self):
+        """已修改的管段初始状态 {管段ID: 'OPEN'/'CLOSED'}"""
+        positions = self.statuses.edited_positions()
+        return {link_id: LINK_STATUSES[status]
+                for link_id, status in zip(self.links.link_ids[positions], self.statuses[positions].tolist())}
+
+    def edited_settings(self):
+        """已修改的管段设定值 {管段ID: 设定值}"""
+        positions = self.settings.edited_positions()
+        return dict(zip(self.links.link_ids[positions], self.settings[positions].tolist()))
+
+    def build_model(self):
+        """构建本版本的完整模型（基础模型的副本加上修改）"""
+        wn = NETWORK_STORE.get_by_digest(self.base_digest, copy=True)
+        for node_id, demand in self.edited_demands().items():
+            wn.get_node(node_id).demand_timeseries_list[0].base_value = demand
+        for link_id, status in self.edited_statuses().items():
+            wn.get_link(link_id).initial_status = wntr.network.LinkStatus[status.capitalize()]
+        for link_id, value in self.edited_settings().items():
+            link = wn.get_link(link_id)
+            if link.link_type == 'Pipe':
+                link.roughness = value
+            elif link.link_type == 'Pump':
+                link.speed_timeseries.base_value = value
+            else:
+                link.initial_setting = value
+        return wn
+
+    def register(self):
+        """在 NETWORK_STORE 中登记本版本（模型按需构建）"""
+        if self.has_edits():
+            NETWORK_STORE.register_version(self.digest, self.base_digest, self.build_model, TOPOLOGY_ARTIFACTS)
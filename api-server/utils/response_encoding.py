@@ -0,0 +1,209 @@
+"""
+各蓝图共用的响应编码层
+
+通过 init_app(app) 安装，所有 jsonify 返回的响应都会经过这里：
+- JSON编码：安装了 orjson 时使用 orjson，否则使用标准库json；两者都直接支持NumPy数组和标量，
+  接口可以把结果数组原样放入响应，无需先逐个转换为Python浮点数
+  （orjson把NaN/inf编码为null，标准库编码为NaN/Infinity）
+- MessagePack：请求头 Accept 优先 application/msgpack 且安装了 msgpack 时返回MessagePack
+- 列式结构：查询参数 shape=columnar 时，响应中的对象列表（如 nodes、links）改为
+  {"ids": [...], "columns": {字段: [...]}}，字段名不再在每个元素中重复
+- 压缩：按请求头 Accept-Encoding 使用 brotli（需安装 brotli）或 gzip 压缩较大的响应；
+  流式响应（NDJSON/SSE）和已经编码的响应不处理
+
+orjson、msgpack、brotli 均为可选依赖，未安装时自动退回到标准库实现。
+"""
+import dataclasses
+import decimal
+import gzip
+import json
+import uuid
+from datetime import date
+
+import numpy as np
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+# 可接受的MessagePack媒体类型写法
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
+COLUMNAR_SHAPE = 'columnar'
+
+# 值得压缩的响应类型（二进制时序结果为float32数组，压缩后通常也能明显变小）
+COMPRESSIBLE_MIMETYPES = {JSON_MIMETYPE, MSGPACK_MIMETYPE, 'application/octet-stream', 'application/x-ndjson'}
+
+
+def _default(o):
+    """orjson和标准库json都无法直接编码的对象"""
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    # 日期、Decimal、UUID、dataclass、带 __html__ 的对象与Flask默认的JSON编码一致
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def to_columnar(obj):
+    """
+    把对象中的对象列表转换为列式结构
+
+    [{"id": "1", "x": 1}, {"id": "2", "x": 2}] -> {"ids": ["1", "2"], "columns": {"x": [1, 2]}}
+    缺少某字段的元素在该列中为None；元素没有id字段时不输出ids。只转换字典中各层的值，
+    不深入数值列表。
+    """
+    if isinstance(obj, dict):
+        return {key: to_columnar(value) for key, value in obj.items()}
+    if isinstance(obj, list) and obj and all(isinstance(item, dict) for item in obj):
+        fields = {}
+        for item in obj:
+            for key in item:
+                fields.setdefault(key, None)
+        columnar = {}
+        if 'id' in fields:
+            del fields['id']
+            columnar['ids'] = [item.get('id') for item in obj]
+        columnar['columns'] = {key: [item.get(key) for item in obj] for key in fields}
+        return columnar
+    return obj
+
+
+def negotiate_format():
+    """按请求头 Accept 选择响应格式：'msgpack' 或 'json'"""
+    if msgpack is None or not request.accept_mimetypes:
+        return 'json'
+    best = request.accept_mimetypes.best_match((JSON_MIMETYPE,) + MSGPACK_MIMETYPES, default=JSON_MIMETYPE)
+    return 'msgpack' if best in MSGPACK_MIMETYPES else 'json'
+
+
+def negotiate_shape():
+    """按查询参数 shape 选择对象列表的结构：'columnar' 或 None"""
+    return COLUMNAR_SHAPE if request.args.get('shape') == COLUMNAR_SHAPE else None
+
+
+def negotiate_encoding():
+    """按请求头 Accept-Encoding 选择压缩方式：'br'、'gzip' 或 None"""
+    accepted = request.accept_encodings
+    candidates = ('br', 'gzip') if brotli is not None else ('gzip',)
+    best = max(candidates, key=lambda encoding: accepted[encoding], default=None)
+    return best if best is not None and accepted[best] > 0 else None
+
+
+def compress(body, encoding):
+    """按 negotiate_encoding 选出的方式压缩响应体"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=config.RESPONSE_BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=config.RESPONSE_GZIP_LEVEL, mtime=0)
+    return body
+
+
+def pack_msgpack(obj):
+    """编码为MessagePack"""
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+
+def encoded_etag(etag, *variant):
+    """同一资源不同表示（格式、结构、压缩方式）的强ETag，默认表示不加后缀"""
+    suffix = '-'.join(part for part in variant if part and part != 'json')
+    return f"{etag}-{suffix}" if suffix else etag
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """NumPy感知的JSON编码（优先使用orjson），jsonify时按请求协商格式和结构"""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None:
+            option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if kwargs.get('sort_keys', self.sort_keys):
+                option |= orjson.OPT_SORT_KEYS
+            if kwargs.get('indent'):
+                option |= orjson.OPT_INDENT_2
+            return orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+        kwargs.setdefault('default', _default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def encode(self, obj, response_format='json', shape=None):
+        """
+        按格式和结构编码为响应体字节
+
+        参数:
+            obj: 要编码的对象
+            response_format (str): 'json' 或 'msgpack'
+            shape (str): 'columnar' 时先转换为列式结构
+        """
+        if shape == COLUMNAR_SHAPE:
+            obj = to_columnar(obj)
+        if response_format == 'msgpack':
+            return pack_msgpack(obj)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return (self.dumps(obj, indent=2) + '\n').encode('utf-8')
+        return (self.dumps(obj, separators=(',', ':')) + '\n').encode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        response_format = negotiate_format()
+        response = self._app.response_class(
+            self.encode(obj, response_format, negotiate_shape()),
+            mimetype=MSGPACK_MIMETYPE if response_format == 'msgpack' else self.mimetype)
+        response.vary.update(('Accept', 'Accept-Encoding'))
+        return response
+
+
+def compress_response(response):
+    """after_request钩子：按 Accept-Encoding 压缩较大的响应"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < config.RESPONSE_COMPRESS_MIN_BYTES:
+        return response
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # 不同编码的响应体不同，强ETag需要区分
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(encoded_etag(etag, encoding))
+    return response
+
+
+def init_app(app):
+    """为应用安装共用的响应编码层"""
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
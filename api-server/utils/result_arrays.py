@@ -0,0 +1,138 @@
+"""
+紧凑的列式模拟结果容器
+
+将wntr的 SimulationResults（每个变量一个DataFrame）转换为float32数组，
+形状为 元素 × 时间步 × 变量，并预先建立 元素ID -> 行号 的索引，
+导出某一时刻的结果时按整行切片，不再逐个元素调用 .loc。
+"""
+import numpy as np
+
+# 节点和管段保存的结果变量，顺序即数组最后一维的顺序
+NODE_VARIABLES = ('demand', 'head', 'pressure')
+LINK_VARIABLES = ('flowrate', 'velocity', 'headloss', 'status', 'setting')
+
+
+class SimulationArrays:
+    """
+    列式模拟结果
+
+    属性:
+        node_ids (list): 节点ID列表
+        link_ids (list): 管段ID列表
+        times (ndarray): 各时间步对应的模拟时间（秒）
+        node_values (ndarray): float32数组，形状为 (节点数, 时间步数, len(NODE_VARIABLES))
+        link_values (ndarray): float32数组，形状为 (管段数, 时间步数, len(LINK_VARIABLES))
+        node_index (dict): 节点ID -> 行号
+        link_index (dict): 管段ID -> 行号
+    """
+
+    def __init__(self, node_ids, link_ids, times, node_values, link_values):
+        self.node_ids = list(node_ids)
+        self.link_ids = list(link_ids)
+        self.times = np.asarray(times, dtype=np.int64)
+        self.node_values = node_values
+        self.link_values = link_values
+        self.node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.link_index = {link_id: i for i, link_id in enumerate(self.link_ids)}
+
+    @classmethod
+    def from_results(cls, results):
+        """由wntr的SimulationResults构建"""
+        pressure = results.node['pressure']
+        flowrate = results.link['flowrate']
+        node_ids = [str(c) for c in pressure.columns]
+        link_ids = [str(c) for c in flowrate.columns]
+        times = pressure.index.to_numpy()
+
+        node_values = np.empty((len(node_ids), len(times), len(NODE_VARIABLES)), dtype=np.float32)
+        for k, name in enumerate(NODE_VARIABLES):
+            node_values[:, :, k] = results.node[name].to_numpy(dtype=np.float32).T
+        link_values = np.empty((len(link_ids), len(times), len(LINK_VARIABLES)), dtype=np.float32)
+        for k, name in enumerate(LINK_VARIABLES):
+            link_values[:, :, k] = results.link[name].to_numpy(dtype=np.float32).T
+
+        return cls(node_ids, link_ids, times, node_values, link_values)
+
+    @property
+    def nbytes(self):
+        """结果数组占用的字节数"""
+        return self.node_values.nbytes + self.link_values.nbytes
+
+    def time_index(self, hour):
+        """返回最接近指定小时的时间步索引（报告时刻按预先建立的 时间 -> 行号 索引直接查找）"""
+        target_time = hour * 3600
+        time_rows = self.__dict__.get('_time_rows')
+        if time_rows is None:
+            time_rows = self._time_rows = {t: i for i, t in enumerate(self.times.tolist())}
+        row = time_rows.get(target_time)
+        if row is not None:
+            return row
+        # 不是报告时刻时在有序的时间数组中二分查找最近的一步
+        right = int(np.searchsorted(self.times, target_time))
+        if right == 0:
+            return 0
+        if right == len(self.times) or target_time - self.times[right - 1] <= self.times[right] - target_time:
+            return right - 1
+        return right
+
+    def node_row(self, variable, time_step_index):
+        """返回所有节点在某一时间步的某个变量（按 node_ids 顺序）"""
+        return self.node_values[:, time_step_index, NODE_VARIABLES.index(variable)]
+
+    def link_row(self, variable, time_step_index):
+        """返回所有管段在某一时间步的某个变量（按 link_ids 顺序）"""
+        return self.link_values[:, time_step_index, LINK_VARIABLES.index(variable)]
+
+    def node_series(self, variable, time_step_index):
+        """返回 {节点ID: 值} 字典，可直接作为wntr绘图函数的node_attribute"""
+        return dict(zip(self.node_ids, self.node_row(variable, time_step_index).tolist()))
+
+
+def report_time(time_options, hour):
+    """
+    EPANET延时模拟中与指定小时最接近的报告时刻（秒）
+
+    参数:
+        time_options: 管网模型的 wn.options.time
+        hour (float): 模拟时间（小时）
+    """
+    if time_options.duration == 0:
+        return 0
+    steps = round((hour * 3600 - time_options.report_start) / time_options.report_timestep)
+    max_steps = (time_options.duration - time_options.report_start) // time_options.report_timestep
+    return int(time_options.report_start + min(max(steps, 0), max_steps) * time_options.report_timestep)
+
+
+# float32约有7位有效数字，转换为float64后更多的位数只是单精度的舍入误差
+FLOAT32_SIGNIFICANT_DIGITS = 7
+
+
+def round_significant(values, digits=FLOAT32_SIGNIFICANT_DIGITS):
+    """
+    按有效数字位数舍入（float64数组，0、NaN和inf保持不变）
+
+    每个元素按其数量级乘或除以10的整数次幂后取整，10的22次幂以内在float64中精确表示，
+    结果即最接近该十进制数的浮点数（例如float32的0.04205744转换后为0.0420574397，舍入后为0.04205744）
+    """
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values) & (values != 0)
+    magnitude = np.zeros(values.shape)
+    magnitude[finite] = np.floor(np.log10(np.abs(values[finite])))
+    shift = (digits - 1 - magnitude).astype(np.int64)
+    with np.errstate(over='ignore', invalid='ignore'):
+        up = np.round(values * 10.0 ** np.maximum(shift, 0)) / 10.0 ** np.maximum(shift, 0)
+        down = np.round(values / 10.0 ** np.maximum(-shift, 0)) * 10.0 ** np.maximum(-shift, 0)
+    return np.where(finite, np.where(shift >= 0, up, down), values)
+
+
+def rounded_list(values, decimals=None):
+    """
+    将结果整体舍入并转换为Python浮点数列表
+
+    参数:
+        values (ndarray): 结果数组（通常为float32）
+        decimals (int): 保留的小数位数；为None时保留float32有意义的 FLOAT32_SIGNIFICANT_DIGITS 位有效数字
+    """
+    if decimals is None:
+        return round_significant(values).tolist()
+    return np.round(np.asarray(values, dtype=np.float64), decimals).tolist()
@@ -0,0 +1,199 @@
+"""
+水力模拟结果缓存
+
+以 (管网内容哈希, 模拟器选项) 为键缓存EPANET模拟结果，分两级：
+- 第一级：进程内LRU缓存（按结果个数和结果数组的字节数限制，多个管网共用）
+- 第二级：本地磁盘缓存，同一台机器上的多个WSGI工作进程共享
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+import config
+from utils.network_store import NETWORK_STORE
+from utils.result_arrays import report_time
+from utils.sim_pool import SIM_POOL
+
+# 默认模拟器选项
+DEFAULT_SIM_OPTIONS = {'simulator': 'EPANET', 'version': 2.2}
+
+# 缓存内容的格式版本，格式变化时旧的磁盘缓存自动失效
+RESULT_FORMAT = 'arrays-v1'
+
+
+class SimulationCache:
+    """两级模拟结果缓存"""
+
+    def __init__(self, cache_dir, memory_entries, disk_entries, memory_bytes=None):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(digest, options):
+        """由管网内容哈希和模拟器选项生成缓存键，键以管网哈希开头便于按管网失效"""
+        options_text = RESULT_FORMAT + json.dumps(options, sort_keys=True)
+        return f"{digest}-{hashlib.sha256(options_text.encode('utf-8')).hexdigest()[:16]}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def get(self, key):
+        """读取缓存结果，未命中返回None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        """写入两级缓存"""
+        self._remember(key, value)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 先写临时文件再原子替换，其他进程不会读到写了一半的文件
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError as e:
+            print(f"写入模拟结果磁盘缓存失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._prune_disk()
+
+    def invalidate(self, digest):
+        """删除某个管网版本的全部缓存结果"""
+        prefix = digest + '-'
+        with self._lock:
+            for key in [k for k in self._memory if k.startswith(prefix)]:
+                self._memory_size -= _result_size(self._memory.pop(key))
+        for path in glob.glob(os.path.join(self.cache_dir, prefix + '*.pkl')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _remember(self, key, value):
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_size -= _result_size(previous)
+            self._memory[key] = value
+            self._memory_size += _result_size(value)
+            # 至少保留刚写入的结果
+            while len(self._memory) > 1 and (len(self._memory) > self.memory_entries or (
+                    self.memory_bytes is not None and self._memory_size > self.memory_bytes)):
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= _result_size(evicted)
+
+    def _prune_disk(self):
+        # 磁盘缓存超出上限时删除最旧的文件
+        paths = glob.glob(os.path.join(self.cache_dir, '*.pkl'))
+        if len(paths) <= self.disk_entries:
+            return
+        paths.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in paths[:len(paths) - self.disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _result_size(value):
+    """缓存结果占用的字节数（SimulationArrays 为结果数组的字节数）"""
+    return getattr(value, 'nbytes', 0)
+
+
+SIMULATION_CACHE = SimulationCache(config.SIM_CACHE_DIR,
+                                   config.SIM_CACHE_MEMORY_ENTRIES,
+                                   config.SIM_CACHE_DISK_MAX_ENTRIES,
+                                   config.SIM_CACHE_MEMORY_BYTES)
+
+
+# 管网版本 -> 进程内求解函数 solver(digest, options)，返回None时仍由模拟进程池模拟
+_LOCAL_SOLVERS = {}
+
+
+def register_local_solver(digest, solver):
+    """为某个管网版本（例如带有未保存修改的版本）注册进程内的求解函数"""
+    _LOCAL_SOLVERS[digest] = solver
+
+
+def unregister_local_solver(digest):
+    """取消某个管网版本的进程内求解函数"""
+    _LOCAL_SOLVERS.pop(digest, None)
+
+
+def run_simulation(digest, options=None, inp_file_path=None):
+    """
+    运行EPANET模拟，结果按 (管网内容哈希, 模拟器选项) 缓存；未命中时由该版本注册的进程内求解函数
+    （见 utils/network_session.py）或模拟进程池模拟
+
+    参数:
+        digest (str): 管网INP内容哈希（模型须已在 NETWORK_STORE 中）
+        options (dict): 模拟器选项，默认为 DEFAULT_SIM_OPTIONS
+        inp_file_path (str): 管网INP文件路径，供工作进程加载模型
+
+    返回:
+        SimulationArrays: 列式模拟结果
+    """
+    options = options or DEFAULT_SIM_OPTIONS
+    key = SimulationCache.make_key(digest, options)
+    results = SIMULATION_CACHE.get(key)
+    if results is not None:
+        print(f"命中模拟结果缓存: {key}")
+        return results
+
+    solver = _LOCAL_SOLVERS.get(digest)
+    results = solver(digest, options) if solver is not None else None
+    if results is None:
+        results = SIM_POOL.simulate(digest, options, inp_file_path)
+    SIMULATION_CACHE.put(key, results)
+    return results
+
+
+def run_until_hour(digest, hour, inp_file_path=None):
+    """
+    获取指定小时的结果：已有完整模拟结果时直接使用，否则只模拟到与该小时最接近的报告时刻
+    （0时刻为单时段模拟）。截止时刻之前的各时间步与完整模拟相同，结果同样按管网版本缓存
+
+    参数:
+        digest (str): 管网INP内容哈希（模型须已在 NETWORK_STORE 中）
+        hour (float): 模拟时间（小时）
+        inp_file_path (str): 管网INP文件路径，供工作进程加载模型
+
+    返回:
+        SimulationArrays: 列式模拟结果，最后一个时间步即指定小时
+    """
+    results = SIMULATION_CACHE.get(SimulationCache.make_key(digest, DEFAULT_SIM_OPTIONS))
+    if results is not None:
+        return results
+    time_options = NETWORK_STORE.get_by_digest(digest, copy=False).options.time
+    duration = report_time(time_options, hour)
+    if duration >= time_options.duration:
+        return run_simulation(digest, inp_file_path=inp_file_path)
+    return run_simulation(digest, {**DEFAULT_SIM_OPTIONS, 'duration': duration}, inp_file_path)
+
+
+def invalidate_results(digest):
+    """管网被修改后，删除旧版本管网的模拟结果缓存"""
+    SIMULATION_CACHE.invalidate(digest)
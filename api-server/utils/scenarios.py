@@ -0,0 +1,221 @@
+"""
+批量情景模拟
+
+对同一管网的多个情景并行模拟，每个情景可以修改：
+- demands: 节点基本需水量 {节点ID: 需水量(m³/s)}
+- pump_status: 水泵初始状态 {水泵ID: "OPEN" / "CLOSED"}（管网中的控制规则仍然生效）
+- tank_levels: 水池初始水位 {水池ID: 水位(m)}
+
+每个情景在模拟进程池的工作进程中对缓存模型的副本应用修改后运行EPANET。
+结果不经pickle传回，而是由工作进程直接写入主进程预先分配的共享内存数组，
+主进程在共享数组上一次性计算所有情景的汇总。
+"""
+import numpy as np
+import wntr
+
+from utils.network_store import NETWORK_STORE
+from utils.result_arrays import NODE_VARIABLES, LINK_VARIABLES
+from utils.result_cache import DEFAULT_SIM_OPTIONS
+from utils.shared_arrays import SharedArrays
+from utils.sim_pool import SIM_POOL, NetworkMissing, worker_network, run_epanet, scratch_prefix
+
+SCENARIO_KEYS = ('name', 'demands', 'pump_status', 'tank_levels')
+PUMP_STATUSES = {
+    'OPEN': wntr.network.LinkStatus.Open,
+    'CLOSED': wntr.network.LinkStatus.Closed,
+}
+
+# 返回完整时间序列时包含的变量
+FULL_NODE_VARIABLES = ('pressure', 'head', 'demand')
+FULL_LINK_VARIABLES = ('flowrate',)
+
+
+def report_times(wn):
+    """EPANET输出结果的报告时刻（秒）"""
+    time = wn.options.time
+    if time.duration == 0:
+        return np.zeros(1)
+    return np.arange(time.report_start, time.duration + 1, time.report_timestep, dtype=np.float64)
+
+
+def validate_scenario(wn, scenario):
+    """检查情景中的元素ID和取值，不合法时抛出ValueError"""
+    if not isinstance(scenario, dict):
+        raise ValueError("情景必须是JSON对象")
+    unknown = set(scenario) - set(SCENARIO_KEYS)
+    if unknown:
+        raise ValueError(f"不支持的情景字段: {sorted(unknown)}，可选: {list(SCENARIO_KEYS)}")
+
+    for node_id, demand in (scenario.get('demands') or {}).items():
+        if node_id not in wn.junction_name_list:
+            raise ValueError(f"节点 {node_id} 不存在或不是用户节点")
+        if not isinstance(demand, (int, float)):
+            raise ValueError(f"节点 {node_id} 的需水量必须是数值")
+
+    for pump_id, status in (scenario.get('pump_status') or {}).items():
+        if pump_id not in wn.pump_name_list:
+            raise ValueError(f"水泵 {pump_id} 不存在")
+        if str(status).upper() not in PUMP_STATUSES:
+            raise ValueError(f"水泵 {pump_id} 的状态必须是 {list(PUMP_STATUSES)} 之一")
+
+    for tank_id, level in (scenario.get('tank_levels') or {}).items():
+        if tank_id not in wn.tank_name_list:
+            raise ValueError(f"水池 {tank_id} 不存在")
+        if not isinstance(level, (int, float)):
+            raise ValueError(f"水池 {tank_id} 的初始水位必须是数值")
+        tank = wn.get_node(tank_id)
+        if not tank.min_level <= level <= tank.max_level:
+            raise ValueError(f"水池 {tank_id} 的初始水位必须在 {tank.min_level} 到 {tank.max_level} 之间")
+
+
+def apply_scenario(wn, scenario):
+    """将情景中的修改应用到管网模型（调用方须传入副本）"""
+    for node_id, demand in (scenario.get('demands') or {}).items():
+        node = wn.get_node(node_id)
+        if len(node.demand_timeseries_list) > 0:
+            node.demand_timeseries_list[0].base_value = float(demand)
+        else:
+            node.add_demand(float(demand), None)
+
+    for pump_id, status in (scenario.get('pump_status') or {}).items():
+        wn.get_link(pump_id).initial_status = PUMP_STATUSES[str(status).upper()]
+
+    for tank_id, level in (scenario.get('tank_levels') or {}).items():
+        wn.get_node(tank_id).init_level = float(level)
+
+
+def _run_scenario(digest, inp_file_path, blob, options, scenario, index, layout):
+    """
+    在工作进程中模拟一个情景，并把结果写入共享数组的第index行
+
+    返回:
+        dict: {"periods": 写入的时间步数} 或 {"error": 错误信息}
+    """
+    try:
+        wn = worker_network(digest, inp_file_path, blob, copy=True)
+        apply_scenario(wn, scenario)
+        with scratch_prefix() as file_prefix:
+            results = run_epanet(wn, file_prefix, options)
+    except NetworkMissing:
+        raise
+    except Exception as e:
+        return {"error": str(e)}
+
+    # 结果按主进程的元素顺序（wn.node_name_list / wn.link_name_list）写入
+    node_rows = [results.node_index[node_id] for node_id in wn.node_name_list]
+    link_rows = [results.link_index[link_id] for link_id in wn.link_name_list]
+    pressure = results.node_values[node_rows, :, NODE_VARIABLES.index('pressure')]
+    flow = results.link_values[link_rows, :, LINK_VARIABLES.index('flowrate')]
+    periods = len(results.times)
+
+    with SharedArrays.attach(layout) as shared:
+        shared['min_pressure'][index] = pressure.min(axis=1)
+        shared['max_pressure'][index] = pressure.max(axis=1)
+        shared['min_flow'][index] = flow.min(axis=1)
+        shared['max_flow'][index] = flow.max(axis=1)
+        # 模拟提前终止时结果的时间步可能少于预期，其余位置保持为NaN
+        for name in FULL_NODE_VARIABLES:
+            if name in shared:
+                count = min(periods, shared[name].shape[2])
+                shared[name][index, :, :count] = results.node_values[node_rows, :count, NODE_VARIABLES.index(name)]
+        for name in FULL_LINK_VARIABLES:
+            if name in shared:
+                count = min(periods, shared[name].shape[2])
+                shared[name][index, :, :count] = results.link_values[link_rows, :count, LINK_VARIABLES.index(name)]
+    return {"periods": periods}
+
+
+def _masked_extreme(values, mask, largest):
+    """对每个情景在mask选中的列中求最值及其列号，全为NaN的情景返回 (nan, -1)"""
+    values = values[:, mask]
+    fill = -np.inf if largest else np.inf
+    filled = np.where(np.isnan(values), fill, values)
+    columns = filled.argmax(axis=1) if largest else filled.argmin(axis=1)
+    extremes = filled[np.arange(values.shape[0]), columns]
+    valid = np.isfinite(extremes)
+    return np.where(valid, extremes, np.nan), np.where(valid, np.flatnonzero(mask)[columns], -1)
+
+
+def run_scenarios(digest, scenarios, include_arrays=False, options=None, inp_file_path=None, callback=None):
+    """
+    并行模拟一组情景
+
+    参数:
+        digest (str): 管网内容哈希（模型须已在 NETWORK_STORE 中）
+        scenarios (list): 情景列表，格式见模块说明（调用前应先用 validate_scenario 检查）
+        include_arrays (bool): 是否返回完整时间序列
+        options (dict): 模拟器选项，默认为 DEFAULT_SIM_OPTIONS
+        inp_file_path (str): 管网INP文件路径，供工作进程加载模型
+        callback (callable): 每完成一个情景调用 callback(完成数, 总数)
+
+    返回:
+        dict: node_ids、link_ids、times、每个情景的汇总 summaries，
+              以及include_arrays时的 arrays {变量名: 形状为(情景数, 元素数, 时间步数)的数组}
+    """
+    options = options or DEFAULT_SIM_OPTIONS
+    wn = NETWORK_STORE.get_by_digest(digest, copy=False)
+    node_ids = list(wn.node_name_list)
+    link_ids = list(wn.link_name_list)
+    times = report_times(wn)
+    n_scenarios, n_nodes, n_links, n_times = len(scenarios), len(node_ids), len(link_ids), len(times)
+
+    shapes = {
+        'min_pressure': (n_scenarios, n_nodes),
+        'max_pressure': (n_scenarios, n_nodes),
+        'min_flow': (n_scenarios, n_links),
+        'max_flow': (n_scenarios, n_links),
+    }
+    if include_arrays:
+        shapes.update({name: (n_scenarios, n_nodes, n_times) for name in FULL_NODE_VARIABLES})
+        shapes.update({name: (n_scenarios, n_links, n_times) for name in FULL_LINK_VARIABLES})
+
+    with SharedArrays.create(shapes) as shared:
+        statuses = SIM_POOL.map_network(
+            _run_scenario, digest, inp_file_path,
+            [(options, scenario, index, shared.layout) for index, scenario in enumerate(scenarios)],
+            callback=callback
+        )
+
+        # 在所有情景上一次性计算汇总
+        junction_mask = np.array([wn.get_node(node_id).node_type == 'Junction' for node_id in node_ids], dtype=bool)
+        link_mask = np.ones(n_links, dtype=bool)
+        min_pressure, min_pressure_rows = _masked_extreme(shared['min_pressure'], junction_mask, largest=False)
+        max_pressure, max_pressure_rows = _masked_extreme(shared['max_pressure'], junction_mask, largest=True)
+        min_flow, min_flow_rows = _masked_extreme(shared['min_flow'], link_mask, largest=False)
+        max_flow, max_flow_rows = _masked_extreme(shared['max_flow'], link_mask, largest=True)
+
+        # 复制出需要返回的数组后才能释放共享内存
+        arrays = None
+        if include_arrays:
+            arrays = {name: np.array(shared[name]) for name in FULL_NODE_VARIABLES + FULL_LINK_VARIABLES}
+
+    summaries = []
+    for index, (scenario, status) in enumerate(zip(scenarios, statuses)):
+        summary = {
+            'index': index,
+            'name': scenario.get('name', f'scenario-{index}'),
+            'success': 'error' not in status,
+        }
+        if 'error' in status:
+            summary['error'] = status['error']
+        else:
+            summary.update({
+                'periods': status['periods'],
+                'min_pressure': float(min_pressure[index]),
+                'min_pressure_node': node_ids[min_pressure_rows[index]] if min_pressure_rows[index] >= 0 else None,
+                'max_pressure': float(max_pressure[index]),
+                'max_pressure_node': node_ids[max_pressure_rows[index]] if max_pressure_rows[index] >= 0 else None,
+                'min_flow': float(min_flow[index]),
+                'min_flow_link': link_ids[min_flow_rows[index]] if min_flow_rows[index] >= 0 else None,
+                'max_flow': float(max_flow[index]),
+                'max_flow_link': link_ids[max_flow_rows[index]] if max_flow_rows[index] >= 0 else None,
+            })
+        summaries.append(summary)
+
+    return {
+        'node_ids': node_ids,
+        'link_ids': link_ids,
+        'times': times,
+        'summaries': summaries,
+        'arrays': arrays,
+    }
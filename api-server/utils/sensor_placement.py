@@ -0,0 +1,91 @@
+"""
+监测点布置（最远点贪心）
+
+从第一个节点开始，每次选择到已选监测点最短路径距离最大的节点作为下一个监测点。
+- 保存每个节点到最近监测点的距离，新增监测点后只从该点出发做一次剪枝的Dijkstra
+  （只更新距离变小的节点），无需每轮从全部监测点重新计算。每次搜索通常只涉及少数节点，
+  这里直接在拓扑图的CSR数组上循环，而不调用csgraph（其每次调用都要校验和复制整个图）
+- 贪心顺序与管网版本绑定并缓存，任意k个监测点的方案都是该顺序的前k个
+"""
+import heapq
+import threading
+
+import numpy as np
+
+from utils.network_graph import UNREACHABLE, get_network_graph
+from utils.network_store import NETWORK_STORE
+
+
+class FarthestPointPlacement:
+    """按需扩展的最远点贪心布点顺序"""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.node_ids = graph.node_ids
+        self._adjacency = graph.adjacency_lists()
+        # 到最近监测点的距离：Python列表供Dijkstra读写，NumPy数组供求最大值（已选节点为-1）
+        self._dist = [UNREACHABLE] * len(graph)
+        self._candidates = np.full(len(graph), UNREACHABLE)
+        self.order = []
+        # max_distances[k-1]: 布置k个监测点后未选节点到最近监测点的最大距离
+        self.max_distances = []
+        self._lock = threading.Lock()
+
+    def _add_sensor(self, source):
+        """新增监测点，从该点出发只松弛距离变小的节点"""
+        indptr, indices, weights = self._adjacency
+        dist = self._dist
+        dist[source] = 0
+        changed = [source]
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                nd = d + weights[k]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    changed.append(v)
+                    heapq.heappush(heap, (nd, v))
+
+        self.order.append(source)
+        self._candidates[changed] = [dist[i] for i in changed]
+        self._candidates[self.order] = -1
+
+    def extend(self, count):
+        """把贪心顺序扩展到至少count个监测点"""
+        count = min(count, len(self.node_ids))
+        with self._lock:
+            while len(self.order) < count:
+                if not self.order:
+                    self._add_sensor(0)
+                else:
+                    # 距离相同时取节点顺序靠前者
+                    self._add_sensor(int(np.argmax(self._candidates)))
+                if len(self.order) < len(self.node_ids):
+                    self.max_distances.append(float(self._candidates.max()))
+                else:
+                    self.max_distances.append(0)
+
+    def plan(self, count):
+        """
+        前count个监测点
+
+        返回:
+            tuple: (监测点ID列表, 未选节点到最近监测点的最大距离)
+        """
+        self.extend(count)
+        return [self.node_ids[i] for i in self.order[:count]], self.max_distances[count - 1]
+
+    def coverage_curve(self):
+        """布置1到全部节点个监测点时的最大距离 {"k": 距离}"""
+        self.extend(len(self.node_ids))
+        return {str(k + 1): distance for k, distance in enumerate(self.max_distances)}
+
+
+def get_placement(digest):
+    """获取管网版本对应的布点顺序（缓存在 NETWORK_STORE 中，随模型一起淘汰）"""
+    return NETWORK_STORE.get_artifact(digest, 'farthest_point_placement',
+                                      lambda wn: FarthestPointPlacement(get_network_graph(digest)))
@@ -0,0 +1,78 @@
+"""
+共享内存数组
+
+批量模拟时由主进程在 multiprocessing.shared_memory 中预先分配结果数组，
+工作进程按名称挂载后直接写入自己负责的行，结果无需pickle后经管道传回。
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+DTYPE = np.float32
+
+
+class SharedArrays:
+    """一组位于共享内存中的float32数组，按名称访问"""
+
+    def __init__(self, blocks, owner):
+        # 名称 -> (SharedMemory, ndarray)
+        self._blocks = blocks
+        self.owner = owner
+
+    @classmethod
+    def create(cls, shapes, fill=np.nan):
+        """
+        在主进程中分配共享数组
+
+        参数:
+            shapes (dict): 数组名称 -> 形状
+            fill (float): 初始值，默认NaN（未写入的位置保持为NaN）
+        """
+        blocks = {}
+        try:
+            for name, shape in shapes.items():
+                nbytes = max(int(np.prod(shape)) * np.dtype(DTYPE).itemsize, 1)
+                shm = shared_memory.SharedMemory(create=True, size=nbytes)
+                array = np.ndarray(shape, dtype=DTYPE, buffer=shm.buf)
+                array.fill(fill)
+                blocks[name] = (shm, array)
+        except Exception:
+            cls(blocks, owner=True).release()
+            raise
+        return cls(blocks, owner=True)
+
+    @classmethod
+    def attach(cls, layout):
+        """在工作进程中按 layout 挂载主进程分配的共享数组"""
+        blocks = {}
+        for name, (shm_name, shape) in layout.items():
+            # spawn启动的工作进程与主进程共用同一个资源跟踪器，共享内存由主进程删除
+            shm = shared_memory.SharedMemory(name=shm_name)
+            blocks[name] = (shm, np.ndarray(shape, dtype=DTYPE, buffer=shm.buf))
+        return cls(blocks, owner=False)
+
+    @property
+    def layout(self):
+        """传给工作进程的描述：数组名称 -> (共享内存名称, 形状)"""
+        return {name: (shm.name, array.shape) for name, (shm, array) in self._blocks.items()}
+
+    def __contains__(self, name):
+        return name in self._blocks
+
+    def __getitem__(self, name):
+        return self._blocks[name][1]
+
+    def release(self):
+        """解除映射；主进程还会删除共享内存。调用前须先释放（或复制）取得的数组视图"""
+        shms = [shm for shm, _ in self._blocks.values()]
+        self._blocks = {}
+        for shm in shms:
+            shm.close()
+            if self.owner:
+                shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,214 @@
+"""
+EPANET模拟工作进程池
+
+EpanetSimulator 会把 .inp/.rpt/.bin 临时文件写到工作目录，多个请求同时模拟会互相覆盖文件，
+因此模拟不在请求进程中运行，而是分发到预先启动的工作进程：
+- 每个工作进程有独立的临时目录（优先放在tmpfs上），进程内一次只运行一个模拟
+- 每个工作进程启动时只预加载 config.NETWORK_DIRS 中 config.NETWORK_PRELOAD_IDS 指定的管网，其余管网在第一次
+  模拟时加载；模型在自己的 NETWORK_STORE 中按内容哈希缓存，按内存上限淘汰
+N个工作进程即可并行运行N个模拟。
+"""
+import atexit
+import contextlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+import wntr
+from wntr.epanet.util import EN
+
+import config
+from utils.network_store import NETWORK_STORE
+from utils.epanet_output import EpanetOutput
+from utils.result_arrays import SimulationArrays
+
+# 工作进程的临时目录
+_WORKER_SCRATCH_DIR = None
+
+
+class NetworkMissing(Exception):
+    """工作进程中没有指定版本的管网模型，需要由主进程发送"""
+
+
+def run_epanet(wn, file_prefix, options):
+    """
+    运行EPANET模拟并转换为列式结果
+
+    参数:
+        wn (WaterNetworkModel): 管网模型（只读）
+        file_prefix (str): 临时文件路径前缀
+        options (dict): 模拟器选项，可含 duration（模拟时长，秒，覆盖INP中的设置）
+    """
+    if wn.msx is not None:
+        # 多组分水质模拟需要wntr合并MSX结果
+        sim = wntr.sim.EpanetSimulator(wn)
+        return SimulationArrays.from_results(sim.run_sim(file_prefix=file_prefix, version=options['version']))
+
+    # 与 EpanetSimulator.run_sim 相同的调用顺序，但不生成文本报告，也不把输出文件整个读入DataFrame：
+    # 结果直接从内存映射的 .bin 文件按变量换算写入列式数组
+    version = float(options['version'])
+    inp_file = file_prefix + '.inp'
+    out_file = file_prefix + '.bin'
+    wntr.network.write_inpfile(wn, inp_file, units=wn.options.hydraulic.inpfile_units, version=version)
+    toolkit = wntr.epanet.toolkit.ENepanet(version=version)
+    try:
+        toolkit.ENopen(inp_file, file_prefix + '.rpt', out_file)
+        if options.get('duration') is not None:
+            # 只模拟到指定时刻（秒），0为单时段稳态模拟
+            toolkit.ENsettimeparam(EN.DURATION, int(options['duration']))
+        toolkit.ENsolveH()
+        toolkit.ENsolveQ()
+    finally:
+        # 求解失败时同样释放EPANET项目和文件句柄，否则长期运行的工作进程每次失败都会泄漏
+        toolkit.ENclose()
+    with EpanetOutput(out_file, darcy_weisbach=wn.options.hydraulic.headloss == 'D-W') as output:
+        return output.to_arrays()
+
+
+def _init_worker(scratch_root, preload_files):
+    """工作进程初始化：创建独立的临时目录并预加载管网"""
+    global _WORKER_SCRATCH_DIR
+    _WORKER_SCRATCH_DIR = tempfile.mkdtemp(prefix=f'worker-{os.getpid()}-', dir=scratch_root)
+    # 切换工作目录，确保任何遗留的临时文件都只写到本进程的目录中
+    os.chdir(_WORKER_SCRATCH_DIR)
+    atexit.register(shutil.rmtree, _WORKER_SCRATCH_DIR, True)
+
+    for inp_file_path in preload_files:
+        try:
+            NETWORK_STORE.load_file(inp_file_path)
+        except Exception as e:
+            print(f"工作进程 {os.getpid()} 预加载 {inp_file_path} 失败: {str(e)}")
+
+
+def worker_network(digest, inp_file_path, blob, copy=False):
+    """在工作进程中获取指定版本的管网模型"""
+    if digest not in NETWORK_STORE:
+        if blob is not None:
+            NETWORK_STORE.put_blob(digest, blob)
+        elif inp_file_path is None or NETWORK_STORE.load_file(inp_file_path) != digest:
+            raise NetworkMissing(digest)
+    return NETWORK_STORE.get_by_digest(digest, copy=copy)
+
+
+@contextlib.contextmanager
+def scratch_prefix():
+    """模拟临时文件的路径前缀：工作进程使用自己的目录，在主进程中运行时使用一次性的临时目录"""
+    if _WORKER_SCRATCH_DIR is not None:
+        yield os.path.join(_WORKER_SCRATCH_DIR, 'sim')
+        return
+    with tempfile.TemporaryDirectory(prefix='sim-', dir=config.SIM_SCRATCH_DIR) as scratch_dir:
+        yield os.path.join(scratch_dir, 'sim')
+
+
+def _simulate_in_worker(digest, inp_file_path, blob, options):
+    """在工作进程中运行模拟"""
+    wn = worker_network(digest, inp_file_path, blob)
+    with scratch_prefix() as file_prefix:
+        return run_epanet(wn, file_prefix, options)
+
+
+class SimulationPool:
+    """EPANET模拟工作进程池（首次使用时启动全部工作进程）"""
+
+    def __init__(self, workers, scratch_root, preload_files, timeout):
+        self.workers = workers
+        self.scratch_root = scratch_root
+        self.preload_files = preload_files
+        self.timeout = timeout
+        self._pool = None
+        self._pool_scratch_dir = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动工作进程池"""
+        with self._lock:
+            if self._pool is None:
+                self._pool_scratch_dir = tempfile.mkdtemp(prefix='water-sim-pool-', dir=self.scratch_root)
+                # 使用spawn启动，避免在多线程的Web进程中fork
+                context = multiprocessing.get_context('spawn')
+                self._pool = context.Pool(self.workers, initializer=_init_worker,
+                                          initargs=(self._pool_scratch_dir, self.preload_files))
+                atexit.register(self.shutdown)
+            return self._pool
+
+    def shutdown(self):
+        """关闭工作进程池并删除临时目录"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                shutil.rmtree(self._pool_scratch_dir, ignore_errors=True)
+                self._pool = None
+
+    def call(self, func, *args):
+        """在工作进程中执行func（必须是可导入的模块级函数），工作进程数为0时在当前进程中执行"""
+        if self.workers <= 0:
+            return func(*args)
+        return self.start().apply_async(func, args).get(self.timeout)
+
+    def map_network(self, func, digest, inp_file_path, args_list, callback=None):
+        """
+        在工作进程中并行执行 func(digest, inp_file_path, blob, *args)，args_list中每项一次
+
+        func通过 worker_network 获取管网模型。INP文件内容与digest一致时只向工作进程传递文件路径，
+        否则（例如模型只存在于内存中）传递序列化的模型。
+
+        参数:
+            callback (callable): 每完成一项调用 callback(完成数, 总数)，可在其中抛出异常以中止等待
+
+        返回:
+            list: 与args_list一一对应的返回值
+        """
+        if inp_file_path is None or not os.path.exists(inp_file_path) \
+                or NETWORK_STORE.digest_file(inp_file_path) != digest:
+            inp_file_path = None
+        network_args = (digest, inp_file_path, None if inp_file_path else NETWORK_STORE.get_blob(digest))
+
+        if self.workers <= 0:
+            # 在当前进程中运行，模型已在 NETWORK_STORE 中
+            results = []
+            for args in args_list:
+                results.append(func(digest, None, None, *args))
+                if callback is not None:
+                    callback(len(results), len(args_list))
+            return results
+
+        pool = self.start()
+        handles = [pool.apply_async(func, network_args + tuple(args)) for args in args_list]
+        results = []
+        for args, handle in zip(args_list, handles):
+            try:
+                results.append(handle.get(self.timeout))
+            except NetworkMissing:
+                # 工作进程中的模型已被淘汰且文件已变化，改为发送序列化的模型
+                results.append(self.call(func, digest, None, NETWORK_STORE.get_blob(digest), *args))
+            if callback is not None:
+                callback(len(results), len(args_list))
+        return results
+
+    def simulate(self, digest, options, inp_file_path=None):
+        """
+        在工作进程中模拟指定版本的管网
+
+        参数:
+            digest (str): 管网内容哈希（模型须已在主进程的 NETWORK_STORE 中）
+            options (dict): 模拟器选项
+            inp_file_path (str): 管网INP文件路径，内容与digest一致时工作进程从此文件加载
+
+        返回:
+            SimulationArrays: 列式模拟结果
+        """
+        return self.map_network(_simulate_in_worker, digest, inp_file_path, [(options,)])[0]
+
+
+def preload_files():
+    """工作进程启动时预加载的INP文件"""
+    paths = [os.path.join(networks_dir, f"{network_id}.inp")
+             for networks_dir in config.NETWORK_DIRS for network_id in config.NETWORK_PRELOAD_IDS]
+    return [path for path in paths if os.path.exists(path)]
+
+
+SIM_POOL = SimulationPool(config.SIM_POOL_WORKERS, config.SIM_SCRATCH_DIR,
+                          preload_files(), config.SIM_POOL_TIMEOUT)
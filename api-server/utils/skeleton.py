@@ -0,0 +1,329 @@
+"""
+快速预览：在骨架化的管网上模拟，再把结果映射回原管网
+
+骨架化使用 wntr.morph.skeletonize（枝状管段裁剪、串联管段合并、并联管段合并，
+只处理直径不超过 config.SKELETON_DIAMETER_THRESHOLD 的管段），每个管网版本构建一次并缓存。
+骨架模型以 "<原管网哈希>-skeleton-<阈值>" 为键放入 NETWORK_STORE，由模拟进程池按普通管网模拟。
+
+结果映射回原管网的方式：
+- 水头：被删除的节点按其所在的被删除区段（被删除节点的连通块）与各边界保留节点之间的管长，
+  对边界节点的水头做反距离加权插值。串联链上即为按管长线性插值，枝状末端取其接入点的水头
+- 压力：保留节点直接取骨架结果，被删除节点为插值水头减去标高
+- 需水量：用户节点按原模型的基本需水量和时间模式计算（需水量驱动模拟时与完整模型一致），
+  水箱、水池取骨架结果
+- 管段：两端和参数都未改变的管段直接取骨架结果；其余管道由两端水头差按水头损失公式
+  （H-W / D-W完全粗糙区 / C-M，不计局部损失）反算流量
+"""
+import pickle
+import threading
+import time
+
+import numpy as np
+import wntr
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+
+import config
+from utils.network_graph import get_network_graph
+from utils.network_store import NETWORK_STORE
+from utils.result_arrays import LINK_VARIABLES, NODE_VARIABLES, SimulationArrays
+from utils.result_cache import DEFAULT_SIM_OPTIONS, SIMULATION_CACHE, SimulationCache, run_simulation
+from utils.sim_pool import SIM_POOL
+
+NODE_COLUMN = {name: k for k, name in enumerate(NODE_VARIABLES)}
+LINK_COLUMN = {name: k for k, name in enumerate(LINK_VARIABLES)}
+
+GRAVITY = 9.81
+
+
+def _friction_coefficients(wn, pipes):
+    """
+    管道流量与水头差的关系 Q = 系数 × |Δh|^指数（国际单位）
+
+    返回:
+        tuple: (系数数组, 指数)
+    """
+    length = np.array([pipe.length for pipe in pipes])
+    diameter = np.array([pipe.diameter for pipe in pipes])
+    roughness = np.array([pipe.roughness for pipe in pipes])
+    headloss = wn.options.hydraulic.headloss
+    if headloss == 'H-W':
+        # h = 10.667 L Q^1.852 / (C^1.852 D^4.871)
+        return (roughness ** 1.852 * diameter ** 4.871 / (10.667 * length)) ** (1 / 1.852), 1 / 1.852
+    if headloss == 'D-W':
+        # 完全粗糙区的摩阻系数 f = 0.25 / log10(ε / 3.7D)²，h = f L V² / (2 g D)
+        friction = 0.25 / np.log10(roughness / (3.7 * diameter)) ** 2
+        area = np.pi * diameter ** 2 / 4
+        return area * np.sqrt(2 * GRAVITY * diameter / (friction * length)), 0.5
+    # C-M: h = 10.29 n² L Q² / D^(16/3)
+    return np.sqrt(diameter ** (16 / 3) / (10.29 * roughness ** 2 * length)), 0.5
+
+
+class Skeleton:
+    """管网骨架及其到原管网的结果映射"""
+
+    def __init__(self, digest, wn, diameter_threshold):
+        started = time.perf_counter()
+        self.source_digest = digest
+        self.diameter_threshold = diameter_threshold
+        self.digest = f"{digest}-skeleton-{diameter_threshold:g}"
+
+        # skeletonize 会就地修改模型，使用共享模型的副本；水质源所在的节点不能删除
+        source_nodes = sorted({source.node_name for _, source in wn.sources()} & set(wn.junction_name_list))
+        skeleton_wn, self.skeleton_map = wntr.morph.skeletonize(
+            NETWORK_STORE.get_by_digest(digest), diameter_threshold, junctions_to_exclude=source_nodes,
+            return_map=True, return_copy=False)
+        self.blob = pickle.dumps(skeleton_wn, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.node_ids = list(wn.node_name_list)
+        self.link_ids = list(wn.link_name_list)
+        node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.skeleton_node_ids = list(skeleton_wn.node_name_list)
+        self.skeleton_link_ids = list(skeleton_wn.link_name_list)
+        skeleton_node_index = {node_id: i for i, node_id in enumerate(self.skeleton_node_ids)}
+        skeleton_link_index = {link_id: i for i, link_id in enumerate(self.skeleton_link_ids)}
+
+        # 保留节点：原序号 -> 骨架序号
+        self.kept_nodes = np.array([node_index[node_id] for node_id in self.skeleton_node_ids], dtype=np.int64)
+        self.head_weights = self._head_weights(get_network_graph(digest), skeleton_node_index)
+        self.elevations = np.array([getattr(wn.get_node(node_id), 'elevation', 0.0) or 0.0
+                                    for node_id in self.node_ids])
+        self._prepare_demands(wn, node_index)
+        self._prepare_links(wn, skeleton_wn, node_index, skeleton_link_index)
+
+        self.build_seconds = time.perf_counter() - started
+        self.report = None
+        self._report_lock = threading.Lock()
+
+    def _head_weights(self, graph, skeleton_node_index):
+        """
+        原管网节点水头 = 插值矩阵 × 骨架节点水头
+
+        被删除节点的每个连通块只与其边界上的保留节点插值，计算到某个边界节点的距离时不经过其他边界节点
+        """
+        n = len(self.node_ids)
+        kept = np.zeros(n, dtype=bool)
+        kept[self.kept_nodes] = True
+        rows = self.kept_nodes.tolist()
+        columns = list(range(len(self.kept_nodes)))
+        values = [1.0] * len(self.kept_nodes)
+
+        removed = np.flatnonzero(~kept)
+        if len(removed):
+            _, labels = connected_components(graph.matrix[removed][:, removed], directed=False)
+            indptr, indices = graph.indptr, graph.indices
+            for component in np.split(removed[np.argsort(labels, kind='stable')],
+                                      np.flatnonzero(np.diff(np.sort(labels))) + 1):
+                neighbors = np.concatenate([indices[indptr[i]:indptr[i + 1]] for i in component])
+                boundary = np.unique(neighbors[kept[neighbors]])
+                if len(boundary) == 0:
+                    # 与保留节点不连通的孤立部分没有结果
+                    continue
+                inverse = np.zeros((len(boundary), len(component)))
+                for k, node in enumerate(boundary.tolist()):
+                    local = np.concatenate([[node], component])
+                    distances = dijkstra(graph.matrix[local][:, local], directed=False, indices=0)[1:]
+                    with np.errstate(divide='ignore'):
+                        inverse[k] = np.where(np.isfinite(distances), 1.0 / np.maximum(distances, 1e-9), 0.0)
+                weights = inverse / inverse.sum(axis=0)
+                for k, node in enumerate(boundary.tolist()):
+                    column = skeleton_node_index[self.node_ids[node]]
+                    rows.extend(component.tolist())
+                    columns.extend([column] * len(component))
+                    values.extend(weights[k].tolist())
+        return csr_matrix((values, (rows, columns)), shape=(n, len(self.kept_nodes)))
+
+    def _prepare_demands(self, wn, node_index):
+        """用户节点需水量 = 基本需水量矩阵 × 各时间模式在各时刻的系数"""
+        default_pattern = wn.options.hydraulic.pattern
+        if default_pattern not in wn.pattern_name_list:
+            default_pattern = None
+        self.patterns = []
+        pattern_index = {}
+        rows, columns, values = [], [], []
+        for junction_id in wn.junction_name_list:
+            for demand in wn.get_node(junction_id).demand_timeseries_list:
+                name = demand.pattern_name or default_pattern
+                if name not in pattern_index:
+                    pattern_index[name] = len(self.patterns)
+                    self.patterns.append(wn.get_pattern(name) if name is not None else None)
+                rows.append(node_index[junction_id])
+                columns.append(pattern_index[name])
+                values.append(demand.base_value)
+        self.demand_bases = csr_matrix((values, (rows, columns)), shape=(len(self.node_ids), len(self.patterns)))
+        self.demand_multiplier = wn.options.hydraulic.demand_multiplier
+        self.junctions = np.array([node_index[junction_id] for junction_id in wn.junction_name_list], dtype=np.int64)
+
+    def _prepare_links(self, wn, skeleton_wn, node_index, skeleton_link_index):
+        """区分直接取骨架结果的管段和需要由水头差反算流量的管道"""
+        kept, kept_columns, pipes = [], [], []
+        for i, link_id in enumerate(self.link_ids):
+            link = wn.get_link(link_id)
+            column = skeleton_link_index.get(link_id)
+            if column is not None:
+                other = skeleton_wn.get_link(link_id)
+                unchanged = (other.start_node_name == link.start_node_name and other.end_node_name == link.end_node_name
+                             and (link.link_type != 'Pipe' or (other.length, other.diameter, other.roughness)
+                                  == (link.length, link.diameter, link.roughness)))
+                if unchanged:
+                    kept.append(i)
+                    kept_columns.append(column)
+                    continue
+            pipes.append(i)
+        self.kept_links = np.array(kept, dtype=np.int64)
+        self.kept_link_columns = np.array(kept_columns, dtype=np.int64)
+        self.derived_pipes = np.array(pipes, dtype=np.int64)
+
+        derived = [wn.get_link(self.link_ids[i]) for i in pipes]
+        self.pipe_ends = np.array([[node_index[pipe.start_node_name], node_index[pipe.end_node_name]]
+                                   for pipe in derived], dtype=np.int64).reshape(-1, 2)
+        self.pipe_coefficients, self.pipe_exponent = _friction_coefficients(wn, derived) if derived else (np.zeros(0), 0.5)
+        self.pipe_areas = np.array([np.pi * pipe.diameter ** 2 / 4 for pipe in derived])
+        self.pipe_lengths = np.array([pipe.length for pipe in derived])
+        self.pipe_roughness = np.array([pipe.roughness for pipe in derived])
+        self.pipe_closed = np.array([str(pipe.initial_status).lower() == 'closed' for pipe in derived], dtype=bool)
+        self.pipe_check_valve = np.array([bool(getattr(pipe, 'check_valve', False)) for pipe in derived], dtype=bool)
+
+    @property
+    def summary(self):
+        """骨架化前后的规模"""
+        return {
+            'diameter_threshold': self.diameter_threshold,
+            'nodes': len(self.node_ids),
+            'links': len(self.link_ids),
+            'skeleton_nodes': len(self.skeleton_node_ids),
+            'skeleton_links': len(self.skeleton_link_ids),
+            'build_seconds': round(self.build_seconds, 3),
+        }
+
+    def ensure_loaded(self):
+        """确保骨架模型在 NETWORK_STORE 中（可能已随LRU被淘汰），返回其键"""
+        if self.digest not in NETWORK_STORE:
+            NETWORK_STORE.put_blob(self.digest, self.blob)
+        return self.digest
+
+    def expand(self, skeleton_results):
+        """
+        把骨架的模拟结果映射回原管网
+
+        参数:
+            skeleton_results (SimulationArrays): 骨架模型的列式模拟结果
+
+        返回:
+            SimulationArrays: 原管网全部节点和管段的（近似）结果
+        """
+        times = skeleton_results.times
+        n_times = len(times)
+        skeleton_nodes = skeleton_results.node_values.astype(np.float64)
+
+        node_values = np.empty((len(self.node_ids), n_times, len(NODE_VARIABLES)), dtype=np.float32)
+        head = self.head_weights @ skeleton_nodes[:, :, NODE_COLUMN['head']]
+        pressure = head - self.elevations[:, None]
+        pressure[self.kept_nodes] = skeleton_nodes[:, :, NODE_COLUMN['pressure']]
+        demand = np.zeros((len(self.node_ids), n_times))
+        demand[self.kept_nodes] = skeleton_nodes[:, :, NODE_COLUMN['demand']]
+        multipliers = np.array([[pattern.at(t) if pattern is not None else 1.0 for t in times.tolist()]
+                                for pattern in self.patterns]).reshape(len(self.patterns), n_times)
+        demand[self.junctions] = (self.demand_bases @ multipliers)[self.junctions] * self.demand_multiplier
+        node_values[:, :, NODE_COLUMN['head']] = head
+        node_values[:, :, NODE_COLUMN['pressure']] = pressure
+        node_values[:, :, NODE_COLUMN['demand']] = demand
+
+        link_values = np.empty((len(self.link_ids), n_times, len(LINK_VARIABLES)), dtype=np.float32)
+        link_values[self.kept_links] = skeleton_results.link_values[self.kept_link_columns]
+        if len(self.derived_pipes):
+            difference = head[self.pipe_ends[:, 0]] - head[self.pipe_ends[:, 1]]
+            flow = np.sign(difference) * self.pipe_coefficients[:, None] * np.abs(difference) ** self.pipe_exponent
+            flow[self.pipe_closed] = 0
+            flow[self.pipe_check_valve] = np.maximum(flow[self.pipe_check_valve], 0)
+            derived = link_values[self.derived_pipes]
+            derived[:, :, LINK_COLUMN['flowrate']] = flow
+            derived[:, :, LINK_COLUMN['velocity']] = np.abs(flow) / self.pipe_areas[:, None]
+            # 与wntr结果一致：管道水头损失为单位管长的损失
+            derived[:, :, LINK_COLUMN['headloss']] = np.abs(difference) / self.pipe_lengths[:, None] * (flow != 0)
+            # 关闭的管道和无流量的止回阀管道为关闭状态
+            derived[:, :, LINK_COLUMN['status']] = (~self.pipe_closed)[:, None] & ~(self.pipe_check_valve[:, None] & (flow == 0))
+            derived[:, :, LINK_COLUMN['setting']] = self.pipe_roughness[:, None]
+            link_values[self.derived_pipes] = derived
+
+        return SimulationArrays(self.node_ids, self.link_ids, times, node_values, link_values)
+
+    def error_report(self, full_results, preview_results):
+        """
+        预览结果相对完整模型结果的误差（只计算一次）
+
+        返回:
+            dict: 骨架规模，以及压力、水头（m）和流量（m³/s）的最大、平均和95%分位绝对误差，
+                  压力误差最大的若干节点
+        """
+        with self._report_lock:
+            if self.report is not None:
+                return self.report
+            steps = min(len(full_results.times), len(preview_results.times))
+            report = {**self.summary, 'time_steps': steps}
+            for element, variables, index, full_values, preview_values in (
+                    ('node', ('pressure', 'head'), NODE_COLUMN, full_results.node_values, preview_results.node_values),
+                    ('link', ('flowrate',), LINK_COLUMN, full_results.link_values, preview_results.link_values)):
+                for name in variables:
+                    errors = np.abs(full_values[:, :steps, index[name]].astype(np.float64)
+                                    - preview_values[:, :steps, index[name]])
+                    report[name] = {
+                        'max_abs_error': round(float(np.nanmax(errors)), 6) if errors.size else 0.0,
+                        'mean_abs_error': round(float(np.nanmean(errors)), 6) if errors.size else 0.0,
+                        'p95_abs_error': round(float(np.nanpercentile(errors, 95)), 6) if errors.size else 0.0,
+                    }
+                    if name == 'pressure' and errors.size:
+                        worst = np.argsort(-np.nanmax(errors, axis=1))[:config.SKELETON_REPORT_WORST_NODES]
+                        report['worst_pressure_nodes'] = [
+                            {'node_id': self.node_ids[i], 'max_abs_error': round(float(np.nanmax(errors[i])), 6)}
+                            for i in worst.tolist()]
+            self.report = report
+            return report
+
+
+def get_skeleton(digest):
+    """获取管网版本的骨架（随模型缓存在 NETWORK_STORE 中）"""
+    threshold = config.SKELETON_DIAMETER_THRESHOLD
+    return NETWORK_STORE.get_artifact(digest, f"skeleton:{threshold:g}",
+                                      lambda wn: Skeleton(digest, wn, threshold))
+
+
+def run_preview_simulation(digest, options=None, inp_file_path=None):
+    """
+    在骨架化的管网上模拟并映射回原管网，结果与完整模拟一样按管网版本缓存
+
+    参数:
+        digest (str): 管网内容哈希（模型须已在 NETWORK_STORE 中）
+        options (dict): 模拟器选项，默认为 DEFAULT_SIM_OPTIONS
+        inp_file_path (str): 未使用，与 run_simulation 的参数保持一致
+
+    返回:
+        SimulationArrays: 原管网全部节点和管段的近似结果
+    """
+    options = options or DEFAULT_SIM_OPTIONS
+    skeleton = get_skeleton(digest)
+    # 缓存键以原管网哈希开头，原管网被修改时随之失效
+    key = SimulationCache.make_key(digest, {**options, 'preview': skeleton.diameter_threshold})
+    results = SIMULATION_CACHE.get(key)
+    if results is not None:
+        print(f"命中预览结果缓存: {key}")
+        return results
+
+    results = skeleton.expand(SIM_POOL.simulate(skeleton.ensure_loaded(), options))
+    SIMULATION_CACHE.put(key, results)
+    return results
+
+
+def preview_report(digest, options=None, inp_file_path=None):
+    """骨架预览相对完整模型的误差报告（需要运行一次完整模拟，结果会被缓存）"""
+    skeleton = get_skeleton(digest)
+    if skeleton.report is not None:
+        return skeleton.report
+    full_results = run_simulation(digest, options, inp_file_path=inp_file_path)
+    return skeleton.error_report(full_results, run_preview_simulation(digest, options))
+
+
+def preview_summary(digest):
+    """预览结果附带的说明：骨架规模，以及误差报告（尚未计算时为None）"""
+    skeleton = get_skeleton(digest)
+    return {**skeleton.summary, 'error_report': skeleton.report}
@@ -0,0 +1,232 @@
+"""
+管网拓扑的空间索引与视口查询
+
+每个管网版本构建一次（缓存在 NETWORK_STORE 中）：
+- 节点坐标按 /network-data 相同的方式归一化到0-1范围，视口查询也使用归一化坐标
+- 节点（点）和管段（两端点构成的线段的包围盒）各建一棵STR打包的静态R树：
+  按x排序切成若干竖条，条内按y排序，每 RTREE_NODE_SIZE 个元素打包为一个叶子，再逐层打包上层节点。
+  每个节点的子节点在下一层中连续存放，查询时逐层向量化地筛选，无需递归
+- 视口内元素较少或缩放级别足够大时返回元素明细，否则把节点按网格聚合为簇，
+  管段合并为簇之间的连线（见 SpatialIndex.viewport）
+"""
+import numpy as np
+
+import config
+from utils.network_store import NETWORK_STORE
+
+# R树每个节点的子节点数
+RTREE_NODE_SIZE = 16
+
+
+def _str_order(boxes, node_size):
+    """STR打包顺序：按中心x切成竖条，条内按中心y排序"""
+    count = len(boxes)
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    leaf_count = -(-count // node_size)
+    slice_count = int(np.ceil(np.sqrt(leaf_count)))
+    slice_size = slice_count * node_size
+    by_x = np.argsort(centers[:, 0], kind='stable')
+    parts = []
+    for start in range(0, count, slice_size):
+        part = by_x[start:start + slice_size]
+        parts.append(part[np.argsort(centers[part, 1], kind='stable')])
+    return np.concatenate(parts)
+
+
+def _group_bounds(boxes, node_size):
+    """每 node_size 个连续的包围盒合并为一个上层包围盒"""
+    starts = np.arange(0, len(boxes), node_size)
+    return np.concatenate([np.minimum.reduceat(boxes[:, :2], starts), np.maximum.reduceat(boxes[:, 2:], starts)], axis=1)
+
+
+class PackedRTree:
+    """STR打包的静态R树，元素为包围盒 [minx, miny, maxx, maxy]"""
+
+    def __init__(self, boxes, node_size=RTREE_NODE_SIZE):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.node_size = node_size
+        order = _str_order(boxes, node_size)
+        # 叶子层的元素按打包顺序存放，items[k] 为第k个位置上的元素序号
+        self.items = order
+        self.item_boxes = boxes[order]
+        # 上层节点按顺序每 node_size 个打包（叶子已按STR排列，相邻叶子在空间上也相邻）
+        # levels[0] 为根层；第i层第j个节点的子节点为下一层（或元素层）的 [j*node_size, (j+1)*node_size)
+        levels = []
+        current = self.item_boxes
+        while len(current) > 1 or not levels:
+            if len(current) == 0:
+                break
+            current = _group_bounds(current, node_size)
+            levels.append(current)
+        self.levels = levels[::-1]
+
+    def query(self, bbox):
+        """
+        与bbox相交的元素序号
+
+        参数:
+            bbox (tuple): (minx, miny, maxx, maxy)
+
+        返回:
+            ndarray: 元素序号（升序）
+        """
+        if not self.levels:
+            return np.zeros(0, dtype=np.int64)
+        minx, miny, maxx, maxy = bbox
+        candidates = np.arange(len(self.levels[0]))
+        for depth, boxes in enumerate(self.levels + [self.item_boxes]):
+            if depth > 0:
+                # 展开上一层留下的节点的子节点
+                children = (candidates[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+                candidates = children[children < len(boxes)]
+            selected = boxes[candidates]
+            hit = ((selected[:, 0] <= maxx) & (selected[:, 2] >= minx)
+                   & (selected[:, 1] <= maxy) & (selected[:, 3] >= miny))
+            candidates = candidates[hit]
+            if len(candidates) == 0:
+                return np.zeros(0, dtype=np.int64)
+        return np.sort(self.items[candidates])
+
+
+class SpatialIndex:
+    """管网节点和管段的空间索引（归一化坐标）"""
+
+    def __init__(self, wn):
+        self.node_ids = list(wn.node_name_list)
+        self.node_types = []
+        coordinates = np.zeros((len(self.node_ids), 2))
+        for i, node_id in enumerate(self.node_ids):
+            node = wn.get_node(node_id)
+            self.node_types.append(node.node_type)
+            if node.coordinates:
+                coordinates[i] = node.coordinates
+
+        # 与 /network-data 相同的归一化（坐标范围为0时按1处理）
+        if len(coordinates):
+            lower = coordinates.min(axis=0)
+            extent = coordinates.max(axis=0) - lower
+            extent[extent == 0] = 1
+            coordinates = (coordinates - lower) / extent
+        self.coordinates = coordinates
+
+        node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.link_ids = list(wn.link_name_list)
+        self.link_types = []
+        self.link_lengths = np.zeros(len(self.link_ids))
+        ends = np.zeros((len(self.link_ids), 2), dtype=np.int64)
+        for i, link_id in enumerate(self.link_ids):
+            link = wn.get_link(link_id)
+            self.link_types.append(link.link_type)
+            self.link_lengths[i] = getattr(link, 'length', 0) or 0
+            ends[i] = node_index[link.start_node_name], node_index[link.end_node_name]
+        self.link_ends = ends
+
+        self.node_tree = PackedRTree(np.concatenate([coordinates, coordinates], axis=1))
+        starts, stops = coordinates[ends[:, 0]], coordinates[ends[:, 1]]
+        self.link_tree = PackedRTree(np.concatenate([np.minimum(starts, stops), np.maximum(starts, stops)], axis=1))
+
+    def viewport(self, bbox, zoom):
+        """
+        视口查询
+
+        参数:
+            bbox (tuple): 归一化坐标的 (minx, miny, maxx, maxy)
+            zoom (int): 缩放级别，0为显示整个管网，每增加1级比例尺放大一倍
+
+        返回:
+            dict: 元素明细（mode为detail）或网格聚合结果（mode为aggregated）
+        """
+        nodes = self.node_tree.query(bbox)
+        links = self.link_tree.query(bbox)
+        if zoom >= config.VIEWPORT_DETAIL_ZOOM or len(nodes) + len(links) <= config.VIEWPORT_MAX_ELEMENTS:
+            return self._detail(nodes, links)
+        return self._aggregate(nodes, links, zoom)
+
+    def _detail(self, nodes, links):
+        coordinates = self.coordinates
+        return {
+            'mode': 'detail',
+            'nodes': [{'id': self.node_ids[i], 'node_type': self.node_types[i],
+                       'coordinates': coordinates[i].tolist()} for i in nodes.tolist()],
+            # 管段附带两端坐标，端点在视口外时前端也能直接绘制
+            'links': [{'id': self.link_ids[i], 'link_type': self.link_types[i],
+                       'source': self.node_ids[self.link_ends[i, 0]], 'target': self.node_ids[self.link_ends[i, 1]],
+                       'coordinates': [coordinates[self.link_ends[i, 0]].tolist(),
+                                       coordinates[self.link_ends[i, 1]].tolist()]} for i in links.tolist()],
+        }
+
+    def _aggregate(self, nodes, links, zoom):
+        """按网格把节点聚合为簇，管段合并为簇之间的连线；网格边长随缩放级别减半"""
+        cells_per_side = config.VIEWPORT_GRID_SIZE * 2 ** zoom
+        cell_size = 1.0 / cells_per_side
+        # 视口内的节点以及与视口相交的管段的端点都参与聚合
+        members = np.union1d(nodes, self.link_ends[links].ravel()).astype(np.int64)
+        # 坐标为1的节点归入最后一格
+        cells = np.minimum(np.floor(self.coordinates[members] * cells_per_side), cells_per_side - 1).astype(np.int64)
+        keys, cluster_of = np.unique(cells, axis=0, return_inverse=True)
+        cluster_of = cluster_of.ravel()
+        counts = np.bincount(cluster_of, minlength=len(keys))
+        centroids = np.stack([np.bincount(cluster_of, self.coordinates[members, k], len(keys)) for k in (0, 1)], axis=1)
+        centroids /= counts[:, None]
+
+        clusters = []
+        for k in range(len(keys)):
+            clusters.append({'coordinates': centroids[k].tolist(), 'count': int(counts[k]), 'node_types': {}})
+        for member, k in zip(members.tolist(), cluster_of.tolist()):
+            types = clusters[k]['node_types']
+            types[self.node_types[member]] = types.get(self.node_types[member], 0) + 1
+            if counts[k] == 1:
+                clusters[k]['id'] = self.node_ids[member]
+
+        # 管段按两端所在的簇合并，两端在同一簇内的管段不再单独显示
+        position = np.full(len(self.node_ids), -1, dtype=np.int64)
+        position[members] = cluster_of
+        ends = np.sort(position[self.link_ends[links]], axis=1)
+        between = ends[:, 0] != ends[:, 1]
+        pairs, bundle_of = np.unique(ends[between], axis=0, return_inverse=True)
+        bundle_of = bundle_of.ravel()
+        bundle_counts = np.bincount(bundle_of, minlength=len(pairs))
+        bundle_lengths = np.bincount(bundle_of, self.link_lengths[links[between]], len(pairs))
+        return {
+            'mode': 'aggregated',
+            'cell_size': cell_size,
+            'clusters': clusters,
+            # source/target 为 clusters 中的序号
+            'links': [{'source': int(a), 'target': int(b), 'count': int(c), 'length': round(float(length), 2)}
+                      for (a, b), c, length in zip(pairs.tolist(), bundle_counts.tolist(), bundle_lengths.tolist())],
+        }
+
+
+def get_spatial_index(digest):
+    """获取管网版本的空间索引（随模型缓存在 NETWORK_STORE 中）"""
+    return NETWORK_STORE.get_artifact(digest, 'spatial_index', SpatialIndex)
+
+
+def parse_viewport_args(args):
+    """
+    解析视口查询参数 bbox=minx,miny,maxx,maxy（归一化坐标，默认整个管网）和 zoom（默认0）
+
+    返回:
+        tuple: (bbox, zoom)，参数不合法时抛出ValueError
+    """
+    bbox = args.get('bbox')
+    if bbox is None:
+        bbox = (0.0, 0.0, 1.0, 1.0)
+    else:
+        try:
+            bbox = tuple(float(value) for value in bbox.split(','))
+        except ValueError:
+            raise ValueError("bbox 必须是 minx,miny,maxx,maxy 形式的4个数值")
+        if len(bbox) != 4 or not all(np.isfinite(bbox)):
+            raise ValueError("bbox 必须是 minx,miny,maxx,maxy 形式的4个数值")
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("bbox 要求 minx <= maxx 且 miny <= maxy")
+    try:
+        zoom = int(args.get('zoom', 0))
+    except ValueError:
+        raise ValueError("zoom 必须是整数")
+    if zoom < 0 or zoom > config.VIEWPORT_MAX_ZOOM:
+        raise ValueError(f"zoom 必须在0到{config.VIEWPORT_MAX_ZOOM}之间")
+    return bbox, zoom